@@ -0,0 +1,260 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+
+import copy_stream
+import data_generator
+import postgres
+import stats_snapshot
+from data_generator import DataGenerator
+
+DEFAULT_FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               'resources', 'Tennis_ATP', 'atp_2020_stats.json.gz')
+DEFAULT_SYNTHETIC_ROWS = 100000
+DEFAULT_SEED = 1
+SYNTHETIC_SCHEMA = 'benchmark'
+
+examples = '''How to use benchmark.py:
+
+  python benchmark.py
+  \t-> Generates the data of the bundled Tennis_ATP statistics and of one synthetic table per data type in memory,
+  \t   without a database, and prints the rows/s, bytes/s and peak memory of every run as JSON
+
+  python benchmark.py -mf 1 10 -jobs 1 4 -output before.json
+  \t-> Runs every combination of the multiplication factors 1 and 10 with 1 and 4 worker processes,
+  \t   and writes the results to "before.json" to compare them with a later run'''
+
+
+def main():
+    args = parse_arguments()
+
+    fixture = stats_snapshot.load_snapshot(args.fixture)
+    if fixture is None:
+        sys.exit(f'The statistics fixture "{args.fixture}" could not be loaded.')
+
+    suites = {
+        "tennis": fixture["table_information"],
+        "data_types": synthetic_table_information(args.rows)
+    }
+
+    results = {
+        "commit": current_commit(),
+        "python": platform.python_version(),
+        "numpy": numpy.__version__,
+        "seed": args.seed,
+        "runs": list()
+    }
+
+    for suite_name, table_information in suites.items():
+        for multiplication_factor in args.mf:
+            for jobs in args.jobs:
+                run = benchmark_run(table_information, multiplication_factor, jobs, args.seed)
+                run["suite"] = suite_name
+                results["runs"].append(run)
+
+                print(f'{suite_name}, mf {multiplication_factor}, {jobs} job(s): {run["rows"]} rows in '
+                      f'{run["seconds"]:.2f}s, {run["rows_per_second"]:.0f} rows/s, '
+                      f'{run["bytes_per_second"] / 1024 / 1024:.1f} MiB/s', file=sys.stderr)
+
+    # The peak resident memory of this process and of the worker processes, in kilobytes
+    results["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results["peak_worker_rss_kb"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Measures the generation speed without a database', epilog=examples,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-mf', '--mf', type=float, nargs='+', default=[1.0],
+                        help='Multiplication factors to benchmark (default: 1.0)')
+    parser.add_argument('-jobs', '--jobs', type=int, nargs='+', default=[1],
+                        help='Numbers of worker processes to benchmark (default: 1)')
+    parser.add_argument('-rows', '--rows', type=int, default=DEFAULT_SYNTHETIC_ROWS,
+                        help=f'Rows of every synthetic data type table at -mf 1 (default: {DEFAULT_SYNTHETIC_ROWS})')
+    parser.add_argument('-fixture', '--fixture', type=str, default=DEFAULT_FIXTURE,
+                        help='Statistics snapshot to generate from (default: the bundled Tennis_ATP statistics)')
+    parser.add_argument('-seed', '--seed', type=int, default=DEFAULT_SEED,
+                        help=f'Seed for the random generators (default: {DEFAULT_SEED})')
+    parser.add_argument('-output', '--output', type=str, help='Writes the results to a JSON file instead of stdout')
+
+    return parser.parse_args()
+
+
+def benchmark_run(table_information, multiplication_factor, jobs, seed):
+    generator = DataGenerator()
+    generator.table_information = table_information
+    generator.seed = seed
+
+    start_time = time.perf_counter()
+    table_models = [table_model for table_model in
+                    (generator.create_table_model(multiplication_factor, table_name)
+                     for table_name in table_information) if table_model is not None]
+    model_seconds = time.perf_counter() - start_time
+
+    tables = {table_model["table_name"]: {"rows": 0, "bytes": 0, "seconds": 0.0,
+                                          "data_types": sorted(set(table_model["column_types"]))}
+              for table_model in table_models}
+
+    # The waves are kept so that the foreign keys are generated from the referenced tables like in a real run
+    remaining_chunks = {table_model["table_name"]: len(table_model["chunks"]) for table_model in table_models}
+    for wave in data_generator.dependency_waves(table_models):
+        generator.attach_foreign_keys(None, wave, remaining_chunks, table_models)
+
+        for table_name, rows, encoded_bytes, seconds in generate_chunks(wave, seed, jobs):
+            remaining_chunks[table_name] -= 1
+            tables[table_name]["rows"] += rows
+            tables[table_name]["bytes"] += encoded_bytes
+            tables[table_name]["seconds"] += seconds
+
+    seconds = time.perf_counter() - start_time
+    rows = sum(table["rows"] for table in tables.values())
+    encoded_bytes = sum(table["bytes"] for table in tables.values())
+
+    for table in tables.values():
+        table["rows_per_second"] = table["rows"] / table["seconds"] if table["seconds"] else 0.0
+        table["bytes_per_second"] = table["bytes"] / table["seconds"] if table["seconds"] else 0.0
+
+    return {
+        "mf": multiplication_factor,
+        "jobs": jobs,
+        "rows": rows,
+        "bytes": encoded_bytes,
+        "seconds": seconds,
+        "model_seconds": model_seconds,
+        "rows_per_second": rows / seconds if seconds else 0.0,
+        "bytes_per_second": encoded_bytes / seconds if seconds else 0.0,
+        "tables": tables
+    }
+
+
+def generate_chunks(table_models, seed, jobs):
+    chunk_tasks = [(table_model["table_name"], chunk_index)
+                   for table_model in table_models
+                   for chunk_index in range(len(table_model["chunks"]))]
+
+    if jobs > 1 and len(chunk_tasks) > 1:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=initialize_worker,
+                                 initargs=(table_models, seed)) as executor:
+            yield from executor.map(generate_chunk, *zip(*chunk_tasks))
+    else:
+        initialize_worker(table_models, seed)
+        for chunk_task in chunk_tasks:
+            yield generate_chunk(*chunk_task)
+
+
+worker_models = None
+worker_seed = None
+
+
+def initialize_worker(table_models, seed):
+    global worker_models, worker_seed
+    worker_models = {table_model["table_name"]: table_model for table_model in table_models}
+    worker_seed = seed
+
+
+# Generates and encodes a chunk like a load into the database does, but drops the encoded rows
+def generate_chunk(table_name, chunk_index):
+    table_model = worker_models[table_name]
+    chunk_offset, chunk_rows = table_model["chunks"][chunk_index]
+    rng = data_generator.create_rng(worker_seed, table_name, *table_model["chunk_stream"], chunk_index)
+
+    start_time = time.perf_counter()
+    encoded_bytes = 0
+    for columns in data_generator.generate_batches(table_model["column_samplers"], chunk_rows, rng, chunk_offset):
+        encoded_bytes += len(copy_stream.encode_columns(columns))
+
+    return table_name, chunk_rows, encoded_bytes, time.perf_counter() - start_time
+
+
+# One table per data type, each with a unique column, a skewed column with most common values and a histogram,
+# a low cardinality column and a column without statistics
+def synthetic_table_information(row_count):
+    column_types = {
+        "integer": dict(data_type='integer', numeric_precision=32, numeric_precision_radix=2, numeric_scale=0),
+        "numeric": dict(data_type='numeric', numeric_precision=12, numeric_precision_radix=10, numeric_scale=2),
+        "text": dict(data_type='character varying', max_length=40),
+        "date": dict(data_type='date'),
+        "timestamp": dict(data_type='timestamp without time zone'),
+        "boolean": dict(data_type='boolean')
+    }
+
+    table_information = dict()
+    for type_name, column_type in column_types.items():
+        column_information = dict()
+        pg_stats = dict()
+
+        for column_name, n_distinct in (('unique_values', -1.0), ('skewed_values', -0.2), ('few_values', 20.0),
+                                        ('no_stats', None)):
+            column_information[column_name] = dict(column_type, column_name=column_name, nullable=True)
+            if n_distinct is not None:
+                pg_stats[column_name] = synthetic_column_stats(type_name, column_name, n_distinct)
+
+        table_name = postgres.qualified_name(SYNTHETIC_SCHEMA, type_name)
+        table_information[table_name] = {
+            "identifier": (SYNTHETIC_SCHEMA, type_name),
+            "column_information": column_information,
+            "pg_stats": pg_stats,
+            "foreign_keys": [],
+            "partition_levels": [],
+            "unique_keys": [],
+            "row_count": row_count,
+            "value_ranges": {}
+        }
+
+    return table_information
+
+
+def synthetic_column_stats(type_name, column_name, n_distinct):
+    if type_name == 'boolean':
+        values, histogram_bounds = ['t', 'f'], None
+    elif type_name in ('integer', 'numeric'):
+        values = [str(value * 7) for value in range(10)]
+        histogram_bounds = [str(value ** 2) for value in range(101)]
+    elif type_name == 'text':
+        values = ['Zurich', 'Geneva', 'Basel', 'Lausanne', 'Bern', 'Winterthur', 'Lucerne', 'Lugano', 'Biel', 'Thun']
+        histogram_bounds = ['Aarau', 'Baden', 'Chur', 'Frauenfeld', 'Olten', 'Schaffhausen', 'Sion', 'Zug']
+    else:
+        values = [f'2019-0{month}-01' for month in range(1, 10)]
+        histogram_bounds = [f'{year}-01-01' for year in range(1990, 2021)]
+        if type_name == 'timestamp':
+            values = [f'{value} 12:00:00' for value in values]
+            histogram_bounds = [f'{bound} 00:00:00' for bound in histogram_bounds]
+
+    skewed = column_name == 'skewed_values'
+    most_common_freqs = [0.3 / (index + 1) for index in range(len(values))] if skewed else None
+
+    return {
+        "column_name": column_name,
+        "null_frac": 0.05 if skewed else 0.0,
+        "avg_width": 11,
+        "n_distinct": n_distinct,
+        "most_common_vals": values if skewed else None,
+        "most_common_freqs": most_common_freqs,
+        "histogram_bounds": histogram_bounds,
+        "correlation": 0.0
+    }
+
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+import json
+import sys
+
+import psycopg2
+from psycopg2 import sql
+
+CHECKPOINT_SCHEMA = 'pgsynthdata'
+
+# The run table holds a single row with the seed, the settings and the fingerprint of the statistics of the run,
+# the chunks table one row per chunk, written in the same transaction as the chunk's rows. The statistics
+# themselves are never stored in the generated database, they hold the values of the source database.
+# The run is kept once it is finished, so that -incremental can grow the database from the same seed
+CHECKPOINT_TABLES = """
+    CREATE SCHEMA IF NOT EXISTS {schema};
+    CREATE TABLE IF NOT EXISTS {schema}.run (
+        seed        numeric NOT NULL,
+        settings    jsonb NOT NULL,
+        fingerprint text NOT NULL,
+        started_at  timestamptz NOT NULL DEFAULT now(),
+        finished_at timestamptz
+    );
+    CREATE TABLE IF NOT EXISTS {schema}.chunks (
+        table_name   text NOT NULL,
+        chunk_index  integer NOT NULL,
+        chunk_offset bigint NOT NULL,
+        chunk_rows   bigint NOT NULL,
+        seed         numeric NOT NULL,
+        loaded_at    timestamptz NOT NULL DEFAULT now(),
+        PRIMARY KEY (table_name, chunk_index)
+    );"""
+
+
+# The fingerprint is made by stats_snapshot.statistics_fingerprint
+def save_run(connection, seed, settings, fingerprint):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql.SQL(CHECKPOINT_TABLES).format(schema=sql.Identifier(CHECKPOINT_SCHEMA)))
+            cursor.execute(sql.SQL("INSERT INTO {} (seed, settings, fingerprint) VALUES (%s, %s, %s)").format(
+                sql.Identifier(CHECKPOINT_SCHEMA, 'run')), (seed, json.dumps(settings), fingerprint))
+        connection.commit()
+    except psycopg2.DatabaseError as error:
+        sys.exit('Could not create the checkpoint tables. Error description: {0}'.format(error))
+
+
+# Returns the seed, the settings, the fingerprint of the statistics and whether the run is finished,
+# or None without a checkpoint
+def load_run(connection):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s)", (f'{CHECKPOINT_SCHEMA}.run',))
+            if cursor.fetchone()[0] is None:
+                return None
+
+            cursor.execute(sql.SQL("SELECT seed, settings, fingerprint, finished_at IS NOT NULL FROM {}").format(
+                sql.Identifier(CHECKPOINT_SCHEMA, 'run')))
+            run = cursor.fetchone()
+        connection.commit()
+    except psycopg2.DatabaseError as error:
+        sys.exit('Could not read the checkpoint. Error description: {0}'.format(error))
+
+    if run is None:
+        return None
+
+    return int(run[0]), run[1], run[2], run[3]
+
+
+def get_loaded_chunks(connection):
+    loaded_chunks = dict()
+
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql.SQL("SELECT table_name, chunk_index FROM {}").format(
+                sql.Identifier(CHECKPOINT_SCHEMA, 'chunks')))
+            for table_name, chunk_index in cursor.fetchall():
+                loaded_chunks.setdefault(table_name, set()).add(chunk_index)
+        connection.commit()
+    except psycopg2.DatabaseError as error:
+        sys.exit('Could not read the checkpoint. Error description: {0}'.format(error))
+
+    return loaded_chunks
+
+
+# Called in the transaction of the chunk, so that a chunk is recorded if and only if its rows are committed
+def record_chunk(cursor, table_name, chunk_index, chunk_offset, chunk_rows, seed):
+    cursor.execute(sql.SQL("INSERT INTO {} (table_name, chunk_index, chunk_offset, chunk_rows, seed) "
+                           "VALUES (%s, %s, %s, %s, %s)").format(sql.Identifier(CHECKPOINT_SCHEMA, 'chunks')),
+                   (table_name, chunk_index, chunk_offset, chunk_rows, seed))
+
+
+# The chunks are only needed to resume the run, the run itself is kept for -incremental
+def finish_run(connection):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql.SQL("UPDATE {} SET finished_at = now()").format(
+                sql.Identifier(CHECKPOINT_SCHEMA, 'run')))
+            cursor.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(CHECKPOINT_SCHEMA, 'chunks')))
+        connection.commit()
+    except psycopg2.DatabaseError as error:
+        print(f'Could not mark the run as finished in the "{CHECKPOINT_SCHEMA}" schema. Error description: {error}')
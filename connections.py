@@ -0,0 +1,101 @@
+import os
+import threading
+from contextlib import contextmanager
+
+from psycopg2 import extensions
+from psycopg2.pool import ThreadedConnectionPool
+
+DEFAULT_POOL_SIZE = 1
+
+# Session settings of the command line, in the order of their arguments
+SESSION_SETTINGS = ['work_mem', 'maintenance_work_mem']
+
+# The pools of this process by their connection settings. A forked worker process never uses or closes
+# the pools it inherited, their connections belong to the parent process
+pools = dict()
+pools_lock = threading.Lock()
+
+
+def connection_settings(args, db_name, **session_settings):
+    settings = dict(dbname=db_name, user=args.user, host=args.hostname, port=args.port, password=args.password)
+    options = session_options(args, **session_settings)
+    if options:
+        settings["options"] = options
+
+    return settings
+
+
+# The settings are applied by the server to every new session, as libpq options
+def session_options(args, **session_settings):
+    settings = {setting: getattr(args, setting, None) for setting in SESSION_SETTINGS}
+    settings.update(session_settings)
+
+    return ' '.join(f'-c {setting}={value}' for setting, value in settings.items() if value is not None)
+
+
+# The settings of -targets keep the options of their DSN, the session settings are added to them
+def with_session_options(settings, options):
+    if not options:
+        return settings
+
+    return dict(settings, options=' '.join(filter(None, [settings.get("options"), options])))
+
+
+# A connection pool whose borrowers wait for a free connection instead of failing, so that it can be shared
+# by the threads of a process. The connections are opened on first use and reused across tables
+class ConnectionPool:
+    def __init__(self, settings, size):
+        self.settings = settings
+        self.size = size
+        self.pool = ThreadedConnectionPool(0, size, **settings)
+        self.free_slots = threading.BoundedSemaphore(size)
+        self.pid = os.getpid()
+
+    @contextmanager
+    def connection(self, autocommit=False):
+        with self.free_slots:
+            connection = self.pool.getconn()
+            try:
+                connection.autocommit = autocommit
+                yield connection
+            finally:
+                broken = connection.closed or \
+                    connection.info.transaction_status == extensions.TRANSACTION_STATUS_UNKNOWN
+                if not broken:
+                    if connection.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                        connection.rollback()
+                    connection.autocommit = False
+                self.pool.putconn(connection, close=broken)
+
+    def close(self):
+        self.pool.closeall()
+
+
+# Returns the pool of this process for the settings, the size of its first use wins
+def get_pool(settings, size=DEFAULT_POOL_SIZE):
+    key = (os.getpid(), tuple(sorted((name, str(value)) for name, value in settings.items() if value is not None)))
+    with pools_lock:
+        if key not in pools:
+            pools[key] = ConnectionPool({name: value for name, value in settings.items() if value is not None},
+                                        max(size, 1))
+
+        return pools[key]
+
+
+# Borrows a connection of the pool, or gives None without a pool
+@contextmanager
+def borrow(pool, autocommit=False):
+    if pool is None:
+        yield None
+    else:
+        with pool.connection(autocommit) as connection:
+            yield connection
+
+
+def close_pools():
+    with pools_lock:
+        for key, pool in list(pools.items()):
+            if pool.pid == os.getpid():
+                pool.close()
+                del pools[key]
+
@@ -0,0 +1,180 @@
+import csv
+import decimal
+import gzip
+import importlib.util
+import io
+import os
+import struct
+
+import numpy
+
+PGCOPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+PGCOPY_TRAILER = struct.pack('>h', -1)
+NULL_FIELD = struct.pack('>i', -1)
+POSTGRES_EPOCH = numpy.datetime64('2000-01-01T00:00:00', 'us')
+
+FILE_EXTENSIONS = {
+    'binary': 'pgcopy',
+    'csv': 'csv'
+}
+
+COMPRESSION_EXTENSIONS = {
+    None: '',
+    'gzip': '.gz',
+    'zstd': '.zst'
+}
+
+ZSTD_MISSING = 'The zstd compression needs the "zstandard" package, please install it or use gzip.'
+
+# Types whose binary representation is a fixed-width big-endian value
+FIXED_WIDTH_FORMATS = {
+    'smallint': '>i2',
+    'integer': '>i4',
+    'bigint': '>i8',
+    'boolean': '?',
+    'bool': '?',
+    'date': '>i4',
+    'timestamp': '>i8',
+    'timestamp without time zone': '>i8'
+}
+
+
+# The rows of a partition that is loaded through its partitioned table go into files named after both tables
+def chunk_file_path(output_settings, table_model, chunk_index):
+    table_names = list(table_model["load_identifier"])
+    if table_model["load_identifier"] != table_model["identifier"]:
+        table_names.append(table_model["identifier"][1])
+
+    file_name = '{0}.{1:05d}.{2}{3}'.format('.'.join(table_names), chunk_index,
+                                            FILE_EXTENSIONS[output_settings["format"]],
+                                            COMPRESSION_EXTENSIONS[output_settings["compression"]])
+
+    return os.path.join(output_settings["directory"], file_name)
+
+
+# Checked before the run starts, the workers only raise an ImportError
+def compression_available(compression):
+    if compression == 'zstd':
+        return importlib.util.find_spec('zstandard') is not None
+
+    return True
+
+
+def open_output_file(path, compression):
+    if compression == 'gzip':
+        return gzip.open(path, 'wb', compresslevel=1)
+    elif compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError as error:
+            raise ImportError(ZSTD_MISSING) from error
+
+        return zstandard.ZstdCompressor().stream_writer(open(path, 'wb'))
+
+    return open(path, 'wb')
+
+
+# Every chunk of a table goes into a file of its own, so the workers never share a file
+# and the files are rotated every CHUNK_SIZE rows. Returns the number of bytes before the compression
+def write_chunk(output_settings, table_model, chunk_index, batches):
+    path = chunk_file_path(output_settings, table_model, chunk_index)
+    written_bytes = 0
+
+    with open_output_file(path, output_settings["compression"]) as output_file:
+        if output_settings["format"] == 'csv':
+            written_bytes += output_file.write(encode_csv_rows([table_model["column_names"]]))
+            for columns in batches:
+                written_bytes += output_file.write(encode_csv_rows(zip(*[column.tolist() for column in columns])))
+        else:
+            written_bytes += output_file.write(PGCOPY_HEADER)
+            for columns in batches:
+                written_bytes += output_file.write(encode_binary_rows(columns, table_model["column_types"]))
+            written_bytes += output_file.write(PGCOPY_TRAILER)
+
+    return written_bytes
+
+
+def encode_csv_rows(rows):
+    text = io.StringIO()
+    csv.writer(text).writerows(rows)
+
+    return text.getvalue().encode('utf-8')
+
+
+def encode_binary_rows(columns, column_types):
+    fields = [encode_binary_column(column, column_type) for column, column_type in zip(columns, column_types)]
+    row_header = struct.pack('>h', len(fields))
+
+    return b''.join(row_header + b''.join(row) for row in zip(*fields))
+
+
+# Encodes a column vector into its binary COPY fields, each one prefixed by its length
+def encode_binary_column(values, column_type):
+    null_rows = numpy.array([value is None for value in values], dtype=bool) if values.dtype == object \
+        else numpy.zeros(len(values), dtype=bool)
+    present_values = values[~null_rows]
+
+    if column_type in FIXED_WIDTH_FORMATS:
+        value_format = numpy.dtype(FIXED_WIDTH_FORMATS[column_type])
+        fields = numpy.empty(len(present_values), dtype=[('length', '>i4'), ('value', value_format)])
+        fields['length'] = value_format.itemsize
+        fields['value'] = binary_values(present_values, column_type)
+        encoded = fields.view(f'V{fields.dtype.itemsize}').tolist()
+    elif column_type in ('decimal', 'numeric'):
+        encoded = [length_prefixed(encode_numeric(value)) for value in present_values.tolist()]
+    else:
+        encoded = [length_prefixed(str(value).encode('utf-8')) for value in present_values.tolist()]
+
+    if not null_rows.any():
+        return encoded
+
+    column_fields = numpy.full(len(values), NULL_FIELD, dtype=object)
+    column_fields[~null_rows] = encoded
+
+    return column_fields.tolist()
+
+
+def binary_values(values, column_type):
+    if column_type == 'date':
+        return (numpy.array(values.tolist(), dtype='datetime64[D]') - POSTGRES_EPOCH.astype('datetime64[D]')) \
+            .astype(numpy.int64)
+    elif column_type in ('timestamp', 'timestamp without time zone'):
+        return (numpy.array(values.tolist(), dtype='datetime64[us]') - POSTGRES_EPOCH).astype(numpy.int64)
+    elif column_type in ('boolean', 'bool'):
+        return values.astype(bool)
+
+    return values.astype(numpy.int64)
+
+
+def length_prefixed(data):
+    return struct.pack('>i', len(data)) + data
+
+
+# numeric is sent as base 10000 digits with the weight of the first one, a sign and the display scale
+def encode_numeric(value):
+    sign, digits, exponent = decimal.Decimal(str(value)).as_tuple()
+    digits = ''.join(str(digit) for digit in digits)
+    display_scale = max(-exponent, 0)
+
+    if exponent >= 0:
+        integer_part, fraction_part = digits + '0' * exponent, ''
+    elif len(digits) + exponent > 0:
+        integer_part, fraction_part = digits[:exponent], digits[exponent:]
+    else:
+        integer_part, fraction_part = '', '0' * -(len(digits) + exponent) + digits
+
+    integer_part = integer_part.zfill(-(-len(integer_part) // 4) * 4)
+    fraction_part = fraction_part.ljust(-(-len(fraction_part) // 4) * 4, '0')
+    groups = [int(integer_part[index:index + 4]) for index in range(0, len(integer_part), 4)]
+    groups += [int(fraction_part[index:index + 4]) for index in range(0, len(fraction_part), 4)]
+    weight = len(integer_part) // 4 - 1
+
+    while groups and groups[0] == 0:
+        groups.pop(0)
+        weight -= 1
+    while groups and groups[-1] == 0:
+        groups.pop()
+    if not groups:
+        weight = 0
+
+    return struct.pack(f'>hhHh{len(groups)}h', len(groups), weight, 0x4000 if sign else 0, display_scale, *groups)
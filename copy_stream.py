@@ -0,0 +1,184 @@
+import queue
+import threading
+
+COPY_NULL = '\\N'
+COPY_BUFFER_SIZE = 64 * 1024
+DEFAULT_QUEUE_DEPTH = 4
+# How often a blocked producer checks whether it was cancelled, in seconds
+QUEUE_TIMEOUT = 0.1
+END_OF_BATCHES = None
+
+# Characters that have to be backslash-escaped in the COPY text format
+COPY_ESCAPES = str.maketrans({
+    '\\': '\\\\',
+    '\t': '\\t',
+    '\n': '\\n',
+    '\r': '\\r'
+})
+
+
+# Raised into a COPY whose stream was cancelled while the COPY was still reading from it
+class CopyCancelled(Exception):
+    pass
+
+
+def encode_value(value):
+    if value is None:
+        return COPY_NULL
+    if value is True:
+        return 't'
+    if value is False:
+        return 'f'
+
+    return str(value).translate(COPY_ESCAPES)
+
+
+def encode_row(row):
+    return ('\t'.join(encode_value(value) for value in row) + '\n').encode('utf-8')
+
+
+def encode_columns(columns):
+    return b''.join(encode_row(row) for row in zip(*[column.tolist() for column in columns]))
+
+
+# File-like object that encodes the rows into the COPY text format on demand,
+# so that at most one buffer of encoded rows is kept in memory at any time
+class CopyStream:
+    def __init__(self, rows, buffer_size=COPY_BUFFER_SIZE):
+        self.rows = iter(rows)
+        self.buffer_size = buffer_size
+        self.buffer = bytearray()
+        self.exhausted = False
+        self.sent_bytes = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.buffer_size
+
+        while not self.exhausted and len(self.buffer) < size:
+            try:
+                self.buffer += encode_row(next(self.rows))
+            except StopIteration:
+                self.exhausted = True
+
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        self.sent_bytes += len(data)
+        return data
+
+
+# Overlaps the generation with the COPY: a producer thread generates and encodes the batches of columns
+# into a bounded queue while the COPY drains it. A full queue blocks the producer (backpressure),
+# and closing the stream cancels the producer, e.g. when the COPY failed.
+# Without batches the stream is only the reading end of a queue, which another producer fills
+class PipelinedCopyStream:
+    def __init__(self, batches, queue_depth=DEFAULT_QUEUE_DEPTH, cancelled=None):
+        self.queue = queue.Queue(maxsize=queue_depth)
+        self.cancelled = cancelled or threading.Event()
+        self.error = None
+        self.buffer = bytearray()
+        self.exhausted = False
+        self.sent_bytes = 0
+        self.producer = None
+        if batches is not None:
+            self.producer = threading.Thread(target=self.produce, args=(batches,), daemon=True)
+            self.producer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def produce(self, batches):
+        try:
+            for columns in batches:
+                if not self.put(encode_columns(columns)):
+                    return
+        except Exception as error:
+            self.error = error
+        self.put(END_OF_BATCHES)
+
+    def put(self, data):
+        while not self.cancelled.is_set():
+            try:
+                self.queue.put(data, timeout=QUEUE_TIMEOUT)
+                return True
+            except queue.Full:
+                continue
+
+        return False
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = COPY_BUFFER_SIZE
+
+        while not self.exhausted and len(self.buffer) < size:
+            try:
+                data = self.queue.get(timeout=QUEUE_TIMEOUT)
+            except queue.Empty:
+                if self.cancelled.is_set():
+                    raise CopyCancelled('The COPY was cancelled')
+                continue
+
+            if data is END_OF_BATCHES:
+                self.exhausted = True
+                if self.error is not None:
+                    raise self.error
+            else:
+                self.buffer += data
+
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        self.sent_bytes += len(data)
+        return data
+
+    def close(self):
+        self.cancelled.set()
+        if self.producer is not None:
+            self.producer.join()
+
+
+# Fans the batches of columns out to one PipelinedCopyStream per target. The batches are generated and routed
+# by a single producer thread: route gives the target of every row, or is None to send every row to all targets.
+# All the streams share one cancellation, so that a failed COPY stops the producer and the other COPYs
+class FanOutCopyStreams:
+    def __init__(self, batches, route, target_count, queue_depth=DEFAULT_QUEUE_DEPTH):
+        self.cancelled = threading.Event()
+        self.streams = [PipelinedCopyStream(None, max(queue_depth, 1), self.cancelled) for _ in range(target_count)]
+        self.producer = threading.Thread(target=self.produce, args=(batches, route), daemon=True)
+        self.producer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def produce(self, batches, route):
+        try:
+            for columns in batches:
+                if route is None:
+                    data = encode_columns(columns)
+                    target_data = [data] * len(self.streams)
+                else:
+                    targets = route(columns)
+                    target_data = [encode_columns([column[targets == index] for column in columns])
+                                   for index in range(len(self.streams))]
+
+                for stream, data in zip(self.streams, target_data):
+                    if not stream.put(data):
+                        return
+        except Exception as error:
+            for stream in self.streams:
+                stream.error = error
+
+        for stream in self.streams:
+            stream.put(END_OF_BATCHES)
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def close(self):
+        self.cancelled.set()
+        self.producer.join()
@@ -1,17 +1,48 @@
+import copy
 import datetime
-import random
+import math
+import os
 import sys
+import time
+import zlib
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from typing import Dict
 
 import numpy
 import psycopg2
-from psycopg2 import sql
 
+import checkpoints
+import connections
+import copy_files
+import copy_stream
+import instrumentation
 import postgres
-import utils
+import samplers
+import server_side
+import sharding
+import stats_snapshot
 
 DEFAULT_NUMBER_OF_ROWS = 100
+BATCH_SIZE = 10000
+CHUNK_SIZE = 100000
+
+MODEL_STREAM = 0
+CHUNK_STREAM = 1
+FOREIGN_KEY_STREAM = 2
+TOP_UP_STREAM = 3
 RANDOM_WORD_LENGTH = 15
+# Key columns whose values are stored in their order are generated in order
+ORDERED_CORRELATION = 0.9
+# The key domains have room for this many times the rows of the source, so that the keys of a row
+# are spelled the same whatever the multiplication factor
+KEY_GROWTH = 1000
+
+INTEGER_MAXIMUMS = {
+    'smallint': 2 ** 15 - 1,
+    'integer': 2 ** 31 - 1,
+    'bigint': 2 ** 63 - 1
+}
 
 START_DATE = datetime.date(year=1950, month=1, day=1)
 END_DATE = datetime.date.today()
@@ -19,102 +50,450 @@ END_DATE = datetime.date.today()
 
 class DataGenerator:
     table_information: Dict = {}
+    seed = None
+    rng = None
+    key_tables: Dict = {}
 
     def  generate(self, args):
-        print(f'Preparing the generation of synthetic data into the "{args.DBNAMEGEN}" database...')
+        if args.output_dir:
+            target = f'the "{args.output_dir}" directory'
+        elif args.targets:
+            target = f'{len(args.targets)} target databases'
+        else:
+            target = f'the "{args.DBNAMEGEN}" database'
+        print(f'Preparing the generation of synthetic data into {target}...')
+
+        connection_settings = connections.connection_settings(
+            args, args.DBNAMEGEN, synchronous_commit='off' if args.fast_load else None)
+
+        # Every chunk loaded into the target is checkpointed, except into UNLOGGED tables which do not
+        # survive a crash of the server. Top-ups are not, running them again tops up the rows that are still missing
+        load_settings = dict(server_side=args.server_side,
+                             queue_depth=args.queue_depth,
+                             checkpoint=not (args.output_dir or args.fast_load or args.incremental or args.targets),
+                             pool_size=args.pool_size,
+                             output=None,
+                             targets=None)
+        if args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+            load_settings["output"] = dict(directory=args.output_dir,
+                                           format=args.output_format,
+                                           compression=args.compress)
+        elif args.targets:
+            load_settings["targets"] = [
+                connections.with_session_options(settings, connections.session_options(args))
+                for settings in sharding.target_settings(args.targets, user=args.user, host=args.hostname,
+                                                         port=args.port, password=args.password)]
+            load_settings["sharding"] = dict(mode=args.shard_mode, column=args.shard_column, bounds=args.shard_bounds)
+
+        # Without a single target database the foreign keys are generated from the referenced models.
+        # The connections to the target are borrowed from the pool that the chunks are loaded with
+        key_pool = None
+        if load_settings["output"] is None and load_settings["targets"] is None:
+            key_pool = connections.get_pool(connection_settings, args.pool_size)
+            try:
+                with key_pool.connection():
+                    pass
+            except psycopg2.DatabaseError as error:
+                sys.exit('Could not connect to the "{0}" database. Error description: {1}'.format(
+                    args.DBNAMEGEN, error))
+
+        recorder = instrumentation.recorder
+        multiplication_factor = args.mf
+        loaded_chunks = dict()
+
+        run = None
+        if args.resume or args.incremental:
+            with recorder.phase('read checkpoint'), key_pool.connection() as key_connection:
+                run = checkpoints.load_run(key_connection)
+
+        if args.resume:
+            with recorder.phase('read checkpoint'):
+                if run is None or run[3]:
+                    sys.exit(f'The "{args.DBNAMEGEN}" database has no checkpoint of an unfinished run to resume.')
+
+                seed, settings, fingerprint, _ = run
+                check_run_arguments(args, seed, settings, 'resumed')
+
+                # The resumed run generates from the settings and statistics of the interrupted one
+                multiplication_factor = settings["mf"]
+                load_settings["server_side"] = settings["server_side"]
+                table_names = self.read_run_statistics(args, seed, settings, fingerprint, 'resumed')
+                with key_pool.connection() as key_connection:
+                    loaded_chunks = checkpoints.get_loaded_chunks(key_connection)
+            print(f'Resuming the run with the seed {self.seed}, {sum(map(len, loaded_chunks.values()))} chunk(s) '
+                  f'are already loaded.')
+        elif run is not None:
+            if not run[3]:
+                sys.exit(f'The run into the "{args.DBNAMEGEN}" database is unfinished, resume it with "-resume" '
+                         f'before topping it up.')
+
+            # The top-up generates from the seed and the statistics of the run that created the database
+            seed, settings, fingerprint, _ = run
+            check_run_arguments(args, seed, settings, 'topped up')
+            load_settings["server_side"] = settings["server_side"]
+            table_names = self.read_run_statistics(args, seed, settings, fingerprint, 'topped up')
+            print(f'Topping up the run with the seed {self.seed} to the multiplication factor {args.mf}.')
+        else:
+            # Without the checkpoint, only the seed of the run that created the database generates the same keys
+            # again, a new random seed would generate keys that collide with the loaded ones
+            if args.incremental and args.seed is None:
+                sys.exit(f'The "{args.DBNAMEGEN}" database has no checkpoint of the run that created it, like the runs '
+                         f'with "-fast-load", "-targets" or "-output-dir". Pass the "-seed" of that run to top it up.')
+
+            table_names = self.read_statistics(args)
+
+            # The run generates from the normalized statistics, which a resumed run reads again
+            # and compares by their fingerprint
+            self.table_information = stats_snapshot.normalize_table_information(
+                {table_name: self.table_information[table_name] for table_name in table_names})
+            if load_settings["checkpoint"]:
+                with key_pool.connection() as key_connection:
+                    checkpoints.save_run(key_connection, self.seed,
+                                         dict(mf=args.mf, tables=args.tables, server_side=args.server_side,
+                                              exact_stats=args.exact_stats),
+                                         stats_snapshot.statistics_fingerprint(self.table_information))
+
+        table_models = list()
+
+        with recorder.phase('build models'):
+            for table_name in table_names:
+                table_model = self.create_table_model(multiplication_factor, table_name)
+                if table_model is not None:
+                    table_models.append(table_model)
+
+        if args.incremental:
+            with key_pool.connection() as key_connection:
+                table_models = self.top_up_models(key_connection, table_models)
+        if load_settings["targets"] is not None:
+            sharding.check_bounds(table_models, load_settings["sharding"])
+
+        # Bigger tables are started first so that the workers finish at roughly the same time
+        table_models.sort(key=lambda model: model["rows_to_generate"], reverse=True)
+
+        remaining_chunks = {table_model["table_name"]: len(table_model["chunks"]) for table_model in table_models}
+        generated_rows = dict.fromkeys(remaining_chunks, 0)
+        failed_tables = dict()
+        finished_tables = 0
+
+        loaded_rows = {table_model["table_name"]: sum(table_model["chunks"][chunk_index][1] for chunk_index in
+                                                      loaded_chunks.get(table_model["table_name"], ()))
+                       for table_model in table_models}
+        progress = instrumentation.ProgressBar(sum(table_model["rows_to_generate"] for table_model in table_models)
+                                               - sum(loaded_rows.values()))
+
+        # Referenced tables are loaded in earlier waves than the tables that reference them,
+        # the tables within one wave are loaded in parallel
+        self.key_tables = dict()
+        for wave in dependency_waves(table_models):
+            with recorder.phase('read foreign keys'), connections.borrow(key_pool) as key_connection:
+                unloadable_tables = self.attach_foreign_keys(key_connection, wave, remaining_chunks, table_models,
+                                                             load_settings["server_side"])
+
+            # Tables whose foreign keys cannot be satisfied are failed before any of their rows is generated
+            for table_name, error in unloadable_tables.items():
+                failed_tables[table_name] = error
+                remaining_chunks[table_name] = 0
+                finished_tables += 1
+                progress.clear()
+                sys.stdout.write(f'The "{table_name}" table cannot be generated: {error}.\n')
+            wave = [table_model for table_model in wave if table_model["table_name"] not in unloadable_tables]
+
+            # The chunks of the interrupted run are only counted after the foreign keys are attached,
+            # like in the interrupted run the tables of this wave are not loaded yet when their keys are read
+            for table_model in wave:
+                table_name = table_model["table_name"]
+                if table_name in loaded_chunks:
+                    remaining_chunks[table_name] -= len(loaded_chunks[table_name])
+                    generated_rows[table_name] += loaded_rows[table_name]
+                    if remaining_chunks[table_name] == 0:
+                        finished_tables += 1
+                        print(f'The "{table_name}" table was already loaded by the interrupted run '
+                              f'({finished_tables}/{len(table_models)}).')
+
+            with recorder.phase('generate and load'):
+                for table_name, chunk_rows, error, chunk_stats in load_chunks(wave, connection_settings, load_settings,
+                                                                              self.seed, args.jobs, loaded_chunks):
+                    remaining_chunks[table_name] -= 1
+                    generated_rows[table_name] += chunk_rows
+                    recorder.record_table(table_name, chunk_rows, **chunk_stats)
+                    progress.update(chunk_rows)
 
+                    if error and table_name not in failed_tables:
+                        failed_tables[table_name] = error
+                        progress.clear()
+                        sys.stdout.write(
+                            f'An error occurred while inserting data into the "{table_name}" table. '
+                            f'Error description: {error}.\n')
+
+                    if remaining_chunks[table_name] == 0:
+                        finished_tables += 1
+                        if table_name not in failed_tables:
+                            progress.clear()
+                            print(f'Generated {generated_rows[table_name]} rows into the "{table_name}" table '
+                                  f'({finished_tables}/{len(table_models)}).')
+
+        progress.close()
+        if self.key_tables:
+            with key_pool.connection() as key_connection:
+                server_side.drop_key_tables(key_connection)
+
+        with recorder.phase('advance sequences'):
+            if key_pool is not None:
+                with key_pool.connection() as key_connection:
+                    self.advance_sequences([key_connection], table_models)
+            elif load_settings["targets"] is not None:
+                try:
+                    for settings in load_settings["targets"]:
+                        with connections.get_pool(settings, args.pool_size).connection() as target_connection:
+                            self.advance_sequences([target_connection], table_models)
+                except psycopg2.DatabaseError as error:
+                    print(f'Could not connect to the target databases to advance their sequences. '
+                          f'Error description: {error}')
+
+        if load_settings["checkpoint"] and not failed_tables:
+            with key_pool.connection() as key_connection:
+                checkpoints.finish_run(key_connection)
+
+        if failed_tables:
+            sys.stdout.write(f'Generated the synthetic data into {target}, '
+                             f'but {len(failed_tables)} table(s) failed: {", ".join(failed_tables)}.\n')
+            if load_settings["checkpoint"]:
+                sys.stdout.write('Run it again with "-resume" to load only the missing chunks.\n')
+        else:
+            sys.stdout.write(f'Successfully generated the synthetic data into {target}.\n')
+
+    # The sequences owned by the generated columns continue after the generated values. The sequences of
+    # partitions belong to the partitioned table at the root
+    def advance_sequences(self, connections, table_models):
+        sequence_columns = dict()
+        for table_model in table_models:
+            partition_levels = self.table_information[table_model["table_name"]]["partition_levels"]
+            identifier = partition_levels[0]["parent_identifier"] if partition_levels else table_model["identifier"]
+            sequence_columns.setdefault(tuple(identifier), set()).update(
+                column_name for column_name, column_type in
+                zip(table_model["column_names"], table_model["column_types"]) if column_type in INTEGER_MAXIMUMS)
+
+        for connection in connections:
+            for identifier, column_names in sequence_columns.items():
+                postgres.advance_sequences(connection, *identifier, sorted(column_names))
+
+    # Only the rows between the current row count of a target table and its size at the multiplication factor
+    # are generated. Their chunks get a stream of their own, so that they do not repeat the random draws of
+    # the rows that are already loaded
+    def top_up_models(self, key_connection, table_models):
+        with instrumentation.recorder.phase('count target rows'):
+            row_counts = postgres.get_row_counts(key_connection,
+                                                 [table_model["identifier"] for table_model in table_models])
+
+        top_up_models = list()
+        for table_model in table_models:
+            row_count = row_counts[table_model["table_name"]]
+            if row_count >= table_model["rows_to_generate"]:
+                print(f'The "{table_model["table_name"]}" table already has {row_count} rows, '
+                      f'skipping its data generation...')
+                continue
+
+            table_model["chunks"] = split_chunks(table_model["rows_to_generate"], row_count)
+            table_model["chunk_stream"] = (TOP_UP_STREAM, row_count)
+            table_model["rows_to_generate"] -= row_count
+            top_up_models.append(table_model)
+
+        return top_up_models
+
+    # Reads the statistics of the source tables and returns the names of the tables to generate
+    def read_statistics(self, args):
+        self.seed = args.seed
+        if self.seed is None:
+            self.seed = numpy.random.SeedSequence().entropy
+            print(f'Using the random seed {self.seed} (pass "-seed {self.seed}" to reproduce this run).')
+
+        recorder = instrumentation.recorder
+        self.table_information = dict()
+
+        # The statistics are read over the pool of the source database, which the new database was created with
+        source_pool = connections.get_pool(connections.connection_settings(args, args.DBNAMEIN), args.pool_size)
         try:
-            connection = psycopg2.connect(dbname=args.DBNAMEIN,
-                                          user=args.user,
-                                          host=args.hostname,
-                                          port=args.port,
-                                          password=args.password)
-        except psycopg2.DatabaseError as error:
+            with source_pool.connection() as connection:
+                cursor = connection.cursor()
+
+                with recorder.phase('read tables'):
+                    table_results = postgres.filter_tables(postgres.get_tables(cursor), args.tables)
+                    fingerprints = postgres.get_table_fingerprints(cursor, table_results)
+
+                stale_tables = table_results
+                if args.from_stats:
+                    with recorder.phase('load statistics snapshot'):
+                        stale_tables = self.load_stats_snapshot(args.from_stats, table_results, fingerprints,
+                                                                args.exact_stats)
+
+                if stale_tables:
+                    with recorder.phase('read statistics'):
+                        self.collect_table_information(cursor, stale_tables, args.exact_stats)
+
+                cursor.close()
+        except psycopg2.OperationalError as error:
             sys.exit('Could not connect to the "{0}" database. Error description: {1}'.format(args.DBNAMEIN, error))
 
-        cursor = connection.cursor()
+        stats_path = args.save_stats or (args.from_stats if stale_tables else None)
+        if stats_path:
+            with recorder.phase('save statistics snapshot'):
+                stats_snapshot.save_snapshot(stats_path, self.table_information, fingerprints, args.exact_stats)
+            print(f'Saved the statistics snapshot to "{stats_path}".')
 
-        table_results = postgres.get_tables(cursor)
+        return [postgres.qualified_name(table_entry[0], table_entry[1]) for table_entry in table_results]
 
-        tables_list = None
-        if args.tables is not None:
-            tables_list = args.tables.split(",")
-            tables_list = [table.strip(' ') for table in tables_list]
+    # The checkpoint only holds the fingerprint of the statistics, so a resumed or topped-up run reads them again
+    # (from DBNAMEIN or -from-stats) and goes on only if they are still the statistics of the run
+    def read_run_statistics(self, args, seed, settings, fingerprint, action):
+        run_args = copy.copy(args)
+        run_args.seed, run_args.tables, run_args.exact_stats = seed, settings["tables"], settings["exact_stats"]
+        table_names = self.read_statistics(run_args)
+        self.table_information = stats_snapshot.normalize_table_information(
+            {table_name: self.table_information[table_name] for table_name in table_names})
 
-        insert_dict = dict()
+        if stats_snapshot.statistics_fingerprint(self.table_information) != fingerprint:
+            sys.exit(f'The statistics of the "{args.DBNAMEIN}" database changed since the run was started, '
+                     f'it cannot be {action} with the same data. Generate the database again.')
 
-        for table_entry in table_results:
-            table_name = table_entry[1]
+        return table_names
+
+    # Returns the tables of the wave with a foreign key that is not nullable and has no keys to reference,
+    # with the reason
+    def attach_foreign_keys(self, key_connection, wave, remaining_chunks, table_models, server_side_keys=False):
+        key_values = dict()
+        unloadable_tables = dict()
+
+        for table_model in wave:
+            table_name = table_model["table_name"]
 
-            if tables_list:
-                if table_name not in tables_list:
+            for index, column_sampler in enumerate(table_model["column_samplers"]):
+                if not isinstance(column_sampler, samplers.ForeignKeySampler):
                     continue
 
-            primary_columns = postgres.get_table_primary_keys(cursor, table_name)
+                referenced_table = column_sampler.referenced_table
+                # Self references and references into a cycle cannot be satisfied while loading
+                key = (referenced_table, tuple(column_sampler.referenced_columns))
+                if referenced_table == table_name or remaining_chunks.get(referenced_table, 0) > 0:
+                    column_sampler.attach_keys(None, None)
+                elif server_side_keys:
+                    # The referenced table is complete once its wave is loaded, its keys are numbered only once
+                    if key not in self.key_tables:
+                        key_table = f'keys_{len(self.key_tables) + 1}'
+                        self.key_tables[key] = (server_side.KEY_SCHEMA, key_table), server_side.create_key_table(
+                            key_connection, key_table, column_sampler.referenced_identifier,
+                            column_sampler.referenced_columns)
 
-            column_results = postgres.get_column_information(cursor, table_name)
+                    column_sampler.attach_server_keys(*self.key_tables[key],
+                                                      create_rng(self.seed, table_name, FOREIGN_KEY_STREAM, index))
+                else:
+                    if key not in key_values:
+                        if key_connection is not None:
+                            key_values[key] = postgres.get_key_values(
+                                key_connection, *column_sampler.referenced_identifier,
+                                column_sampler.referenced_columns)
+                        else:
+                            # Without a target database the keys are generated once more from the referenced model
+                            key_values[key] = generated_key_values(table_models, referenced_table,
+                                                                   column_sampler.referenced_columns, self.seed)
 
-            self.table_information[table_name] = {}
-            self.table_information[table_name]["column_information"] = {}
-            self.table_information[table_name]["pg_stats"] = {}
+                    column_sampler.attach_keys(key_values[key],
+                                               create_rng(self.seed, table_name, FOREIGN_KEY_STREAM, index))
 
-            self.fill_columns_dict(table_name, column_results, primary_columns)
+                if not column_sampler.nullable and not column_sampler.has_keys():
+                    unloadable_tables.setdefault(table_name, column_sampler.missing_keys_error())
 
-            table_stats = postgres.get_table_stats(cursor, table_name)
-            self.fill_stats_dict(table_name, table_stats)
+        return unloadable_tables
 
-            column_names = list()
+    def load_stats_snapshot(self, stats_path, table_results, fingerprints, exact_stats):
+        snapshot = stats_snapshot.load_snapshot(stats_path)
+        if snapshot is None:
+            print(f'No usable statistics snapshot found at "{stats_path}", reading the statistics from the database...')
+            return table_results
 
-            for column_name, column_info in self.table_information.get(table_name)["column_information"].items():
-                if not column_info.get("column_default"):
-                    column_names.append(column_name)
+        stale_tables = list()
+        for table_entry in table_results:
+            table_name = postgres.qualified_name(table_entry[0], table_entry[1])
 
-            print(f'Generating synthetic data into the "{table_name}" table...')
-            self.create_insert_query(cursor, args.mf, table_name, column_names, insert_dict)
+            if stats_snapshot.is_table_fresh(snapshot, table_name, fingerprints[table_name], exact_stats):
+                self.table_information[table_name] = snapshot["table_information"][table_name]
+            else:
+                stale_tables.append(table_entry)
 
-        connection = psycopg2.connect(dbname=args.DBNAMEGEN,
-                                      user=args.user,
-                                      host=args.hostname,
-                                      port=args.port,
-                                      password=args.password)
+        if stale_tables:
+            print(f'The statistics snapshot is stale for {len(stale_tables)} table(s), '
+                  f'reading their statistics from the database...')
+        else:
+            print(f'Using the statistics snapshot from "{stats_path}".')
 
-        cursor = connection.cursor()
+        return stale_tables
 
-        for table_name, insert_query in insert_dict.items():
-            try:
-                if insert_query:
-                    cursor.execute(
-                        sql.SQL(insert_query).format(
-                            table_name=sql.Identifier(table_name)
-                        )
-                    )
-                    connection.commit()
-            except psycopg2.DatabaseError as db_error:
-                sys.stdout.write(
-                    f'An error occurred while inserting data into the "{table_name}" table. Error description: {db_error}.\n')
-                connection.rollback()
+    # The metadata of postgres.get_database_metadata is read here unless the caller already has it
+    def collect_table_information(self, cursor, table_results, exact_stats, metadata=None):
+        if metadata is None:
+            metadata = postgres.get_database_metadata(cursor, table_results)
 
-        sys.stdout.write(f'Successfully generated the synthetic data into the "{args.DBNAMEGEN}" database.')
+        for table_entry in table_results:
+            schema_name = table_entry[0]
+            table_name = postgres.qualified_name(schema_name, table_entry[1])
+            table_metadata = metadata[(schema_name, table_entry[1])]
 
-        cursor.close()
+            self.table_information[table_name] = {}
+            self.table_information[table_name]["identifier"] = (schema_name, table_entry[1])
+            self.table_information[table_name]["column_information"] = {}
+            self.table_information[table_name]["pg_stats"] = {}
+            self.table_information[table_name]["foreign_keys"] = []
+            self.table_information[table_name]["partition_levels"] = []
+            self.table_information[table_name]["unique_keys"] = []
+
+            self.fill_columns_dict(table_name, table_metadata["columns"])
+            self.fill_unique_keys(table_name, table_metadata["unique_keys"])
+            self.fill_stats_dict(table_name, table_metadata["stats"])
+            self.fill_foreign_keys_dict(table_name, table_metadata["foreign_keys"])
+            self.fill_partition_levels(table_name, table_metadata["partition_levels"])
 
-    def fill_columns_dict(self, table_name, column_results, primary_columns):
+            # By default the row count and the value ranges are taken from the catalog only, since scanning
+            # big source tables is by far the most expensive part of reading the statistics
+            if exact_stats:
+                column_information = self.table_information[table_name]["column_information"]
+                numeric_columns = [column_name for column_name, column_info in column_information.items()
+                                   if not column_info.get("column_default")
+                                   and column_info.get("data_type") in postgres.DataTypes.NUMERIC_TYPES]
+                with instrumentation.recorder.phase('scan tables for exact statistics'):
+                    row_count, value_ranges = postgres.get_exact_table_stats(
+                        cursor, schema_name, table_entry[1], numeric_columns)
+            else:
+                row_count = table_entry[2]
+                value_ranges = dict()
+
+            self.table_information[table_name]["row_count"] = row_count
+            self.table_information[table_name]["value_ranges"] = value_ranges
+
+    def fill_columns_dict(self, table_name, column_results):
         for column_entry in column_results:
-            if not primary_columns or column_entry[0] not in primary_columns:
-                columns_dict = dict()
-                columns_dict["column_name"] = column_entry[0]
-                columns_dict["data_type"] = column_entry[1]
-                columns_dict["max_length"] = column_entry[2]
-                if column_entry[3]:
-                    columns_dict["column_default"] = column_entry[3]
-                if column_entry[4]:
-                    columns_dict["numeric_precision"] = column_entry[4]
-                if column_entry[5]:
-                    columns_dict["numeric_precision_radix"] = column_entry[5]
-                if column_entry[6]:
-                    columns_dict["numeric_scale"] = column_entry[6]
-
-                self.table_information[table_name]["column_information"][column_entry[0]] = columns_dict
+            columns_dict = dict()
+            columns_dict["column_name"] = column_entry[0]
+            columns_dict["data_type"] = column_entry[1]
+            columns_dict["max_length"] = column_entry[2]
+            if column_entry[3]:
+                columns_dict["column_default"] = column_entry[3]
+            if column_entry[4]:
+                columns_dict["numeric_precision"] = column_entry[4]
+            if column_entry[5]:
+                columns_dict["numeric_precision_radix"] = column_entry[5]
+            if column_entry[6]:
+                columns_dict["numeric_scale"] = column_entry[6]
+            columns_dict["nullable"] = column_entry[7]
+
+            self.table_information[table_name]["column_information"][column_entry[0]] = columns_dict
+
+    def fill_unique_keys(self, table_name, unique_keys):
+        for key_entry in unique_keys:
+            key_dict = dict()
+            key_dict["primary_key"] = key_entry[0]
+            key_dict["column_names"] = key_entry[1]
+
+            self.table_information[table_name]["unique_keys"].append(key_dict)
 
     def fill_stats_dict(self, table_name, table_stats):
         for stats_entry in table_stats:
@@ -127,7 +506,7 @@ class DataGenerator:
             most_common_values = stats_entry[4]
             if most_common_values is not None:
                 most_common_values = most_common_values.strip("{}").split(",")
-                most_common_values = [value.strip('"').replace("'", "''") for value in most_common_values]
+                most_common_values = [value.strip('"') for value in most_common_values]
                 most_common_values = [value for value in most_common_values if value.strip()]
 
             stats_dict["most_common_vals"] = most_common_values
@@ -136,189 +515,730 @@ class DataGenerator:
             histogram_bounds = stats_entry[6]
             if histogram_bounds is not None:
                 histogram_bounds = histogram_bounds.strip("{}").split(",")
-                histogram_bounds = [bound.strip('"').replace("'", "''") for bound in histogram_bounds]
+                histogram_bounds = [bound.strip('"') for bound in histogram_bounds]
                 histogram_bounds = [bound for bound in histogram_bounds if bound.strip()]
 
             stats_dict["histogram_bounds"] = histogram_bounds
             stats_dict["correlation"] = stats_entry[7]
             self.table_information[table_name]["pg_stats"][stats_entry[0]] = stats_dict
 
-    def create_insert_query(self, cursor, multiplication_factor, table_name, column_names, insert_dict):
-        insert_query = ""
-        cursor.execute(f"SELECT COUNT(*) FROM {table_name};")
-        number_of_rows = cursor.fetchone()[0]
-        if number_of_rows is None:
-            number_of_rows = DEFAULT_NUMBER_OF_ROWS
+    def fill_foreign_keys_dict(self, table_name, foreign_keys):
+        for foreign_key_entry in foreign_keys:
+            foreign_key_dict = dict()
+            foreign_key_dict["constraint_name"] = foreign_key_entry[0]
+            foreign_key_dict["column_names"] = foreign_key_entry[1]
+            foreign_key_dict["referenced_table"] = postgres.qualified_name(foreign_key_entry[2], foreign_key_entry[3])
+            foreign_key_dict["referenced_identifier"] = (foreign_key_entry[2], foreign_key_entry[3])
+            foreign_key_dict["referenced_columns"] = foreign_key_entry[4]
+
+            self.table_information[table_name]["foreign_keys"].append(foreign_key_dict)
+
+    def fill_partition_levels(self, table_name, partition_levels):
+        for level_entry in partition_levels:
+            level_dict = dict()
+            level_dict["parent"] = postgres.qualified_name(level_entry[0], level_entry[1])
+            level_dict["parent_identifier"] = (level_entry[0], level_entry[1])
+            level_dict["column_name"] = level_entry[3]
+            level_dict["bound"] = postgres.parse_partition_bound(level_entry[4])
+
+            self.table_information[table_name]["partition_levels"].append(level_dict)
+
+    def create_table_model(self, multiplication_factor, table_name):
+        self.rng = create_rng(self.seed, table_name, MODEL_STREAM)
 
-        column_information = Dict = {}
-        for column_info in self.table_information[table_name]["column_information"].values():
-            column_name = column_info.get("column_name")
+        column_information = self.table_information[table_name]["column_information"]
+        for column_info in column_information.values():
             data_type = column_info.get("data_type")
-            numeric_precision = column_info.get("numeric_precision")
-            numeric_precision_radix = column_info.get("numeric_precision_radix")
-            numeric_scale = column_info.get("numeric_scale")
-            column_information[column_name] = {}
-
-            if column_name in self.table_information[table_name]["pg_stats"]:
-                column_stats = self.table_information[table_name]["pg_stats"][column_name]
-                if column_stats and column_stats["most_common_vals"] and column_stats["most_common_freqs"]:
-                    most_common_values = column_stats["most_common_vals"]
-                    most_common_freqs = column_stats["most_common_freqs"]
-                    avg_width = column_stats["avg_width"]
-                    n_distinct = column_stats["n_distinct"]
-
-                    if most_common_values and most_common_freqs:
-                        generated_vals = list()
-                        if n_distinct > 0:
-                            distinct_no = n_distinct
-                        else:
-                            distinct_no = -n_distinct * number_of_rows
-                        distinct_no = round(distinct_no)
-                        leftover_freq = 1 - sum(most_common_freqs)
-                        generated_freqs = most_common_freqs
-
-                        # The dirichlet function that generates random floating numbers to fill
-                        # the left-over frequencies
-                        # Only place where the numpy library is used
-                        generated_freqs += (numpy.random.dirichlet(numpy.ones(distinct_no - len(most_common_freqs)))
-                                            * leftover_freq).tolist()
-
-                        rows_to_gen = len(generated_freqs)
-
-                        if data_type in postgres.DataTypes.NUMERIC_TYPES:
-                            min_value = None
-                            cursor.execute(f"SELECT MIN({column_name}) FROM {table_name}")
-                            result = cursor.fetchone()
-                            if result:
-                                min_value = result[0]
-                            max_value = None
-                            cursor.execute(f"SELECT MAX({column_name}) FROM {table_name}")
-                            result = cursor.fetchone()
-                            if result:
-                                max_value = result[0]
-                            for index in range(rows_to_gen):
-                                generated_vals.append(
-                                    random_number(numeric_precision, numeric_precision_radix,
-                                                  numeric_scale,
-                                                  min_value=min_value, max_value=max_value))
-                        elif data_type in postgres.DataTypes.DATE_TYPES:
-                            for index in range(rows_to_gen):
-                                if data_type in ('timestamp', 'timestamp without time zone'):
-                                    generated_vals.append(utils.random_date(START_DATE, END_DATE, time=True))
-                                else:
-                                    generated_vals.append(utils.random_date(START_DATE, END_DATE))
-                        elif data_type in postgres.DataTypes.VARCHAR_TYPES:
-                            for index in range(rows_to_gen):
-                                generated_vals.append(random_word(
-                                    avg_width - 1,
-                                    value=most_common_values[utils.random_number(0, len(most_common_values) - 1)]))
-
-                        column_information[column_name]["generated_vals"] = generated_vals
-                        column_information[column_name]["generated_freqs"] = generated_freqs
 
             if data_type not in postgres.DataTypes.SUPPORTED_TYPES:
                 print(
                     f'The "{data_type}" data type is not supported. '
                     f'Skipping the table\'s "{table_name}" data generation...')
-                return
+                return None
+
+        number_of_rows = self.table_information[table_name]["row_count"]
+        if number_of_rows is None or number_of_rows < 0:
+            number_of_rows = DEFAULT_NUMBER_OF_ROWS
+        rows_to_generate = round(number_of_rows * multiplication_factor)
+
+        generated_columns = [column_name for column_name, column_info in column_information.items()
+                             if not column_info.get("column_default")]
+
+        # Foreign keys are generated by a single sampler for all of their columns, keyed by their first column
+        foreign_keys = dict()
+        foreign_key_columns = set()
+        for foreign_key in self.table_information[table_name]["foreign_keys"]:
+            if all(column_name in generated_columns and column_name not in foreign_key_columns
+                   for column_name in foreign_key["column_names"]):
+                foreign_keys[foreign_key["column_names"][0]] = foreign_key
+                foreign_key_columns.update(foreign_key["column_names"])
+
+        # Columns with a default are filled by the server, except for the columns of the unique keys,
+        # whose sequences are advanced after the load instead
+        table_key_samplers = self.create_key_samplers(table_name, foreign_key_columns, rows_to_generate)
+        if table_key_samplers is None:
+            return None
+
+        key_samplers = dict()
+        for key_column_names, key_sampler in table_key_samplers:
+            key_samplers[min(key_column_names, key=list(column_information).index)] = (key_column_names, key_sampler)
+        key_sampler_columns = {column_name for key_column_names, _ in key_samplers.values()
+                               for column_name in key_column_names}
+        generated_columns = [column_name for column_name in column_information
+                             if column_name in generated_columns or column_name in key_sampler_columns]
+
+        column_names = list()
+        column_samplers = list()
+        # The samplers of single columns by their column
+        column_sampler_indexes = dict()
+        for column_name in generated_columns:
+            if column_name in key_samplers:
+                key_column_names, key_sampler = key_samplers[column_name]
+                column_names.extend(key_column_names)
+                column_samplers.append(key_sampler)
+            elif column_name in foreign_keys:
+                foreign_key = foreign_keys[column_name]
+                column_stats = self.table_information[table_name]["pg_stats"].get(column_name) or {}
+
+                column_names.extend(foreign_key["column_names"])
+                column_samplers.append(samplers.ForeignKeySampler(
+                    foreign_key["referenced_table"],
+                    foreign_key["referenced_identifier"],
+                    foreign_key["referenced_columns"],
+                    [self.create_default_sampler(table_name, key_column, rows_to_generate)
+                     for key_column in foreign_key["column_names"]],
+                    nullable=all(column_information[key_column].get("nullable")
+                                 for key_column in foreign_key["column_names"]),
+                    null_frac=column_stats.get("null_frac"),
+                    most_common_freqs=column_stats.get("most_common_freqs")))
+            elif column_name not in foreign_key_columns and column_name not in key_sampler_columns:
+                column_sampler_indexes[column_name] = len(column_samplers)
+                column_names.append(column_name)
+                column_samplers.append(self.create_default_sampler(table_name, column_name, rows_to_generate))
 
         if not column_names:
             print(f'No columns found to generate data into. '
                   f'Skipping the table\'s "{table_name}" data generation...')
-            return
-
-        for _ in range(round(number_of_rows * multiplication_factor)):
-            column_values = list()
-            insert_query += "INSERT INTO {table_name}("
-            insert_query += '{0}{1}'.format(', '.join(column_names), ') VALUES (')
-            random_frac = random.random()
-
-            for column_info in self.table_information[table_name]["column_information"].values():
-                column_name = column_info.get("column_name")
-                data_type = column_info.get("data_type")
-                max_length = column_info.get("max_length")
-                numeric_precision = column_info.get("numeric_precision")
-                numeric_precision_radix = column_info.get("numeric_precision_radix")
-                numeric_scale = column_info.get("numeric_scale")
-                if column_info.get("column_default"):
-                    continue
-                generated_vals = None
-                generated_freqs = None
-                null_frac = None
-                column_stats = None
-
-                if column_name in self.table_information[table_name]["pg_stats"]:
-                    column_stats = self.table_information[table_name]["pg_stats"][column_name]
-
-                if column_stats:
-                    if "generated_vals" in column_information[column_name] \
-                            and column_information[column_name]["generated_vals"] \
-                            and "generated_freqs" in column_information[column_name] \
-                            and column_information[column_name]["generated_freqs"]:
-                        generated_vals = column_information[column_name]["generated_vals"]
-                        generated_freqs = column_information[column_name]["generated_freqs"]
-                        null_frac = column_stats["null_frac"]
-
-                if data_type in postgres.DataTypes.NUMERIC_TYPES:
-                    if generated_vals and generated_freqs:
-                        if null_frac and random_frac <= null_frac:
-                            column_values.append("{0}".format('NULL'))
-                        else:
-                            column_values.append("{0}".format(utils.random_choices(generated_vals, generated_freqs)))
-                    else:
-                        column_values.append(
-                            "{0}".format(random_number(numeric_precision, numeric_precision_radix, numeric_scale)))
-                elif data_type in postgres.DataTypes.DATE_TYPES:
-                    if generated_vals and generated_freqs:
-                        if null_frac and random_frac <= null_frac:
-                            column_values.append("{0}".format('NULL'))
-                        else:
-                            column_values.append("'{0}'".format(utils.random_choices(generated_vals, generated_freqs)))
-                    else:
-                        column_values.append("'{0}'".format(utils.random_date(START_DATE, END_DATE)))
-                elif data_type in postgres.DataTypes.BOOLEAN_TYPES:
-                    column_values.append("{0}".format(utils.random_boolean()))
-                elif data_type in postgres.DataTypes.VARCHAR_TYPES:
-                    if generated_vals and generated_freqs:
-                        if null_frac and random_frac <= null_frac:
-                            column_values.append("{0}".format('NULL'))
-                        else:
-                            column_values.append("'{0}'".format(utils.random_choices(generated_vals, generated_freqs)))
-                    else:
-                        column_values.append("'{0}'".format(random_word(max_length / 2.5)))
-            insert_query += '{0}{1}'.format(', '.join(column_values), ');')
-        insert_dict[table_name] = insert_query
-
-
-def random_word(average_length, value=None):
-    average_length = round(average_length)
-    if value:
-        if str(value).isdigit():
-            word = utils.random_word(average_length, numeric=True)
-        elif str(value).isupper():
-            word = utils.random_word(average_length).upper()
-        elif str(value) and str(value)[0].isupper():
-            word = utils.random_word(average_length).capitalize()
+            return None
+
+        # The partition key values are kept within the bounds of the partition, which is then loaded directly.
+        # Key samplers draw their keys within the bounds themselves. From the first level whose bound cannot
+        # be followed (hash and default partitions, keys that are expressions or not generated) on, the rows
+        # are loaded through that level's partitioned table instead
+        load_identifier = self.table_information[table_name]["identifier"]
+        partition_levels = self.table_information[table_name]["partition_levels"]
+        for partition_level in partition_levels:
+            column_name = partition_level["column_name"]
+            if column_name in key_sampler_columns and partition_level["bound"]["strategy"] in ('range', 'list'):
+                continue
+            if partition_level["bound"]["strategy"] not in ('range', 'list') \
+                    or column_name not in column_sampler_indexes:
+                load_identifier = partition_level["parent_identifier"]
+                break
+
+            sampler_index = column_sampler_indexes[column_name]
+            column_info = column_information[column_name]
+            column_samplers[sampler_index] = samplers.PartitionKeySampler(
+                column_samplers[sampler_index], partition_level["bound"], partition_key_kind(column_info["data_type"]),
+                scale=column_info.get("numeric_scale"))
+
+        return {
+            "table_name": table_name,
+            "identifier": self.table_information[table_name]["identifier"],
+            "load_identifier": load_identifier,
+            "partition_of": [partition_level["parent"] for partition_level in partition_levels],
+            "column_names": column_names,
+            "column_types": [column_information[column_name]["data_type"] for column_name in column_names],
+            "column_samplers": column_samplers,
+            "rows_to_generate": rows_to_generate,
+            "chunks": split_chunks(rows_to_generate),
+            "chunk_stream": (CHUNK_STREAM,)
+        }
+
+    # Every unique key gets a key sampler over its columns that are not foreign keys, which makes it unique
+    # on its own. The partition key columns are left to their own samplers as well when other columns remain,
+    # so that they can be kept within the bounds of the partition, otherwise the keys are drawn within the bounds.
+    # Keys that contain an already generated key are unique with it. Returns None if the table cannot be generated
+    def create_key_samplers(self, table_name, foreign_key_columns, rows_to_generate):
+        column_information = self.table_information[table_name]["column_information"]
+        partition_columns = {partition_level["column_name"]
+                             for partition_level in self.table_information[table_name]["partition_levels"]}
+
+        key_samplers = list()
+        for unique_key in self.table_information[table_name]["unique_keys"]:
+            column_names = [column_name for column_name in unique_key["column_names"]
+                            if column_name not in foreign_key_columns]
+            if set(column_names) - partition_columns:
+                column_names = [column_name for column_name in column_names if column_name not in partition_columns]
+
+            if any(set(key_column_names) <= set(column_names) for key_column_names, _ in key_samplers):
+                continue
+            if not column_names or any(column_name in key_column_names for key_column_names, _ in key_samplers
+                                       for column_name in column_names) \
+                    or any(column_information[column_name]["data_type"] in postgres.DataTypes.BOOLEAN_TYPES
+                           for column_name in column_names):
+                print(f'The values of the unique key ({", ".join(unique_key["column_names"])}) '
+                      f'of the "{table_name}" table cannot be generated unique, they are sampled like other values.')
+                continue
+
+            # A key of partition key columns only has to stay within the bounds of its partition
+            bound = self.partition_key_bound(table_name, column_names)
+            key_sampler = None
+            if bound is None or bound["strategy"] != 'unsupported':
+                key_sampler = self.create_key_sampler(table_name, column_names, rows_to_generate,
+                                                      unique_key["primary_key"], bound)
+            if key_sampler is None and bound is not None:
+                print(f'The unique key ({", ".join(unique_key["column_names"])}) of the "{table_name}" table is '
+                      f'its partition key, which cannot hold {rows_to_generate} distinct keys within the bounds '
+                      f'of the partition. Skipping the table\'s "{table_name}" data generation...')
+                return None
+            if key_sampler is None:
+                print(f'The columns of the unique key ({", ".join(unique_key["column_names"])}) of the "{table_name}" '
+                      f'table cannot hold {rows_to_generate} distinct keys, they are sampled like other values.')
+                continue
+
+            key_samplers.append((column_names, key_sampler))
+
+        return key_samplers
+
+    # The keys of a row only depend on its offset and on the source, not on the multiplication factor,
+    # so that -incremental tops up a table with new keys. The partitions below a hash or default partitioned table
+    # share one key space, in which every partition gets a range of key indexes of its own: the server routes
+    # their rows by the hash of the key, so their keys have to be unique across the partitions.
+    # Returns None if the columns cannot hold the keys
+    def create_key_sampler(self, table_name, column_names, rows_to_generate, primary_key, bound=None):
+        pg_stats = self.table_information[table_name]["pg_stats"]
+        key_tables = self.key_space_tables(table_name)
+        # Every table of the key space can grow to KEY_GROWTH times its source rows, in whole blocks
+        key_spans = [-(-max(self.table_information[key_table]["row_count"] or DEFAULT_NUMBER_OF_ROWS, 1) * KEY_GROWTH
+                       // CHUNK_SIZE) * CHUNK_SIZE for key_table in key_tables]
+        index_base = sum(key_spans[:key_tables.index(table_name)])
+
+        # The radix of every column but the first is its number of distinct values in the source,
+        # the first one counts the rest. The radices of a key space come from its first table
+        radix_stats = self.table_information[key_tables[0]]["pg_stats"]
+        radix_rows = max(self.table_information[key_tables[0]]["row_count"] or DEFAULT_NUMBER_OF_ROWS, 1)
+        radices = [None]
+        for column_name in column_names[1:]:
+            n_distinct = (radix_stats.get(column_name) or {}).get("n_distinct")
+            if not n_distinct:
+                distinct_no = radix_rows ** (1 / len(column_names))
+            elif n_distinct > 0:
+                distinct_no = n_distinct
+            else:
+                distinct_no = -n_distinct * radix_rows
+            radices.append(max(round(distinct_no), 1))
+
+        # The domains of the key space are built alike in all its tables, numbers and dates start
+        # at the smallest start of its tables
+        domains = list()
+        for column_name, size in zip(column_names, [-(-sum(key_spans) // math.prod(radices[1:]))] + radices[1:]):
+            column_domains = [self.create_key_domain(key_table, column_name, size, bound) for key_table in key_tables]
+            domain = column_domains[key_tables.index(table_name)]
+            if isinstance(domain, samplers.SequenceDomain):
+                domain = min(column_domains, key=lambda column_domain: column_domain.start)
+            domains.append(domain)
+
+        # The permuted key indexes of the last block can go up to the end of the block. Keys within the bounds
+        # of a partition are not permuted, there may be fewer of them than a block holds
+        key_count = -(-max(rows_to_generate, 1) // CHUNK_SIZE) * CHUNK_SIZE if bound is None else rows_to_generate
+        if key_count > key_spans[key_tables.index(table_name)] or any(
+                domain.capacity() < size for domain, size in
+                zip(domains, [-(-(index_base + key_count) // math.prod(radices[1:]))] + radices[1:])):
+            return None
+
+        # Keys that the source stores in their order, like the values of a sequence, are generated in order
+        first_stats = pg_stats.get(column_names[0]) or {}
+        permuted = abs(first_stats.get("correlation") or 0) < ORDERED_CORRELATION and bound is None
+
+        null_frac = None
+        if not primary_key and len(column_names) == 1:
+            null_frac = first_stats.get("null_frac")
+
+        return samplers.KeySampler(domains, radices, CHUNK_SIZE, self.rng, permuted=permuted, null_frac=null_frac,
+                                   index_base=index_base)
+
+    # The bound of the range or list partition that the keys of partition key columns have to stay within,
+    # None if the columns are not partition key columns there
+    def partition_key_bound(self, table_name, column_names):
+        bounds = list()
+        for partition_level in self.table_information[table_name]["partition_levels"]:
+            if partition_level["bound"]["strategy"] not in ('range', 'list'):
+                break
+            if partition_level["column_name"] in column_names:
+                bounds.append(partition_level["bound"])
+
+        if not bounds:
+            return None
+
+        data_type = self.table_information[table_name]["column_information"][column_names[0]]["data_type"]
+        if len(column_names) > 1 or len(bounds) > 1 or (
+                bounds[0]["strategy"] == 'range' and partition_key_kind(data_type) not in ('number', 'date', 'timestamp')):
+            return dict(strategy='unsupported')
+
+        return bounds[0]
+
+    # The partitions that are routed by the same hash or default partitioned table, in the order of their names,
+    # or only the table itself. Range and list partitions keep their keys within their own bounds
+    def key_space_tables(self, table_name):
+        parent = routing_parent(self.table_information[table_name]["partition_levels"])
+        if parent is None:
+            return [table_name]
+
+        return sorted(other_name for other_name, other_information in self.table_information.items()
+                      if routing_parent(other_information["partition_levels"]) == parent)
+
+    # Numbers, dates and timestamps count up from the smallest value of the source, words spell out their index.
+    # Within the bound of a partition, the keys are its listed values or count up within its range
+    def create_key_domain(self, table_name, column_name, size, bound=None):
+        column_info = self.table_information[table_name]["column_information"][column_name]
+        column_stats = self.table_information[table_name]["pg_stats"].get(column_name)
+        data_type = column_info["data_type"]
+
+        if bound is not None:
+            kind = partition_key_kind(data_type)
+            if bound["strategy"] == 'list':
+                return samplers.ListDomain(
+                    samplers.partition_bound_value(value, kind, column_info.get("numeric_scale"))
+                    for value in bound["values"] if value is not None)
+            lower, upper = (samplers.partition_bound_value(bound[end], kind) for end in ('lower', 'upper'))
+
+        if data_type in postgres.DataTypes.NUMERIC_TYPES:
+            value_range = self.table_information[table_name]["value_ranges"].get(column_name)
+            if value_range is None and column_stats:
+                value_range = stats_value_range(column_stats)
+
+            start = math.ceil(value_range[0]) if value_range and value_range[0] is not None else 1
+            maximum = key_maximum(column_info)
+            # Positive keys stay positive, even when that leaves less room than size
+            lowest = min(start, 1)
+            if bound is not None:
+                if lower is not None:
+                    lowest = math.ceil(lower)
+                    start = max(start, lowest)
+                if upper is not None:
+                    maximum = math.ceil(upper) - 1 if maximum is None else min(maximum, math.ceil(upper) - 1)
+            if maximum is not None:
+                start = max(min(start, maximum - size + 1), lowest)
+            return samplers.SequenceDomain(start, 'number', maximum=maximum)
+        elif data_type in postgres.DataTypes.DATE_TYPES:
+            kind = 'timestamp' if is_timestamp(data_type) else 'date'
+            start = key_start(column_stats, kind)
+            if bound is None:
+                return samplers.SequenceDomain(start, kind)
+
+            unit = samplers.date_unit(kind == 'timestamp')
+            start = numpy.datetime64(start, unit)
+            lowest = None if lower is None else numpy.datetime64(lower, unit)
+            maximum = None if upper is None else numpy.datetime64(upper, unit) - numpy.timedelta64(1, unit)
+            if lowest is not None:
+                start = max(start, lowest)
+            if maximum is not None:
+                start = min(start, maximum - numpy.timedelta64(size - 1, unit))
+                if lowest is not None:
+                    start = max(start, lowest)
+            return samplers.SequenceDomain(start, kind, maximum=maximum)
+        elif column_stats:
+            return samplers.WordDomain(column_stats["avg_width"] - 1, size, shapes=word_shapes(column_stats),
+                                       max_length=column_info.get("max_length"))
+
+        return samplers.WordDomain(RANDOM_WORD_LENGTH, size, max_length=column_info.get("max_length"))
+
+    def create_default_sampler(self, table_name, column_name, rows_to_generate):
+        column_info = self.table_information[table_name]["column_information"][column_name]
+        column_stats = self.table_information[table_name]["pg_stats"].get(column_name)
+
+        value_range = self.table_information[table_name]["value_ranges"].get(column_name)
+        if value_range is None and column_stats:
+            value_range = stats_value_range(column_stats)
+
+        return self.create_column_sampler(column_info, column_stats, rows_to_generate, value_range or (None, None))
+
+    def create_column_sampler(self, column_info, column_stats, rows_to_generate, value_range):
+        data_type = column_info.get("data_type")
+        max_length = column_info.get("max_length")
+        numeric_precision = column_info.get("numeric_precision")
+        numeric_precision_radix = column_info.get("numeric_precision_radix")
+        numeric_scale = column_info.get("numeric_scale")
+
+        if data_type not in postgres.DataTypes.BOOLEAN_TYPES and column_stats and column_stats["n_distinct"]:
+            most_common_freqs = column_stats["most_common_freqs"] or []
+            n_distinct = column_stats["n_distinct"]
+
+            # A negative n_distinct is a fraction of the rows, which grows with the multiplication factor
+            if n_distinct > 0:
+                distinct_no = n_distinct
+            else:
+                distinct_no = -n_distinct * rows_to_generate
+            distinct_no = max(round(distinct_no), len(most_common_freqs), 1)
+
+            if data_type in postgres.DataTypes.NUMERIC_TYPES:
+                min_value, max_value = value_range
+                low, high = number_bounds(numeric_precision, numeric_precision_radix, numeric_scale,
+                                          min_value=min_value, max_value=max_value)
+                domain = samplers.NumberDomain(low, high, distinct_no, scale=numeric_scale,
+                                               histogram_bounds=column_stats["histogram_bounds"],
+                                               most_common_values=most_common_values(column_stats))
+            elif data_type in postgres.DataTypes.DATE_TYPES:
+                domain = samplers.DateDomain(START_DATE, END_DATE, distinct_no, time=is_timestamp(data_type),
+                                             histogram_bounds=column_stats["histogram_bounds"],
+                                             most_common_values=most_common_values(column_stats))
+            else:
+                domain = samplers.WordDomain(column_stats["avg_width"] - 1, distinct_no,
+                                             shapes=word_shapes(column_stats), max_length=max_length)
+
+            # The domain may hold fewer distinct values than the statistics ask for
+            return samplers.DistinctValueSampler(domain, domain.size, rows_to_generate, self.rng,
+                                                 most_common_freqs=most_common_freqs,
+                                                 null_frac=column_stats["null_frac"])
+
+        null_frac = column_stats["null_frac"] if column_stats else None
+        histogram_bounds = column_stats["histogram_bounds"] if column_stats else None
+
+        if data_type in postgres.DataTypes.NUMERIC_TYPES:
+            return samplers.NumberSampler(*number_bounds(numeric_precision, numeric_precision_radix, numeric_scale),
+                                          scale=numeric_scale, null_frac=null_frac, histogram_bounds=histogram_bounds)
+        elif data_type in postgres.DataTypes.DATE_TYPES:
+            return samplers.DateSampler(START_DATE, END_DATE, time=is_timestamp(data_type), null_frac=null_frac,
+                                        histogram_bounds=histogram_bounds)
+        elif data_type in postgres.DataTypes.BOOLEAN_TYPES:
+            return samplers.BooleanSampler(null_frac=null_frac)
+        elif column_stats:
+            return samplers.WordSampler(column_stats["avg_width"] - 1, shapes=word_shapes(column_stats),
+                                        max_length=max_length, null_frac=null_frac)
         else:
-            word = utils.random_word(average_length)
+            return samplers.WordSampler(max_length / 2.5 if max_length else RANDOM_WORD_LENGTH, max_length=max_length)
+
+
+def routing_parent(partition_levels):
+    for partition_level in partition_levels:
+        if partition_level["bound"]["strategy"] not in ('range', 'list'):
+            return partition_level["parent"]
+
+    return None
+
+
+def partition_key_kind(data_type):
+    if data_type in postgres.DataTypes.NUMERIC_TYPES:
+        return 'number'
+    elif data_type in postgres.DataTypes.DATE_TYPES:
+        return 'timestamp' if is_timestamp(data_type) else 'date'
+    elif data_type in postgres.DataTypes.BOOLEAN_TYPES:
+        return 'boolean'
+
+    return 'text'
+
+
+def create_rng(seed, table_name, *stream):
+    # Every (table, stream) pair gets its own independent PCG64 stream derived from the seed,
+    # so that the generated data does not depend on which process generates which chunk
+    table_key = zlib.crc32(table_name.encode('utf-8'))
+    seed_sequence = numpy.random.SeedSequence(entropy=seed, spawn_key=(table_key,) + stream)
+
+    return numpy.random.Generator(numpy.random.PCG64(seed_sequence))
+
+
+def dependency_waves(table_models):
+    remaining_models = {table_model["table_name"]: table_model for table_model in table_models}
+    dependencies = dict()
+    for table_name, table_model in remaining_models.items():
+        referenced_tables = {column_sampler.referenced_table
+                             for column_sampler in table_model["column_samplers"]
+                             if isinstance(column_sampler, samplers.ForeignKeySampler)}
+        # A reference to a partitioned table depends on all of its partitions
+        dependencies[table_name] = {referenced_name for referenced_name, referenced_model in remaining_models.items()
+                                    if referenced_name != table_name
+                                    and (referenced_name in referenced_tables
+                                         or referenced_tables & set(referenced_model["partition_of"]))}
+
+    waves = list()
+    while remaining_models:
+        wave = [table_model for table_name, table_model in remaining_models.items()
+                if not dependencies[table_name] & remaining_models.keys()]
+
+        if not wave:
+            print(f'The foreign keys between the tables {", ".join(remaining_models)} form a cycle, '
+                  f'the references within the cycle are generated without their keys, which only nullable foreign keys allow.')
+            wave = list(remaining_models.values())
+
+        for table_model in wave:
+            del remaining_models[table_model["table_name"]]
+        waves.append(wave)
+
+    return waves
+
+
+# A checkpointed run is continued with its own seed and tables, other ones on the command line are refused
+def check_run_arguments(args, seed, settings, action):
+    if args.seed is not None and args.seed != seed:
+        sys.exit(f'The checkpointed run was generated with the seed {seed}, '
+                 f'it cannot be {action} with the seed {args.seed}.')
+    if args.tables is not None and table_set(args.tables) != table_set(settings["tables"]):
+        sys.exit(f'The checkpointed run was generated for the tables "{settings["tables"] or "all"}", '
+                 f'it cannot be {action} for the tables "{args.tables}".')
+
+
+def table_set(tables_arg):
+    return {table_name.strip() for table_name in tables_arg.split(',')} if tables_arg else None
+
+
+def split_chunks(rows_to_generate, start_offset=0):
+    chunks = [(offset, min(CHUNK_SIZE, rows_to_generate - offset))
+              for offset in range(start_offset, rows_to_generate, CHUNK_SIZE)]
+
+    return chunks or [(0, 0)]
+
+
+# The chunks in loaded_chunks were loaded by an interrupted run and are skipped
+def load_chunks(table_models, connection_settings, load_settings, seed, jobs, loaded_chunks=None):
+    loaded_chunks = loaded_chunks or dict()
+    chunk_tasks = [(table_model["table_name"], chunk_index)
+                   for table_model in table_models
+                   for chunk_index in range(len(table_model["chunks"]))
+                   if chunk_index not in loaded_chunks.get(table_model["table_name"], ())]
+
+    # With -jobs 1 and a -pool-size above 1, the chunks are loaded by threads of this process instead of
+    # worker processes. Every thread keeps a COPY or INSERT open on a connection of the shared pool
+    thread_count = min(load_settings["pool_size"], len(chunk_tasks))
+    if (jobs > 1 or thread_count > 1) and len(chunk_tasks) > 1:
+        if jobs > 1:
+            executor = ProcessPoolExecutor(max_workers=jobs, initializer=initialize_worker,
+                                           initargs=(connection_settings, load_settings, table_models, seed))
+        else:
+            initialize_worker(connection_settings, load_settings, table_models, seed)
+            executor = ThreadPoolExecutor(max_workers=thread_count)
+
+        with executor:
+            futures = {executor.submit(load_chunk, *chunk_task): chunk_task for chunk_task in chunk_tasks}
+            for future in as_completed(futures):
+                table_name = futures[future][0]
+                # The error of a table is reported by the chunk that failed, its cancelled chunks only count down
+                if future.cancelled():
+                    yield table_name, 0, None, dict()
+                    continue
+
+                result = future.result()
+                if result[2]:
+                    for other_future, chunk_task in futures.items():
+                        if chunk_task[0] == table_name:
+                            other_future.cancel()
+                yield result
     else:
-        word = utils.random_word(average_length)
+        initialize_worker(connection_settings, load_settings, table_models, seed)
+        failed_tables = set()
+        for chunk_task in chunk_tasks:
+            if chunk_task[0] in failed_tables:
+                yield chunk_task[0], 0, None, dict()
+                continue
+
+            result = load_chunk(*chunk_task)
+            if result[2]:
+                failed_tables.add(chunk_task[0])
+            yield result
+
 
-    return word
+# Every worker process borrows its connections from its own pools, which it keeps across tables and waves.
+# In this process they are the pools of the other phases, closed at the end of the run
+worker_settings = None
+worker_load_settings = None
+worker_models = None
+worker_seed = None
 
 
-def random_number(numeric_precision, numeric_precision_radix, numeric_scale, min_value=None, max_value=None):
+def initialize_worker(connection_settings, load_settings, table_models, seed):
+    global worker_settings, worker_load_settings, worker_models, worker_seed
+    worker_settings = connection_settings
+    worker_load_settings = load_settings
+    worker_models = {table_model["table_name"]: table_model for table_model in table_models}
+    worker_seed = seed
+
+
+# Returns the table, the loaded rows, the error if the chunk failed and the chunk's instrumentation
+def load_chunk(table_name, chunk_index):
+    start_time = time.perf_counter()
+    chunk_rows, sent_bytes, error = write_chunk(table_name, chunk_index)
+
+    return table_name, chunk_rows, error, dict(sent_bytes=sent_bytes,
+                                               seconds=time.perf_counter() - start_time,
+                                               worker_peak_rss_kb=instrumentation.peak_rss_kb())
+
+
+def write_chunk(table_name, chunk_index):
+    table_model = worker_models[table_name]
+    chunk_offset, chunk_rows = table_model["chunks"][chunk_index]
+    rng = create_rng(worker_seed, table_name, *table_model["chunk_stream"], chunk_index)
+
+    if worker_load_settings["output"] is not None:
+        try:
+            sent_bytes = copy_files.write_chunk(
+                worker_load_settings["output"], table_model, chunk_index,
+                generate_batches(table_model["column_samplers"], chunk_rows, rng, chunk_offset))
+        except Exception as error:
+            return 0, 0, str(error).strip()
+
+        return chunk_rows, sent_bytes, None
+
+    if worker_load_settings["targets"] is not None:
+        return write_target_chunk(table_model, chunk_offset, chunk_rows, rng)
+
+    # The chunk is rolled back when the connection is given back to the pool without a commit. Any error,
+    # also of the generation, fails the chunk's table and is reported with the other failed tables
+    try:
+        with connections.get_pool(worker_settings, worker_load_settings["pool_size"]).connection() as connection:
+            with connection.cursor() as cursor:
+                if worker_load_settings["server_side"]:
+                    # A pooled session may be new, the helper functions are created in the chunk's transaction
+                    server_side.create_functions(cursor)
+                    sent_bytes = server_side.insert_rows(cursor, table_model, chunk_offset, chunk_rows, rng)
+                elif worker_load_settings["queue_depth"] > 0:
+                    batches = generate_batches(table_model["column_samplers"], chunk_rows, rng, chunk_offset)
+                    with copy_stream.PipelinedCopyStream(batches, worker_load_settings["queue_depth"]) as stream:
+                        postgres.copy_rows(cursor, *table_model["load_identifier"], table_model["column_names"],
+                                           stream)
+                    sent_bytes = stream.sent_bytes
+                else:
+                    stream = copy_stream.CopyStream(generate_rows(table_model["column_samplers"], chunk_rows, rng,
+                                                                  chunk_offset))
+                    postgres.copy_rows(cursor, *table_model["load_identifier"], table_model["column_names"], stream)
+                    sent_bytes = stream.sent_bytes
+
+                if worker_load_settings["checkpoint"]:
+                    checkpoints.record_chunk(cursor, table_name, chunk_index, chunk_offset, chunk_rows, worker_seed)
+            connection.commit()
+    except Exception as error:
+        return 0, 0, str(error).strip()
+
+    return chunk_rows, sent_bytes, None
+
+
+# Loads the chunk into all the targets, it is committed on the targets only once every COPY succeeded
+def write_target_chunk(table_model, chunk_offset, chunk_rows, rng):
+    targets = worker_load_settings["targets"]
+
+    # The connections are borrowed in the order of the targets, so that no two threads wait for each other
+    try:
+        with ExitStack() as borrowed:
+            target_connections = [
+                borrowed.enter_context(connections.get_pool(target, worker_load_settings["pool_size"]).connection())
+                for target in targets]
+
+            route = sharding.create_router(table_model, worker_load_settings["sharding"], len(targets))
+            batches = generate_batches(table_model["column_samplers"], chunk_rows, rng, chunk_offset)
+            sent_bytes, error = sharding.copy_batches(target_connections, table_model, batches, route,
+                                                      worker_load_settings["queue_depth"])
+            if error is None:
+                for connection in target_connections:
+                    connection.commit()
+    except Exception as connection_error:
+        error = connection_error
+
+    if error is not None:
+        return 0, 0, str(error).strip()
+
+    return chunk_rows, sent_bytes, None
+
+
+def generate_rows(column_samplers, rows_to_generate, rng, offset=0):
+    for batch_offset in range(0, rows_to_generate, BATCH_SIZE):
+        yield from samplers.sample_rows(column_samplers, rng, min(BATCH_SIZE, rows_to_generate - batch_offset),
+                                        offset + batch_offset)
+
+
+# Same rows as generate_rows, as one vector per column and batch
+def generate_batches(column_samplers, rows_to_generate, rng, offset=0):
+    for batch_offset in range(0, rows_to_generate, BATCH_SIZE):
+        yield samplers.sample_columns(column_samplers, rng, min(BATCH_SIZE, rows_to_generate - batch_offset),
+                                      offset + batch_offset)
+
+
+# The keys of a partitioned table are the keys of all its partitions
+def generated_key_values(table_models, table_name, column_names, seed):
+    key_models = [table_model for table_model in table_models
+                  if table_model["table_name"] == table_name or table_name in table_model["partition_of"]]
+    if not key_models or not all(set(column_names) <= set(table_model["column_names"]) for table_model in key_models):
+        return None
+
+    key_batches = [list() for _ in column_names]
+    for table_model in key_models:
+        column_indexes = [table_model["column_names"].index(column_name) for column_name in column_names]
+        for chunk_index, (chunk_offset, chunk_rows) in enumerate(table_model["chunks"]):
+            rng = create_rng(seed, table_model["table_name"], *table_model["chunk_stream"], chunk_index)
+            for columns in generate_batches(table_model["column_samplers"], chunk_rows, rng, chunk_offset):
+                for key_batch, column_index in zip(key_batches, column_indexes):
+                    key_batch.append(columns[column_index])
+
+    # Sorted like the keys read from the database, so that both generate the same references
+    keys = [numpy.concatenate(key_batch) for key_batch in key_batches]
+    complete_rows = numpy.all([numpy.not_equal(key, None) for key in keys], axis=0)
+    keys = [numpy.array(key[complete_rows].tolist()) for key in keys]
+    order = numpy.lexsort(keys[::-1])
+
+    return [key[order] for key in keys]
+
+
+def stats_value_range(column_stats):
+    values = list()
+    for value in (column_stats["histogram_bounds"] or []) + (column_stats["most_common_vals"] or []):
+        try:
+            values.append(float(value))
+        except ValueError:
+            continue
+
+    if not values:
+        return None
+
+    return min(values), max(values)
+
+
+# The most common values can only be reused when every one of them lines up with its frequency
+def most_common_values(column_stats):
+    values = column_stats["most_common_vals"] or []
+    if len(values) != len(column_stats["most_common_freqs"] or []):
+        return None
+
+    return values
+
+
+def key_maximum(column_info):
+    data_type = column_info["data_type"]
+    if data_type in INTEGER_MAXIMUMS:
+        return INTEGER_MAXIMUMS[data_type]
+    elif column_info.get("numeric_precision"):
+        return (column_info.get("numeric_precision_radix") or 10) ** \
+            (column_info["numeric_precision"] - (column_info.get("numeric_scale") or 0)) - 1
+
+    return None
+
+
+def key_start(column_stats, kind):
+    unit = samplers.date_unit(kind == 'timestamp')
+    values = (column_stats["histogram_bounds"] or []) + (column_stats["most_common_vals"] or []) \
+        if column_stats else []
+    steps = samplers.parse_values(values, f'datetime64[{unit}]')
+    if steps is None:
+        return START_DATE
+
+    return numpy.datetime64(int(steps.min()), unit)
+
+
+def is_timestamp(data_type):
+    return data_type in ('timestamp', 'timestamp without time zone')
+
+
+# The shape classes of a column are detected once, from its most common values or histogram
+def word_shapes(column_stats):
+    sample_values = column_stats["most_common_vals"] or column_stats["histogram_bounds"] or []
+
+    return [samplers.word_shape(value) for value in sample_values]
+
+
+def number_bounds(numeric_precision, numeric_precision_radix, numeric_scale, min_value=None, max_value=None):
     if numeric_precision:
         if numeric_scale and numeric_scale != 0:
-            number = round(utils.random_number(
-                min_value or 0,
-                max_value or ((numeric_precision_radix ** (numeric_precision - numeric_scale - 1)) / 1.5),
-                uniform=True),
-                numeric_scale)
+            return (min_value or 0,
+                    max_value or ((numeric_precision_radix ** (numeric_precision - numeric_scale - 1)) / 1.5))
         else:
-            number = utils.random_number(min_value or 0,
-                                         max_value or ((numeric_precision_radix ** (numeric_precision - 1)) / 1.5))
+            return (min_value or 0,
+                    max_value or ((numeric_precision_radix ** (numeric_precision - 1)) / 1.5))
     else:
-        number = utils.random_number(0, 50000)
-
-    return number
+        return 0, 50000
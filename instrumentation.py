@@ -0,0 +1,137 @@
+import json
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+PROGRESS_BAR_WIDTH = 30
+# Minimum time between two redraws of the progress bar, in seconds
+PROGRESS_INTERVAL = 0.2
+
+
+# The high-water mark of the resident memory of this process since it started, it never goes down
+def peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+# Collects the wall time and memory of the phases of a run, and the rows, bytes and time per table.
+# The memory of a phase is how much it raised the peak of the process: a phase that stays below the peak
+# of an earlier phase raises it by 0, although it may use a lot of memory itself
+class Instrumentation:
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.phases = dict()
+        self.tables = dict()
+
+    @contextmanager
+    def phase(self, name):
+        start_time = time.perf_counter()
+        start_peak_rss_kb = peak_rss_kb()
+        try:
+            yield
+        finally:
+            phase = self.phases.setdefault(name, {"seconds": 0.0, "calls": 0, "peak_rss_growth_kb": 0})
+            phase["seconds"] += time.perf_counter() - start_time
+            phase["calls"] += 1
+            phase["peak_rss_growth_kb"] += peak_rss_kb() - start_peak_rss_kb
+            phase["process_peak_rss_kb_so_far"] = peak_rss_kb()
+
+    def record_table(self, table_name, rows=0, sent_bytes=0, seconds=0.0, worker_peak_rss_kb=0):
+        table = self.tables.setdefault(table_name, {"rows": 0, "bytes": 0, "seconds": 0.0,
+                                                    "worker_peak_rss_kb": 0})
+        table["rows"] += rows
+        table["bytes"] += sent_bytes
+        table["seconds"] += seconds
+        table["worker_peak_rss_kb"] = max(table["worker_peak_rss_kb"], worker_peak_rss_kb)
+
+    def report(self):
+        seconds = time.perf_counter() - self.start_time
+        rows = sum(table["rows"] for table in self.tables.values())
+        sent_bytes = sum(table["bytes"] for table in self.tables.values())
+
+        tables = dict()
+        for table_name, table in self.tables.items():
+            tables[table_name] = dict(table,
+                                      rows_per_second=table["rows"] / table["seconds"] if table["seconds"] else 0.0,
+                                      bytes_per_second=table["bytes"] / table["seconds"] if table["seconds"] else 0.0)
+
+        return {
+            "seconds": seconds,
+            "rows": rows,
+            "bytes": sent_bytes,
+            "rows_per_second": rows / seconds if seconds else 0.0,
+            "peak_rss_kb": peak_rss_kb(),
+            # The largest peak that a process reported with its chunks, this process itself when it loads them.
+            # It is the peak of a single worker, not the total of all the workers
+            "largest_worker_peak_rss_kb": max((table["worker_peak_rss_kb"] for table in self.tables.values()),
+                                              default=0),
+            # The largest peak of all the child processes, the workers as well as pg_dump and pg_restore
+            "largest_child_peak_rss_kb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+            "phases": self.phases,
+            "tables": tables
+        }
+
+    def save_report(self, report_path):
+        try:
+            with open(report_path, 'w') as report_file:
+                json.dump(self.report(), report_file, indent=2)
+        except OSError as error:
+            print(f'The statistics report "{report_path}" could not be saved. Error: {error}')
+
+
+# Progress bar with the generated rows, the throughput and an estimate of the remaining time.
+# It is drawn on stderr, and only when stderr is a terminal
+class ProgressBar:
+    def __init__(self, total_rows, stream=sys.stderr):
+        self.total_rows = total_rows
+        self.rows = 0
+        self.stream = stream
+        self.enabled = stream.isatty()
+        self.start_time = time.perf_counter()
+        self.drawn_time = 0.0
+
+    def update(self, rows):
+        self.rows += rows
+        if self.enabled and time.perf_counter() - self.drawn_time >= PROGRESS_INTERVAL:
+            self.draw()
+
+    def draw(self):
+        self.drawn_time = time.perf_counter()
+        elapsed = self.drawn_time - self.start_time
+        fraction = min(self.rows / self.total_rows, 1.0) if self.total_rows else 1.0
+        rate = self.rows / elapsed if elapsed else 0.0
+        eta = format_seconds((self.total_rows - self.rows) / rate) if rate else '--:--:--'
+
+        filled = round(fraction * PROGRESS_BAR_WIDTH)
+        self.stream.write(f'\r[{"#" * filled}{" " * (PROGRESS_BAR_WIDTH - filled)}] {fraction:6.1%} '
+                          f'{self.rows}/{self.total_rows} rows, {rate:.0f} rows/s, ETA {eta}')
+        self.stream.flush()
+
+    # Removes the bar, so that a message can be printed on its line
+    def clear(self):
+        if self.enabled:
+            self.stream.write('\r\033[K')
+            self.stream.flush()
+
+    def close(self):
+        if self.enabled:
+            self.draw()
+            self.stream.write('\n')
+            self.stream.flush()
+
+
+def format_seconds(seconds):
+    seconds = int(seconds)
+    return f'{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}'
+
+
+def format_bytes(size):
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024:
+            return f'{size:.1f} {unit}'
+        size /= 1024
+
+    return f'{size:.1f} TiB'
+
+
+recorder = Instrumentation()
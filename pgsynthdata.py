@@ -1,13 +1,20 @@
 import argparse
+import cProfile
 import os
 import subprocess
 import sys
+import tempfile
 from subprocess import Popen
 
 import psycopg2
-from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from psycopg2.extensions import make_dsn
 
+import connections
+import copy_files
+import instrumentation
+import planner
 import postgres
+import sharding
 from data_generator import DataGenerator
 
 __version__ = '1.0'
@@ -29,43 +36,126 @@ examples = '''How to use pgsynthdata.py:
   \t-> Connects to database "dbin", host="myHost", port="8070", user="testuser" with password "pw1234"
   \t-> Creates new database "dbgen" with synthetic data on tables: "table1" and "table2"
   
+  python pgsynthdata.py dbin dbgen pw1234 -U testuser -generate -jobs 8
+  \t-> Connects to database "dbin", host="localhost", port="5432", user="testuser" with password "pw1234"
+  \t-> Creates new database "dbgen" with synthetic data, generating and loading 8 chunks at a time
+  
+  python pgsynthdata.py dbin dbgen pw1234 -H remoteHost -U testuser -generate -server-side -pool-size 8 -work-mem 64MB
+  \t-> Connects to database "dbin", host="remoteHost", port="5432", user="testuser" with password "pw1234"
+  \t-> Creates new database "dbgen" with synthetic data that is generated on "remoteHost" by 8 connections at a time,
+  \t   every session with work_mem set to 64MB
+  
+  python pgsynthdata.py dbin dbgen pw1234 -U testuser -generate -from-stats dbin.stats
+  \t-> Connects to database "dbin", host="localhost", port="5432", user="testuser" with password "pw1234"
+  \t-> Creates new database "dbgen" with synthetic data, using the statistics saved in "dbin.stats" while they are fresh
+  \t   (the catalog and the structure are still read from "dbin")
+  
+  python pgsynthdata.py dbin dbgen pw1234 -H remoteHost -U testuser -generate -server-side
+  \t-> Connects to database "dbin", host="remoteHost", port="5432", user="testuser" with password "pw1234"
+  \t-> Creates new database "dbgen" with synthetic data that is generated by queries on "remoteHost"
+  
+  python pgsynthdata.py dbin pw1234 -U testuser -generate -output-dir fixtures -compress gzip
+  \t-> Connects to database "dbin", host="localhost", port="5432", user="testuser" with password "pw1234"
+  \t-> Writes synthetic data as gzipped binary COPY files into the "fixtures" directory, without a target database
+  
+  python pgsynthdata.py dbin dbgen pw1234 -U testuser -generate -resume -jobs 8
+  \t-> Connects to database "dbin", host="localhost", port="5432", user="testuser" with password "pw1234"
+  \t-> Loads the chunks that are missing in the existing database "dbgen" after an interrupted run,
+  \t   the resumed data is the same as the data of an uninterrupted run
+  
+  python pgsynthdata.py dbin dbgen pw1234 -U testuser -generate -incremental -mf 5
+  \t-> Connects to database "dbin", host="localhost", port="5432", user="testuser" with password "pw1234"
+  \t-> Grows the existing database "dbgen" to 5 times the rows of "dbin", generating only the missing rows
+  
+  python pgsynthdata.py dbin dbgen pw1234 -U testuser -generate -stats-report run.json -profile run.prof
+  \t-> Connects to database "dbin", host="localhost", port="5432", user="testuser" with password "pw1234"
+  \t-> Creates new database "dbgen" with synthetic data, writes the time, throughput and memory of every phase
+  \t   and table to "run.json" and the cProfile statistics of the run to "run.prof"
+  
+  python pgsynthdata.py dbin pw1234 -U testuser -generate -targets "host=node1 dbname=synth" "host=node2 dbname=synth"
+  \t-> Connects to database "dbin", host="localhost", port="5432", user="testuser" with password "pw1234"
+  \t-> Generates the synthetic data once and loads it into the existing "synth" databases on "node1" and "node2"
+  
+  python pgsynthdata.py dbin pw1234 -U testuser -generate -targets dbname=shard1 dbname=shard2 -shard-mode hash -shard-column tourney_id
+  \t-> Connects to database "dbin", host="localhost", port="5432", user="testuser" with password "pw1234"
+  \t-> Splits the rows of the tables with a "tourney_id" column over the "shard1" and "shard2" databases
+  \t   by the hash of "tourney_id", the other tables are loaded into both
+  
+  python pgsynthdata.py dbin pw1234 -U testuser -plan -mf 20 -jobs 8 -plan-output plan.json
+  \t-> Connects to database "dbin", host="localhost", port="5432", user="testuser" with password "pw1234"
+  \t-> Estimates the rows, heap and index sizes, peak memory and time of generating 20 times the data of "dbin"
+  \t   with 8 jobs from the catalog statistics, and writes the estimates to "plan.json"
+  
   python pgsynthdata.py --version
   \t-> Show the version of this program and quit'''
 
-DUMP_FILE_PATH = 'schema.dump'
 data_generator = DataGenerator()
 
 
 def main():
     args = parse_arguments()
 
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler is not None:
+        profiler.enable()
+
+    try:
+        run(args)
+    finally:
+        connections.close_pools()
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            print(f'Saved the profile to "{args.profile}".')
+        if args.stats_report:
+            instrumentation.recorder.save_report(args.stats_report)
+            print(f'Saved the statistics report to "{args.stats_report}".')
+
+
+def run(args):
+    if args.compress and not copy_files.compression_available(args.compress):
+        sys.exit(copy_files.ZSTD_MISSING)
+
     if args.show:
         show(args)
+    elif args.plan:
+        planner.plan(args)
+    elif args.output_dir:
+        if args.server_side or args.fast_load or args.resume or args.incremental:
+            sys.exit('The "-server-side", "-fast-load", "-resume" and "-incremental" arguments need '
+                     'a DBNAMEGEN database, not "-output-dir".')
+        data_generator.generate(args)
+    elif args.targets:
+        if args.server_side or args.fast_load or args.resume or args.incremental:
+            sys.exit('The "-server-side", "-fast-load", "-resume" and "-incremental" arguments need '
+                     'a single DBNAMEGEN database, not "-targets".')
+        if args.shard_mode != 'replicate' and not args.shard_column:
+            sys.exit(f'The "-shard-mode {args.shard_mode}" argument needs a "-shard-column".')
+        if args.shard_mode == 'range' and len(args.shard_bounds or []) != len(args.targets) - 1:
+            sys.exit(f'The "-shard-mode range" argument needs {len(args.targets) - 1} "-shard-bounds" '
+                     f'for {len(args.targets)} targets.')
+
+        # The target databases have to exist, the structure of DBNAMEIN is copied into each of them
+        with instrumentation.recorder.phase('copy structure'):
+            for target in sharding.target_settings(args.targets, user=args.user, host=args.hostname,
+                                                   port=args.port, password=args.password):
+                copy_database_structure(args, target=target)
+        data_generator.generate(args)
     else:
         if args.DBNAMEGEN is None:
             sys.exit('When "-generate" argument is given, the following argument is required: DBNAMEGEN')
+        elif args.resume and args.fast_load:
+            sys.exit('Runs with "-fast-load" load into UNLOGGED tables and cannot be resumed.')
+        elif args.incremental and (args.fast_load or args.resume):
+            sys.exit('The "-incremental" argument cannot be combined with "-fast-load" or "-resume".')
         else:
-            connection = None
             try:
-
-                connection = psycopg2.connect(dbname=args.DBNAMEIN,
-                                              user=args.user,
-                                              host=args.hostname,
-                                              port=args.port,
-                                              password=args.password)
-
-                connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
-                cursor = connection.cursor()
-
-                generate(connection, cursor, args)
+                generate(args)
             except psycopg2.DatabaseError:
                 sys.exit('''Connection failed because of at least one of the following reasons:
                         Database does not exist
                         User does not exist
                         Wrong password''')
-            finally:
-                if connection is not None:
-                    connection.close()
 
 
 def parse_arguments():
@@ -82,11 +172,80 @@ def parse_arguments():
     action_group.add_argument('-show', '--show', action='store_true', help='If given, shows config')
     action_group.add_argument('-generate', '--generate', action='store_true',
                               help='If given, generates new synthesized data to database DBNAMEGEN')
+    action_group.add_argument('-plan', '--plan', action='store_true',
+                              help='If given, estimates the rows, sizes, memory and time of -generate with the same '
+                                   'arguments from the catalog of DBNAMEIN, without generating any data')
 
     parser.add_argument('-mf', '--mf', type=float, default=1.0,
                         help='Multiplication factor (mf) for the generated synthesized data (default: 1.0)')
     parser.add_argument('-tables', '--tables', type=str,
                         help='Only generate data for specific tables, separated by a comma')
+    parser.add_argument('-jobs', '--jobs', type=int, default=1,
+                        help='Number of worker processes that generate and load the tables in chunks (default: 1)')
+    parser.add_argument('-pool-size', '--pool-size', type=int, default=connections.DEFAULT_POOL_SIZE,
+                        help='Number of connections that every process keeps to a database and reuses across tables. '
+                             'With -jobs 1, that many chunks are loaded at once by threads of a single process '
+                             f'(default: {connections.DEFAULT_POOL_SIZE})')
+    parser.add_argument('-work-mem', '--work-mem', type=str, metavar='SIZE',
+                        help='Sets work_mem in every session opened by pgsynthdata, e.g. 64MB')
+    parser.add_argument('-maintenance-work-mem', '--maintenance-work-mem', type=str, metavar='SIZE',
+                        help='Sets maintenance_work_mem in every session opened by pgsynthdata, including the index '
+                             'builds of -fast-load, e.g. 1GB')
+    parser.add_argument('-queue-depth', '--queue-depth', type=int, default=4,
+                        help='Number of encoded batches of rows that are generated ahead of the COPY into DBNAMEGEN, '
+                             '0 generates and loads in turns (default: 4)')
+    parser.add_argument('-exact-stats', '--exact-stats', action='store_true',
+                        help='If given, scans every table once for its exact row count and value ranges instead of '
+                             'estimating them from the catalog statistics')
+    parser.add_argument('-save-stats', '--save-stats', type=str, metavar='FILE',
+                        help='Saves the statistics read from DBNAMEIN into a snapshot file')
+    parser.add_argument('-from-stats', '--from-stats', type=str, metavar='FILE',
+                        help='Generates from a statistics snapshot file instead of reading the statistics again, '
+                             'the snapshot is refreshed automatically when the tables were analyzed or changed since. '
+                             'DBNAMEIN must still be reachable: its catalog tells whether the snapshot is fresh and '
+                             'its structure is copied into DBNAMEGEN')
+    parser.add_argument('-fast-load', '--fast-load', action='store_true',
+                        help='If given, loads the data into UNLOGGED tables without indexes and constraints, '
+                             'which are created afterwards with -jobs parallel jobs')
+    parser.add_argument('-server-side', '--server-side', action='store_true',
+                        help='If given, the data is generated inside the DBNAMEGEN database by INSERT ... SELECT '
+                             'queries, only the column models are sent to the server')
+    parser.add_argument('-output-dir', '--output-dir', type=str, metavar='DIRECTORY',
+                        help='Writes the generated data into files in DIRECTORY instead of into the DBNAMEGEN database, '
+                             'one file per table and 100000 rows')
+    parser.add_argument('-output-format', '--output-format', choices=['binary', 'csv'], default='binary',
+                        help='Format of the files written to -output-dir: PostgreSQL binary COPY or CSV with a header '
+                             '(default: binary)')
+    parser.add_argument('-compress', '--compress', choices=['gzip', 'zstd'],
+                        help='Compresses the files written to -output-dir, zstd needs the zstandard package')
+    parser.add_argument('-targets', '--targets', type=str, nargs='+', metavar='DSN',
+                        help='Generates the data once and loads it into all the given existing databases instead of '
+                             'into DBNAMEGEN, e.g. "host=node1 dbname=synth" "host=node2 dbname=synth"')
+    parser.add_argument('-shard-mode', '--shard-mode', choices=sharding.SHARD_MODES, default='replicate',
+                        help='How the rows are spread over the -targets: every row into every target, or by the hash '
+                             'or the range of the -shard-column (default: replicate)')
+    parser.add_argument('-shard-column', '--shard-column', type=str, metavar='COLUMN',
+                        help='Column that the rows are sharded by, tables without it are replicated to all targets')
+    parser.add_argument('-shard-bounds', '--shard-bounds', type=str, nargs='+', metavar='BOUND',
+                        help='Ascending bounds between the -targets for -shard-mode range, one less than the targets')
+    parser.add_argument('-seed', '--seed', type=int,
+                        help='Seed for the random generators, the same seed generates the same data '
+                             'regardless of the number of jobs (default: random)')
+    parser.add_argument('-resume', '--resume', action='store_true',
+                        help='If given, resumes an interrupted or failed run into the existing DBNAMEGEN database, '
+                             'loading only the chunks that are missing with the seed of that run. The statistics are '
+                             'read again and must not have changed since')
+    parser.add_argument('-incremental', '--incremental', action='store_true',
+                        help='If given, tops up the existing DBNAMEGEN database to the multiplication factor, '
+                             'generating only the rows that its tables are missing')
+    parser.add_argument('-stats-report', '--stats-report', type=str, metavar='FILE',
+                        help='Writes the time and peak memory of every phase and the rows, bytes and throughput '
+                             'of every table into a JSON file')
+    parser.add_argument('-plan-output', '--plan-output', type=str, metavar='FILE',
+                        help='Writes the estimates of -plan into a JSON file')
+    parser.add_argument('-profile', '--profile', type=str, metavar='FILE',
+                        help='Profiles the run with cProfile and writes the statistics into FILE, '
+                             'the worker processes of -jobs are not included')
 
     parser.add_argument('-O', '--owner', type=str, help='Owner of the database, default: same as user')
     parser.add_argument('-H', '--hostname', type=str, help='Specifies the host name, default: localhost')
@@ -97,70 +256,168 @@ def parse_arguments():
 
 
 def show(args):
-    connection = None
+    source_pool = connections.get_pool(connections.connection_settings(args, args.DBNAMEIN), args.pool_size)
     try:
-        connection = psycopg2.connect(dbname=args.DBNAMEIN,
-                                      user=args.user,
-                                      host=args.hostname,
-                                      port=args.port,
-                                      password=args.password)
-
-        cursor = connection.cursor()
+        with source_pool.connection() as connection:
+            cursor = connection.cursor()
 
-        postgres.show_database_stats(cursor, args.tables)
-        cursor.close()
+            postgres.show_database_stats(cursor, args.tables)
+            cursor.close()
 
     except psycopg2.DatabaseError:
         sys.exit('''Connection failed because of at least one of the following reasons:
                     Database does not exist
                     User does not exist
                     Wrong password''')
-    finally:
-        if connection is not None:
-            connection.close()
 
 
-def generate(connection, cursor, args):
-    postgres.create_database(connection, cursor, args.DBNAMEGEN, args.owner)
-    copy_database_structure(args)
-    data_generator.generate(args)
-    cursor.close()
+# The connection to DBNAMEIN is borrowed from the pool that the statistics are read with later on
+def generate(args):
+    recorder = instrumentation.recorder
 
+    # Resumed runs and top-ups load into the database and the structure that an earlier run created
+    existing_database = args.resume or args.incremental
+    if not existing_database:
+        source_pool = connections.get_pool(connections.connection_settings(args, args.DBNAMEIN), args.pool_size)
+        with recorder.phase('create database'), source_pool.connection(autocommit=True) as connection:
+            cursor = connection.cursor()
+            postgres.create_database(connection, cursor, args.DBNAMEGEN, args.owner)
+            cursor.close()
 
-def copy_database_structure(args):
-    print(f'Copying the "{args.DBNAMEGEN}" database structure...')
+    if args.fast_load:
+        fast_load(args)
+    else:
+        if not existing_database:
+            with recorder.phase('copy structure'):
+                copy_database_structure(args)
+        data_generator.generate(args)
+
+
+def fast_load(args):
+    # The data is loaded into bare UNLOGGED tables, the indexes and constraints are only created afterwards.
+    # The post-data section is dumped before the load so that both sections come from the same schema
+    recorder = instrumentation.recorder
+    with recorder.phase('copy structure'):
+        post_data_dump = dump_database_structure(args, section='post-data')
+        copy_database_structure(args, section='pre-data')
+
+    # The connection is given back to the pool during the load, which borrows the connections of the same pool
+    target_pool = connections.get_pool(connections.connection_settings(args, args.DBNAMEGEN), args.pool_size)
+    try:
+        with recorder.phase('set tables unlogged'), target_pool.connection() as target_connection:
+            target_cursor = target_connection.cursor()
+            unlogged_tables = postgres.set_tables_unlogged(target_connection, target_cursor)
+            target_cursor.close()
+        data_generator.generate(args)
+
+        print(f'Switching the tables of the "{args.DBNAMEGEN}" database back to LOGGED...')
+        with recorder.phase('set tables logged'), target_pool.connection() as target_connection:
+            target_cursor = target_connection.cursor()
+            postgres.set_tables_logged(target_connection, target_cursor, unlogged_tables)
+            target_cursor.close()
+    except psycopg2.DatabaseError as error:
+        sys.exit('Could not prepare the "{0}" database for fast loading. Error: {1}'.format(args.DBNAMEGEN, error))
+
+    print(f'Creating the indexes and constraints of the "{args.DBNAMEGEN}" database...')
+    with recorder.phase('create indexes and constraints'):
+        restore_database_structure(args, post_data_dump, jobs=args.jobs)
+
+
+def postgres_command(program, args, db_name):
+    command = [program, f'--dbname={db_name}']
+    if args.hostname:
+        command.append(f'--host={args.hostname}')
+    if args.port:
+        command.append(f'--port={args.port}')
+    if args.user:
+        command.append(f'--username={args.user}')
+
+    return command
+
+
+# The session settings also apply to pg_restore, whose index builds use maintenance_work_mem
+def postgres_environment(args):
+    environment = dict(os.environ)
+    environment['PGPASSWORD'] = args.password
+    options = connections.session_options(args)
+    if options:
+        environment['PGOPTIONS'] = ' '.join(filter(None, [environment.get('PGOPTIONS'), options]))
+
+    return environment
+
+
+# The target is the connection settings of one of the -targets, by default the structure is copied into DBNAMEGEN
+def copy_database_structure(args, section=None, target=None):
+    if target is not None:
+        target_name = sharding.target_name(target)
+        restore_command = ['pg_restore', '--dbname=' + make_dsn(**{key: value for key, value in target.items()
+                                                                    if key != 'password'})]
+        environment = dict(postgres_environment(args), PGPASSWORD=target.get("password", args.password))
+    else:
+        target_name = args.DBNAMEGEN
+        restore_command = postgres_command('pg_restore', args, args.DBNAMEGEN)
+        environment = postgres_environment(args)
+    print(f'Copying the "{target_name}" database structure...')
+
+    dump_command = postgres_command('pg_dump', args, args.DBNAMEIN) + ['-s', '-Fc']
+    if section:
+        dump_command.append(f'--section={section}')
 
+    # The dump is streamed straight into pg_restore, without going through a file
     try:
-        process = Popen(['pg_dump',
-                         '--dbname=postgresql://{}:{}@{}:{}/{}'.format(args.user,
-                                                                       args.password,
-                                                                       'localhost',
-                                                                       '5432',
-                                                                       args.DBNAMEIN),
-                         '-s',
-                         '-Fc',
-                         '-f', DUMP_FILE_PATH
-                         ],
-                        stdout=subprocess.PIPE)
-
-        process.communicate()[0]
-
-        process = Popen(['pg_restore',
-                         '--dbname=postgresql://{}:{}@{}:{}/{}'.format(args.user,
-                                                                       args.password,
-                                                                       'localhost',
-                                                                       '5432',
-                                                                       args.DBNAMEGEN),
-                         DUMP_FILE_PATH],
-                        stdout=subprocess.PIPE
-                        )
-
-        process.communicate()[0]
+        dump_process = Popen(dump_command, stdout=subprocess.PIPE, env=postgres_environment(args))
+        restore_process = Popen(restore_command, stdin=dump_process.stdout, env=environment)
+        dump_process.stdout.close()
+
+        restore_process.communicate()
+        dump_process.wait()
     except Exception as error:
         sys.exit('Database structure could not be copied. Error: {}'.format(error))
-    finally:
-        if os.path.exists(DUMP_FILE_PATH):
-            os.remove(DUMP_FILE_PATH)
+
+    if dump_process.returncode != 0:
+        sys.exit('Database structure could not be copied, pg_dump exited with code {}.'.format(
+            dump_process.returncode))
+    if restore_process.returncode != 0:
+        print(f'pg_restore reported errors while copying the "{target_name}" database structure.')
+
+
+def dump_database_structure(args, section=None):
+    dump_command = postgres_command('pg_dump', args, args.DBNAMEIN) + ['-s', '-Fc']
+    if section:
+        dump_command.append(f'--section={section}')
+
+    try:
+        process = Popen(dump_command, stdout=subprocess.PIPE, env=postgres_environment(args))
+        dump = process.communicate()[0]
+    except Exception as error:
+        sys.exit('Database structure could not be copied. Error: {}'.format(error))
+
+    if process.returncode != 0:
+        sys.exit('Database structure could not be copied, pg_dump exited with code {}.'.format(process.returncode))
+
+    return dump
+
+
+def restore_database_structure(args, dump, jobs=1):
+    restore_command = postgres_command('pg_restore', args, args.DBNAMEGEN)
+
+    try:
+        if jobs > 1:
+            # Parallel restores need a seekable archive, so the dump goes into a private temporary file
+            with tempfile.NamedTemporaryFile(suffix='.dump') as dump_file:
+                dump_file.write(dump)
+                dump_file.flush()
+
+                process = Popen(restore_command + [f'--jobs={jobs}', dump_file.name], env=postgres_environment(args))
+                process.communicate()
+        else:
+            process = Popen(restore_command, stdin=subprocess.PIPE, env=postgres_environment(args))
+            process.communicate(dump)
+    except Exception as error:
+        sys.exit('Database structure could not be copied. Error: {}'.format(error))
+
+    if process.returncode != 0:
+        print(f'pg_restore reported errors while copying the "{args.DBNAMEGEN}" database structure.')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,330 @@
+import json
+import os
+import shutil
+import sys
+import time
+import tracemalloc
+
+import psycopg2
+
+import connections
+import copy_stream
+import data_generator
+import instrumentation
+import postgres
+import samplers
+from data_generator import DataGenerator
+
+PAGE_SIZE = 8192
+# The header of every page and the special space of the B-tree pages, in bytes
+PAGE_HEADER_SIZE = 24
+BTREE_SPECIAL_SIZE = 16
+# Every row has a header of 23 bytes and its null bitmap, every index entry a header of 8 bytes,
+# and both have a line pointer of 4 bytes. Headers and values are aligned to 8 bytes
+ROW_HEADER_SIZE = 23
+INDEX_ENTRY_HEADER_SIZE = 8
+LINE_POINTER_SIZE = 4
+ALIGNMENT = 8
+# Duplicates in a B-tree are kept as a single entry with a list of 6 byte heap pointers
+POSTING_SIZE = 6
+# B-tree leaf pages are filled to 90% by the default fillfactor
+INDEX_FILL_FACTOR = 0.9
+
+# Widths of the columns without statistics, in bytes
+TYPE_WIDTHS = {
+    'smallint': 2,
+    'integer': 4,
+    'bigint': 8,
+    'decimal': 8,
+    'numeric': 8,
+    'date': 4,
+    'timestamp': 8,
+    'timestamp without time zone': 8,
+    'boolean': 1,
+    'bool': 1
+}
+DEFAULT_TEXT_WIDTH = 32
+EXPRESSION_WIDTH = 8
+
+# Tables whose generation needs more than this share of the physical memory are reported
+MEMORY_WARNING_SHARE = 0.8
+
+
+# Estimates the rows, the heap and index sizes, the peak memory and the time of a run from the catalog of DBNAMEIN,
+# without reading any rows. The time and memory come from generating one batch of every table locally
+def plan(args):
+    generator = DataGenerator()
+    generator.seed = args.seed if args.seed is not None else 0
+    generator.table_information = dict()
+
+    source_pool = connections.get_pool(connections.connection_settings(args, args.DBNAMEIN), args.pool_size)
+    try:
+        with source_pool.connection() as connection:
+            cursor = connection.cursor()
+
+            table_results = postgres.filter_tables(postgres.get_tables(cursor), args.tables)
+            metadata = postgres.get_database_metadata(cursor, table_results)
+            indexes = postgres.get_indexes(cursor, table_results)
+            data_directory = postgres.get_data_directory(cursor)
+            generator.collect_table_information(cursor, table_results, False, metadata)
+
+            cursor.close()
+    except psycopg2.OperationalError as error:
+        sys.exit('Could not connect to the "{0}" database. Error description: {1}'.format(args.DBNAMEIN, error))
+
+    table_models = [table_model for table_model in
+                    (generator.create_table_model(args.mf, postgres.qualified_name(table_entry[0], table_entry[1]))
+                     for table_entry in table_results) if table_model is not None]
+    base_memory = instrumentation.peak_rss_kb() * 1024
+
+    tables = dict()
+    for table_model in table_models:
+        identifier = tuple(table_model["identifier"])
+        tables[table_model["table_name"]] = plan_table(table_model, metadata[identifier], indexes[identifier],
+                                                       generator.seed, args.queue_depth)
+
+    # The keys of the referenced tables are held by the main process and by every worker
+    for table_model in table_models:
+        table = tables[table_model["table_name"]]
+        table["key_bytes"] = round(sum(
+            key_bytes_per_row * referenced_rows(tables, table_models, referenced_table)
+            for referenced_table, key_bytes_per_row in table.pop("key_bytes_per_row")))
+        table["worker_memory_bytes"] += table["key_bytes"]
+
+    seconds = 0.0
+    peak_memory = base_memory
+    for wave in data_generator.dependency_waves(table_models):
+        wave_tables = [tables[table_model["table_name"]] for table_model in wave]
+        wave_jobs = min(args.jobs, sum(table["chunks"] for table in wave_tables)) or 1
+
+        seconds += max(sum(table["seconds"] for table in wave_tables) / wave_jobs,
+                       max(table["chunk_seconds"] for table in wave_tables))
+        peak_memory = max(peak_memory, base_memory + sum(table["key_bytes"] for table in wave_tables)
+                          + wave_jobs * max(table["worker_memory_bytes"] for table in wave_tables))
+
+    load_plan = {
+        "settings": {
+            "mf": args.mf,
+            "jobs": args.jobs,
+            "queue_depth": args.queue_depth
+        },
+        "tables": tables,
+        "total": {
+            "rows": sum(table["rows"] for table in tables.values()),
+            "heap_bytes": sum(table["heap_bytes"] for table in tables.values()),
+            "index_bytes": sum(table["index_bytes"] for table in tables.values()),
+            "copy_bytes": sum(table["copy_bytes"] for table in tables.values()),
+            "peak_memory_bytes": peak_memory,
+            "seconds": seconds
+        }
+    }
+    load_plan["warnings"] = plan_warnings(load_plan, args, data_directory)
+
+    print_plan(load_plan)
+    if args.plan_output:
+        try:
+            with open(args.plan_output, 'w') as plan_file:
+                json.dump(load_plan, plan_file, indent=2)
+            print(f'Saved the plan to "{args.plan_output}".')
+        except OSError as error:
+            sys.exit(f'The plan "{args.plan_output}" could not be saved. Error: {error}')
+
+    return load_plan
+
+
+def plan_table(table_model, table_metadata, table_indexes, seed, queue_depth):
+    rows = table_model["rows_to_generate"]
+    columns = column_widths(table_metadata)
+    sample = measure_sample(table_model, seed)
+    batch_rows = min(rows, data_generator.BATCH_SIZE)
+    largest_chunk = max((chunk_rows for _, chunk_rows in table_model["chunks"]), default=0)
+
+    return {
+        "rows": rows,
+        "chunks": len(table_model["chunks"]),
+        "heap_bytes": heap_size(rows, columns),
+        "index_bytes": sum(index_size(rows, columns, index_entry) for index_entry in table_indexes),
+        "copy_bytes": round(rows * sample["bytes_per_row"]),
+        "seconds": rows * sample["seconds_per_row"],
+        "chunk_seconds": largest_chunk * sample["seconds_per_row"],
+        # A worker holds the batch in generation and the encoded batches queued ahead of the COPY
+        "worker_memory_bytes": round(batch_rows * (sample["memory_per_row"] + queue_depth * sample["bytes_per_row"])),
+        "key_bytes_per_row": sample["key_bytes_per_row"]
+    }
+
+
+# The average width, the share of NULLs and the number of distinct values of every column
+def column_widths(table_metadata):
+    column_stats = {stats_entry[0]: stats_entry for stats_entry in table_metadata["stats"]}
+
+    columns = dict()
+    for column_entry in table_metadata["columns"]:
+        stats_entry = column_stats.get(column_entry[0])
+        if stats_entry is not None:
+            columns[column_entry[0]] = dict(width=stats_entry[2], null_frac=stats_entry[1], n_distinct=stats_entry[3])
+        else:
+            columns[column_entry[0]] = dict(width=TYPE_WIDTHS.get(column_entry[1],
+                                                                  min(column_entry[2] or DEFAULT_TEXT_WIDTH,
+                                                                      DEFAULT_TEXT_WIDTH)),
+                                            null_frac=0.0, n_distinct=None)
+
+    return columns
+
+
+def heap_size(rows, columns):
+    null_bitmap = (len(columns) + 7) // 8 if any(column["null_frac"] for column in columns.values()) else 0
+    data_width = sum(column["width"] * (1 - column["null_frac"]) for column in columns.values())
+    row_size = aligned(ROW_HEADER_SIZE + null_bitmap) + aligned(data_width)
+    rows_per_page = max((PAGE_SIZE - PAGE_HEADER_SIZE) // (row_size + LINE_POINTER_SIZE), 1)
+
+    return -(-rows // rows_per_page) * PAGE_SIZE
+
+
+# Every index is estimated as a B-tree. The duplicates of a single column index are deduplicated
+def index_size(rows, columns, index_entry):
+    is_unique, column_names = index_entry[1], index_entry[3]
+    key_width = sum(columns[column_name]["width"] if column_name in columns else EXPRESSION_WIDTH
+                    for column_name in column_names)
+    entry_size = aligned(INDEX_ENTRY_HEADER_SIZE + key_width) + LINE_POINTER_SIZE
+    page_space = (PAGE_SIZE - PAGE_HEADER_SIZE - BTREE_SPECIAL_SIZE) * INDEX_FILL_FACTOR
+    entries_per_page = max(int(page_space // entry_size), 2)
+
+    entries, posting_bytes = rows, 0
+    if not is_unique and len(column_names) == 1 and columns.get(column_names[0], {}).get("n_distinct"):
+        entries = distinct_values(columns[column_names[0]]["n_distinct"], rows)
+        posting_bytes = (rows - entries) * POSTING_SIZE
+
+    leaf_pages = -(-entries // entries_per_page) + int(-(-posting_bytes // page_space))
+    # The inner pages and the meta page
+    return (leaf_pages + -(-leaf_pages // entries_per_page) + 1) * PAGE_SIZE
+
+
+def distinct_values(n_distinct, rows):
+    if n_distinct < 0:
+        return max(round(-n_distinct * rows), 1)
+
+    return max(min(round(n_distinct), rows), 1)
+
+
+def aligned(size):
+    return int(-(-size // ALIGNMENT) * ALIGNMENT)
+
+
+# Generates and encodes one batch of the table like a worker does, once for the memory, which tracemalloc
+# slows down, and once more for the time and the COPY bytes. Foreign keys are drawn from keys generated
+# by their fallback samplers, so that the sample costs as much as with the referenced keys
+def measure_sample(table_model, seed):
+    sample_rows = min(table_model["rows_to_generate"], data_generator.BATCH_SIZE)
+    if sample_rows == 0:
+        return dict(seconds_per_row=0.0, bytes_per_row=0.0, memory_per_row=0.0, key_bytes_per_row=[])
+
+    rng = data_generator.create_rng(seed, table_model["table_name"], data_generator.CHUNK_STREAM, 0)
+    key_bytes_per_row = list()
+    for column_sampler in table_model["column_samplers"]:
+        if isinstance(column_sampler, samplers.ForeignKeySampler):
+            keys = [fallback_sampler.sample(rng, sample_rows) for fallback_sampler in column_sampler.fallback_samplers]
+            column_sampler.attach_keys(keys, rng)
+            key_bytes_per_row.append((column_sampler.referenced_table,
+                                      sum(array_bytes(key_column) for key_column in keys) / sample_rows))
+
+    tracemalloc.start()
+    for columns in data_generator.generate_batches(table_model["column_samplers"], sample_rows, rng):
+        copy_stream.encode_columns(columns)
+    memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    start_time = time.perf_counter()
+    encoded_bytes = sum(len(copy_stream.encode_columns(columns)) for columns in
+                        data_generator.generate_batches(table_model["column_samplers"], sample_rows, rng))
+    seconds = time.perf_counter() - start_time
+
+    return dict(seconds_per_row=seconds / sample_rows, bytes_per_row=encoded_bytes / sample_rows,
+                memory_per_row=memory / sample_rows, key_bytes_per_row=key_bytes_per_row)
+
+
+def array_bytes(values):
+    if values.dtype != object:
+        return values.nbytes
+
+    return values.nbytes + sum(sys.getsizeof(value) for value in values.tolist() if value is not None)
+
+
+# The rows of a referenced partitioned table are the rows of its partitions
+def referenced_rows(tables, table_models, referenced_table):
+    return sum(tables[table_model["table_name"]]["rows"] for table_model in table_models
+               if table_model["table_name"] == referenced_table or referenced_table in table_model["partition_of"])
+
+
+def plan_warnings(load_plan, args, data_directory):
+    warnings = list()
+
+    physical_memory = physical_memory_bytes()
+    if physical_memory:
+        for table_name, table in load_plan["tables"].items():
+            table_memory = min(args.jobs, table["chunks"]) * table["worker_memory_bytes"] + table["key_bytes"]
+            if table_memory > physical_memory * MEMORY_WARNING_SHARE:
+                warnings.append(f'The "{table_name}" table needs about {instrumentation.format_bytes(table_memory)} '
+                                f'of memory with {args.jobs} job(s), more than '
+                                f'{MEMORY_WARNING_SHARE:.0%} of the {instrumentation.format_bytes(physical_memory)} '
+                                f'of this machine. Use fewer -jobs or a lower -queue-depth.')
+
+    # The files are written uncompressed when they are estimated. The server's disk is only known when
+    # the server runs on this machine and its data directory can be read
+    if args.output_dir:
+        disk_path, size_key = args.output_dir, "copy_bytes"
+    elif data_directory and args.hostname in (None, 'localhost', '127.0.0.1') and os.path.isdir(data_directory):
+        disk_path, size_key = data_directory, None
+    else:
+        return warnings
+
+    free_bytes = free_disk_bytes(disk_path)
+    used_bytes = 0
+    for table_name, table in load_plan["tables"].items():
+        used_bytes += table[size_key] if size_key else table["heap_bytes"] + table["index_bytes"]
+        if free_bytes is not None and used_bytes > free_bytes:
+            warnings.append(f'The disk of "{disk_path}" runs full at the "{table_name}" table: '
+                            f'{instrumentation.format_bytes(used_bytes)} are needed up to it, '
+                            f'but only {instrumentation.format_bytes(free_bytes)} are free.')
+            break
+
+    return warnings
+
+
+def physical_memory_bytes():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def free_disk_bytes(path):
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+
+    try:
+        return shutil.disk_usage(path).free
+    except OSError:
+        return None
+
+
+def print_plan(load_plan):
+    format_bytes = instrumentation.format_bytes
+    print(f'{"Table":<40} {"Rows":>12} {"Heap":>11} {"Indexes":>11} {"COPY":>11} {"Memory":>11} {"Time":>9}')
+    for table_name, table in load_plan["tables"].items():
+        print(f'{table_name:<40} {table["rows"]:>12} {format_bytes(table["heap_bytes"]):>11} '
+              f'{format_bytes(table["index_bytes"]):>11} {format_bytes(table["copy_bytes"]):>11} '
+              f'{format_bytes(table["worker_memory_bytes"]):>11} '
+              f'{instrumentation.format_seconds(table["seconds"]):>9}')
+
+    total = load_plan["total"]
+    settings = load_plan["settings"]
+    print(f'{"Total":<40} {total["rows"]:>12} {format_bytes(total["heap_bytes"]):>11} '
+          f'{format_bytes(total["index_bytes"]):>11} {format_bytes(total["copy_bytes"]):>11}')
+    print(f'\nEstimated for -mf {settings["mf"]} with {settings["jobs"]} job(s): '
+          f'{instrumentation.format_seconds(total["seconds"])} and a peak client memory of '
+          f'{format_bytes(total["peak_memory_bytes"])}. The time is the generation time of this machine, '
+          f'a slower server takes longer.')
+
+    for warning in load_plan["warnings"]:
+        print(f'Warning: {warning}')
@@ -1,8 +1,18 @@
+import re
 import sys
 
+import numpy
 import psycopg2
 from psycopg2 import sql
 
+from copy_stream import COPY_BUFFER_SIZE
+
+KEY_BATCH_SIZE = 100000
+
+# The literals of a partition bound: quoted values or bare words like numbers, NULL, MINVALUE and MAXVALUE
+PARTITION_LITERAL = re.compile(r"'((?:[^']|'')*)'|([^\s,]+)")
+UNBOUNDED_LITERALS = ('NULL', 'MINVALUE', 'MAXVALUE')
+
 
 class DataTypes:
     VARCHAR_TYPES = [
@@ -60,16 +70,39 @@ def truncate_tables(connection, cursor):
     tables = get_tables(cursor)
 
     for table_info in tables:
-        table_name = table_info[1]
+        table_name = qualified_name(table_info[0], table_info[1])
 
         try:
-            cursor.execute(f"""TRUNCATE TABLE {table_name};""")
+            cursor.execute(sql.SQL("TRUNCATE TABLE {};").format(sql.Identifier(table_info[0], table_info[1])))
         except psycopg2.DatabaseError as error:
             sys.exit('Could not truncate table "{0}". Error description: {1}'.format(table_name, error))
 
         connection.commit()
 
 
+def set_tables_unlogged(connection, cursor):
+    cursor.execute("""
+        SELECT n.nspname, c.relname
+        FROM   pg_class c
+        JOIN   pg_namespace n ON n.oid = c.relnamespace
+        WHERE  n.nspname NOT IN ('pg_catalog', 'information_schema') AND
+               c.relkind = 'r' AND
+               c.relpersistence = 'p';""")
+    tables = cursor.fetchall()
+
+    for table_info in tables:
+        cursor.execute(sql.SQL("ALTER TABLE {} SET UNLOGGED;").format(sql.Identifier(table_info[0], table_info[1])))
+    connection.commit()
+
+    return tables
+
+
+def set_tables_logged(connection, cursor, tables):
+    for table_info in tables:
+        cursor.execute(sql.SQL("ALTER TABLE {} SET LOGGED;").format(sql.Identifier(table_info[0], table_info[1])))
+    connection.commit()
+
+
 def analyze_database(cursor, db_name):
     try:
         print('Retrieving statistics from the "{0}" database.'.format(db_name))
@@ -79,30 +112,63 @@ def analyze_database(cursor, db_name):
 
 
 def show_database_stats(cursor, tables_arg):
-    tables = get_tables(cursor)
-
-    tables_list = None
-    if tables_arg:
-        tables_list = tables_arg.split(",")
-        tables_list = [table.strip(' ') for table in tables_list]
+    tables = filter_tables(get_tables(cursor), tables_arg)
+    metadata = get_database_metadata(cursor, tables)
 
     for table_info in tables:
-        table_name = table_info[1]
+        print(f'\n -- {qualified_name(table_info[0], table_info[1])} -- \n')
+        print(metadata[(table_info[0], table_info[1])]["stats"])
+
+
+def qualified_name(schema_name, table_name):
+    return f'{schema_name}.{table_name}'
+
+
+def filter_tables(tables, tables_arg):
+    if not tables_arg:
+        return tables
 
-        if tables_list:
-            if table_name not in tables_list:
-                continue
-        sub_result = get_table_stats(cursor, table_name)
+    tables_list = [table.strip(' ') for table in tables_arg.split(",")]
 
-        print(f'\n -- {table_name} -- \n')
-        print(sub_result)
+    # A partitioned table stands for all of its partitions
+    return [table_info for table_info in tables
+            if table_info[1] in tables_list or qualified_name(table_info[0], table_info[1]) in tables_list
+            or any(ancestor in tables_list or ancestor.split('.', 1)[1] in tables_list
+                   for ancestor in table_info[4])]
+
+
+# Servers before PostgreSQL 10 have no declarative partitioning, and no relispartition column
+PARTITIONING_VERSION = 100000
+# Servers before PostgreSQL 11 have no INCLUDE columns in their indexes, and no indnkeyatts column
+INCLUDE_COLUMNS_VERSION = 110000
+
+# The partitioned tables above a partition, from the root down, by walking up pg_inherits
+# as long as the table is a partition. Works on all servers with declarative partitioning
+PARTITION_ANCESTORS = """
+            ARRAY(WITH RECURSIVE ancestors(relid, depth) AS (
+                      SELECT i.inhparent, 1 FROM pg_inherits i WHERE i.inhrelid = C.oid AND C.relispartition
+                      UNION ALL
+                      SELECT i.inhparent, a.depth + 1
+                      FROM   ancestors a
+                      JOIN   pg_class ac ON ac.oid = a.relid AND ac.relispartition
+                      JOIN   pg_inherits i ON i.inhrelid = a.relid)
+                  SELECT an.nspname || '.' || ac.relname
+                  FROM   ancestors a
+                  JOIN   pg_class ac ON ac.oid = a.relid
+                  JOIN   pg_namespace an ON an.oid = ac.relnamespace
+                  ORDER  BY a.depth DESC)"""
 
 
 def get_tables(cursor):
     try:
+        # Partitioned tables hold no rows themselves, their partitions are generated and loaded like tables
+        # and come with the names of the partitioned tables above them
+        ancestors = PARTITION_ANCESTORS if cursor.connection.server_version >= PARTITIONING_VERSION \
+            else "ARRAY[]::text[]"
         cursor.execute("""
         SELECT 
-            nspname AS schemaname,relname as tablename, reltuples::bigint as rowcount,rank() over(order by reltuples desc)
+            nspname AS schemaname,relname as tablename, reltuples::bigint as rowcount,rank() over(order by reltuples desc),
+            """ + ancestors + """ AS ancestors
         FROM pg_class C
         LEFT JOIN pg_namespace N ON (N.oid = C.relnamespace)
         WHERE 
@@ -115,50 +181,322 @@ def get_tables(cursor):
         sys.exit('Could not retrieve the database\'s table information. Error description: {0}'.format(error))
 
 
-def get_table_stats(cursor, table_name):
+# Reads the columns, primary keys, foreign keys and statistics of all the given tables with one query each,
+# instead of one round-trip per table and kind of information
+def get_database_metadata(cursor, tables):
+    metadata = dict()
+    for table_info in tables:
+        metadata[(table_info[0], table_info[1])] = {
+            "columns": list(),
+            "unique_keys": list(),
+            "foreign_keys": list(),
+            "stats": list(),
+            "partition_levels": list()
+        }
+
+    table_filter = ([table_info[0] for table_info in tables], [table_info[1] for table_info in tables])
+    server_version = cursor.connection.server_version
+
     try:
-        cursor.execute(f"""
+        cursor.execute("""
+            SELECT 
+                c.table_schema, c.table_name,
+                column_name, data_type, character_maximum_length,
+                column_default,
+                numeric_precision, numeric_precision_radix, numeric_scale,
+                is_nullable = 'YES'
+            FROM   information_schema.columns c
+            JOIN   unnest(%s::text[], %s::text[]) AS t(schema_name, table_name)
+                   ON c.table_schema = t.schema_name AND c.table_name = t.table_name
+            ORDER  BY c.table_schema, c.table_name, c.ordinal_position;
+            """, table_filter)
+
+        for row in cursor.fetchall():
+            metadata[(row[0], row[1])]["columns"].append(row[2:])
+
+        # The primary key and the unique indexes on columns, the primary key first
+        cursor.execute("""
+            SELECT 
+                n.nspname, c.relname, i.indisprimary,
+                ARRAY(SELECT a.attname::text
+                      FROM   unnest(i.indkey::int2[]) WITH ORDINALITY AS k(attnum, position)
+                      JOIN   pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+                      ORDER  BY k.position)
+            FROM   pg_index i
+            JOIN   pg_class c ON c.oid = i.indrelid
+            JOIN   pg_namespace n ON n.oid = c.relnamespace
+            JOIN   unnest(%s::text[], %s::text[]) AS t(schema_name, table_name)
+                   ON n.nspname = t.schema_name AND c.relname = t.table_name
+            WHERE  i.indisunique AND i.indexprs IS NULL""" +
+                       (" AND i.indnkeyatts = i.indnatts" if server_version >= INCLUDE_COLUMNS_VERSION else "") + """
+            ORDER  BY n.nspname, c.relname, i.indisprimary DESC, i.indexrelid::regclass::text;""", table_filter)
+
+        for row in cursor.fetchall():
+            metadata[(row[0], row[1])]["unique_keys"].append(row[2:])
+
+        cursor.execute("""
+            SELECT 
+                n.nspname, c.relname, con.conname,
+                array_agg(a.attname::text ORDER BY k.position),
+                rn.nspname, rc.relname,
+                array_agg(ra.attname::text ORDER BY k.position)
+            FROM   pg_constraint con
+            JOIN   pg_class c ON c.oid = con.conrelid
+            JOIN   pg_namespace n ON n.oid = c.relnamespace
+            JOIN   unnest(%s::text[], %s::text[]) AS t(schema_name, table_name)
+                   ON n.nspname = t.schema_name AND c.relname = t.table_name
+            JOIN   pg_class rc ON rc.oid = con.confrelid
+            JOIN   pg_namespace rn ON rn.oid = rc.relnamespace
+            CROSS  JOIN LATERAL unnest(con.conkey, con.confkey) WITH ORDINALITY AS k(attnum, ref_attnum, position)
+            JOIN   pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.attnum
+            JOIN   pg_attribute ra ON ra.attrelid = con.confrelid AND ra.attnum = k.ref_attnum
+            WHERE  con.contype = 'f'
+            GROUP  BY n.nspname, c.relname, con.conname, rn.nspname, rc.relname;""", table_filter)
+
+        for row in cursor.fetchall():
+            metadata[(row[0], row[1])]["foreign_keys"].append(row[2:])
+
+        cursor.execute("""
            select 
+            s.schemaname, s.tablename,
             attname, null_frac, avg_width, n_distinct, 
             most_common_vals, most_common_freqs, histogram_bounds, 
             correlation 
-           from pg_stats 
-           where schemaname not in ('pg_catalog') and tablename = '{table_name}'""")
+           from pg_stats s
+           join unnest(%s::text[], %s::text[]) as t(schema_name, table_name)
+                on s.schemaname = t.schema_name and s.tablename = t.table_name
+           where not s.inherited""", table_filter)
+
+        for row in cursor.fetchall():
+            metadata[(row[0], row[1])]["stats"].append(row[2:])
+
+        # One row per level of the partition hierarchy above a partition, from the root down to the partition:
+        # the partitioned table, its strategy, its key column (NULL for expressions and several columns)
+        # and the bound of the partition within it
+        if server_version >= PARTITIONING_VERSION:
+            cursor.execute("""
+                WITH RECURSIVE levels(table_oid, relid, depth) AS (
+                    SELECT c.oid, c.oid, 0
+                    FROM   pg_class c
+                    JOIN   pg_namespace n ON n.oid = c.relnamespace
+                    JOIN   unnest(%s::text[], %s::text[]) AS t(schema_name, table_name)
+                           ON n.nspname = t.schema_name AND c.relname = t.table_name
+                    WHERE  c.relispartition
+                    UNION ALL
+                    SELECT l.table_oid, i.inhparent, l.depth + 1
+                    FROM   levels l
+                    JOIN   pg_inherits i ON i.inhrelid = l.relid
+                    JOIN   pg_class pc ON pc.oid = i.inhparent AND pc.relispartition)
+                SELECT 
+                    n.nspname, c.relname,
+                    pn.nspname, p.relname, pt.partstrat, ka.attname,
+                    pg_get_expr(lc.relpartbound, lc.oid)
+                FROM   levels l
+                JOIN   pg_class c ON c.oid = l.table_oid
+                JOIN   pg_namespace n ON n.oid = c.relnamespace
+                JOIN   pg_class lc ON lc.oid = l.relid
+                JOIN   pg_inherits i ON i.inhrelid = lc.oid
+                JOIN   pg_class p ON p.oid = i.inhparent
+                JOIN   pg_namespace pn ON pn.oid = p.relnamespace
+                JOIN   pg_partitioned_table pt ON pt.partrelid = p.oid
+                LEFT   JOIN pg_attribute ka ON ka.attrelid = p.oid AND ka.attnum = pt.partattrs[0]
+                                            AND pt.partnatts = 1
+                ORDER  BY n.nspname, c.relname, l.depth DESC;""", table_filter)
+
+            for row in cursor.fetchall():
+                metadata[(row[0], row[1])]["partition_levels"].append(row[2:])
+    except psycopg2.DatabaseError as error:
+        sys.exit('Could not retrieve the database\'s metadata. Error description: {0}'.format(error))
 
-        return cursor.fetchall()
+    return metadata
+
+
+# Moves the sequences owned by the given columns past the largest value of their column, so that the rows
+# inserted later with the column default do not collide with the generated ones
+def advance_sequences(connection, schema_name, table_name, column_names):
+    table = sql.Identifier(schema_name, table_name)
+    try:
+        with connection.cursor() as cursor:
+            for column_name in column_names:
+                cursor.execute("SELECT pg_get_serial_sequence(%s, %s)", (table.as_string(cursor), column_name))
+                sequence = cursor.fetchone()[0]
+                if sequence is not None:
+                    cursor.execute(sql.SQL("SELECT setval(%s, max({})) FROM {} HAVING max({}) IS NOT NULL").format(
+                        sql.Identifier(column_name), table, sql.Identifier(column_name)), (sequence,))
+        connection.commit()
     except psycopg2.DatabaseError as error:
-        sys.exit('Could not get statistics for the "{0}" table. Error description: {1}'.format(table_name, error))
+        connection.rollback()
+        print(f'Could not advance the sequences of the "{qualified_name(schema_name, table_name)}" table. '
+              f'Error description: {error}')
+
 
+# Reads the indexes of the given tables from the catalog: their name, whether they are unique,
+# their access method and their columns (NULL for the expressions)
+def get_indexes(cursor, tables):
+    indexes = {(table_info[0], table_info[1]): list() for table_info in tables}
+    table_filter = ([table_info[0] for table_info in tables], [table_info[1] for table_info in tables])
 
-def get_column_information(cursor, table_name):
     try:
-        cursor.execute(f"""
+        cursor.execute("""
             SELECT 
-                column_name, data_type, character_maximum_length,
-                column_default,
-                numeric_precision, numeric_precision_radix, numeric_scale
-            FROM   information_schema.columns
-            WHERE  table_name = '{table_name}'
-            ORDER  BY ordinal_position;
-            """)
+                n.nspname, c.relname, ic.relname, i.indisunique, am.amname,
+                ARRAY(SELECT a.attname::text
+                      FROM   unnest(i.indkey::int2[]) WITH ORDINALITY AS k(attnum, position)
+                      LEFT   JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+                      ORDER  BY k.position)
+            FROM   pg_index i
+            JOIN   pg_class c ON c.oid = i.indrelid
+            JOIN   pg_namespace n ON n.oid = c.relnamespace
+            JOIN   unnest(%s::text[], %s::text[]) AS t(schema_name, table_name)
+                   ON n.nspname = t.schema_name AND c.relname = t.table_name
+            JOIN   pg_class ic ON ic.oid = i.indexrelid
+            JOIN   pg_am am ON am.oid = ic.relam
+            ORDER  BY n.nspname, c.relname, ic.relname;""", table_filter)
+
+        for row in cursor.fetchall():
+            indexes[(row[0], row[1])].append(row[2:])
+    except psycopg2.DatabaseError as error:
+        sys.exit('Could not retrieve the database\'s indexes. Error description: {0}'.format(error))
 
-        return cursor.fetchall()
+    return indexes
+
+
+# The data directory of the server, or None if the user is not allowed to read it
+def get_data_directory(cursor):
+    try:
+        cursor.execute("SELECT setting FROM pg_settings WHERE name = 'data_directory'")
+        row = cursor.fetchone()
+    except psycopg2.DatabaseError:
+        return None
+
+    return row[0] if row else None
+
+
+# Parses the text of a partition bound (pg_get_expr of relpartbound). Range bounds of several columns
+# cannot be followed by the generated values and are returned as unsupported
+def parse_partition_bound(bound):
+    if bound == 'DEFAULT':
+        return dict(strategy='default')
+
+    match = re.fullmatch(r"FOR VALUES FROM \((.*)\) TO \((.*)\)", bound)
+    if match:
+        lower, upper = partition_literals(match.group(1)), partition_literals(match.group(2))
+        if len(lower) != 1:
+            return dict(strategy='unsupported')
+        return dict(strategy='range', lower=lower[0], upper=upper[0])
+
+    match = re.fullmatch(r"FOR VALUES IN \((.*)\)", bound)
+    if match:
+        return dict(strategy='list', values=partition_literals(match.group(1)))
+
+    return dict(strategy='hash')
+
+
+def partition_literals(text):
+    literals = list()
+    for match in PARTITION_LITERAL.finditer(text):
+        if match.group(1) is not None:
+            literals.append(match.group(1).replace("''", "'"))
+        else:
+            literals.append(None if match.group(2).upper() in UNBOUNDED_LITERALS else match.group(2))
+
+    return literals
+
+
+# Cheap catalog-only fingerprint of every table, used to detect stale statistics snapshots
+def get_table_fingerprints(cursor, tables):
+    table_filter = ([table_info[0] for table_info in tables], [table_info[1] for table_info in tables])
+
+    try:
+        cursor.execute("""
+            SELECT 
+                n.nspname, c.relname,
+                greatest(s.last_analyze, s.last_autoanalyze)::text,
+                md5(string_agg(a.attname || ' ' || format_type(a.atttypid, a.atttypmod) || ' ' || a.attnotnull,
+                               ',' ORDER BY a.attnum))
+            FROM   pg_class c
+            JOIN   pg_namespace n ON n.oid = c.relnamespace
+            JOIN   unnest(%s::text[], %s::text[]) AS t(schema_name, table_name)
+                   ON n.nspname = t.schema_name AND c.relname = t.table_name
+            JOIN   pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+            LEFT   JOIN pg_stat_user_tables s ON s.relid = c.oid
+            GROUP  BY n.nspname, c.relname, s.last_analyze, s.last_autoanalyze;""", table_filter)
+
+        return {qualified_name(row[0], row[1]): [row[2], row[3]] for row in cursor.fetchall()}
     except psycopg2.DatabaseError as error:
-        sys.exit('Could not get columns for the "{0}" table. Error description: {1}'.format(table_name, error))
+        sys.exit('Could not retrieve the database\'s table fingerprints. Error description: {0}'.format(error))
 
 
-def get_table_primary_keys(cursor, table_name):
+def get_exact_table_stats(cursor, schema_name, table_name, column_names):
+    aggregates = [sql.SQL("COUNT(*)")]
+    for column_name in column_names:
+        aggregates.append(sql.SQL("MIN({0}), MAX({0})").format(sql.Identifier(column_name)))
+
+    # Only the table's own rows, like reltuples and pg_stats describe an inheritance parent
     try:
-        cursor.execute(f"""
-                    SELECT a.attname
-                    FROM   pg_index i
-                    JOIN   pg_attribute a ON a.attrelid = i.indrelid
-                                         AND a.attnum = ANY(i.indkey)
-                    WHERE  i.indrelid = '{table_name}'::regclass
-                    AND    i.indisprimary;""")
-
-        return [r[0] for r in cursor.fetchall()]
+        cursor.execute(sql.SQL("SELECT {} FROM ONLY {}").format(
+            sql.SQL(', ').join(aggregates),
+            sql.Identifier(schema_name, table_name)))
+
+        result = cursor.fetchone()
     except psycopg2.DatabaseError as error:
-        sys.exit(
-            'Could not get the primary key information for the"{0}" table. Error description: {1}'.format(table_name,
-                                                                                                          error))
+        sys.exit('Could not scan the "{0}" table. Error description: {1}'.format(
+            qualified_name(schema_name, table_name), error))
+
+    value_ranges = dict()
+    for index, column_name in enumerate(column_names):
+        value_ranges[column_name] = (result[1 + 2 * index], result[2 + 2 * index])
+
+    return result[0], value_ranges
+
+
+def get_key_values(connection, schema_name, table_name, column_names):
+    key_columns = sql.SQL(', ').join(sql.Identifier(column_name) for column_name in column_names)
+    key_batches = [list() for _ in column_names]
+
+    try:
+        # The keys are read in batches through a server-side cursor and kept as numpy arrays, one per column.
+        # They are sorted so that the generated references are reproducible
+        with connection.cursor(name='key_values') as cursor:
+            cursor.execute(sql.SQL("SELECT {} FROM {} ORDER BY {}").format(
+                key_columns,
+                sql.Identifier(schema_name, table_name),
+                key_columns))
+
+            while True:
+                rows = cursor.fetchmany(KEY_BATCH_SIZE)
+                if not rows:
+                    break
+                for index, column_values in enumerate(zip(*rows)):
+                    key_batches[index].append(numpy.array(column_values))
+        connection.commit()
+    except psycopg2.DatabaseError as error:
+        sys.exit('Could not read the keys of the "{0}" table. Error description: {1}'.format(
+            qualified_name(schema_name, table_name), error))
+
+    return [numpy.concatenate(batches) if batches else numpy.empty(0, dtype=object) for batches in key_batches]
+
+
+def get_row_counts(connection, identifiers):
+    row_counts = dict()
+
+    try:
+        with connection.cursor() as cursor:
+            # The rows of inheritance children are counted with their own tables, not with their parent
+            for schema_name, table_name in identifiers:
+                cursor.execute(sql.SQL("SELECT COUNT(*) FROM ONLY {}").format(sql.Identifier(schema_name, table_name)))
+                row_counts[qualified_name(schema_name, table_name)] = cursor.fetchone()[0]
+        connection.commit()
+    except psycopg2.DatabaseError as error:
+        sys.exit('Could not count the rows of the target tables. Error description: {0}'.format(error))
+
+    return row_counts
+
+
+# The rows are given as a file-like stream in the COPY text format, see copy_stream
+def copy_rows(cursor, schema_name, table_name, column_names, stream):
+    copy_query = sql.SQL("COPY {} ({}) FROM STDIN").format(
+        sql.Identifier(schema_name, table_name),
+        sql.SQL(', ').join(sql.Identifier(column_name) for column_name in column_names))
+
+    cursor.copy_expert(copy_query, stream, size=COPY_BUFFER_SIZE)
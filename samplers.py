@@ -0,0 +1,943 @@
+import datetime
+import math
+import string
+
+import numpy
+from psycopg2 import sql
+
+ALPHABETS = {
+    'numeric': string.digits,
+    'upper': string.ascii_lowercase,
+    'capitalized': string.ascii_lowercase,
+    'lower': string.ascii_lowercase
+}
+# Distance between the lower and upper case ASCII letters
+CASE_OFFSET = numpy.uint8(32)
+TIMESTAMP_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def apply_nulls(values, null_frac, rng):
+    if null_frac:
+        values = values.astype(object)
+        values[rng.random(len(values)) < null_frac] = None
+
+    return values
+
+
+# The sql_expression methods build the SQL counterpart of sample for the server-side generation,
+# drawing their random numbers from the query's per-row draws and their row offsets from query.offset
+def apply_nulls_sql(expression, null_frac, query):
+    if not null_frac:
+        return expression
+
+    return sql.SQL("CASE WHEN {} < {} THEN NULL ELSE {} END").format(
+        query.draw(), sql.Literal(float(null_frac)), expression)
+
+
+def float_array_sql(values):
+    return sql.SQL("{}::float8[]").format(sql.Literal([float(value) for value in values]))
+
+
+def date_sql(steps, unit):
+    if unit == 'D':
+        return sql.SQL("(DATE '1970-01-01' + floor({})::int)").format(steps)
+
+    return sql.SQL("(TIMESTAMP '1970-01-01' + floor({}) * INTERVAL '1 second')").format(steps)
+
+
+class NumberSampler:
+    def __init__(self, low, high, scale=None, null_frac=None, histogram_bounds=None):
+        self.low = int(low)
+        self.high = int(high)
+        self.scale = scale
+        self.null_frac = null_frac
+        self.histogram = create_histogram(histogram_bounds, numpy.float64)
+
+    def sample(self, rng, size, offset=0):
+        if self.histogram is not None:
+            values = self.histogram.quantile(rng.random(size))
+            values = numpy.round(values, self.scale) if self.scale else numpy.floor(values).astype(numpy.int64)
+        elif self.scale:
+            values = numpy.round(rng.uniform(self.low, self.high, size), self.scale)
+        else:
+            values = rng.integers(self.low, self.high, size, endpoint=True)
+
+        return apply_nulls(values, self.null_frac, rng)
+
+    def sql_expression(self, query):
+        if self.histogram is not None:
+            value = self.histogram.quantile_sql(query.draw())
+        elif self.scale:
+            value = sql.SQL("({} + {} * {})").format(
+                sql.Literal(self.low), query.draw(), sql.Literal(self.high - self.low))
+        else:
+            value = sql.SQL("({} + {} * {})").format(
+                sql.Literal(self.low), query.draw(), sql.Literal(self.high - self.low + 1))
+
+        return apply_nulls_sql(number_sql(value, self.scale), self.null_frac, query)
+
+
+class DateSampler:
+    def __init__(self, start_date, end_date, time=False, null_frac=None, histogram_bounds=None):
+        self.unit = date_unit(time)
+        self.start = numpy.datetime64(start_date, self.unit)
+        self.span = int((numpy.datetime64(end_date, self.unit) - self.start).astype(numpy.int64))
+        self.null_frac = null_frac
+        self.histogram = create_histogram(histogram_bounds, f'datetime64[{self.unit}]')
+
+    def sample(self, rng, size, offset=0):
+        if self.histogram is not None:
+            steps = numpy.floor(self.histogram.quantile(rng.random(size))).astype(numpy.int64)
+            values = numpy.datetime64(0, self.unit) + steps.astype(f'timedelta64[{self.unit}]')
+        else:
+            steps = rng.integers(0, self.span, size, endpoint=True)
+            values = self.start + steps.astype(f'timedelta64[{self.unit}]')
+
+        return apply_nulls(values.astype(object), self.null_frac, rng)
+
+    def sql_expression(self, query):
+        if self.histogram is not None:
+            steps = self.histogram.quantile_sql(query.draw())
+        else:
+            steps = sql.SQL("({} + {} * {})").format(
+                sql.Literal(int(self.start.astype(numpy.int64))), query.draw(), sql.Literal(self.span + 1))
+
+        return apply_nulls_sql(date_sql(steps, self.unit), self.null_frac, query)
+
+
+class BooleanSampler:
+    def __init__(self, null_frac=None):
+        self.null_frac = null_frac
+
+    def sample(self, rng, size, offset=0):
+        return apply_nulls(rng.random(size) < 0.5, self.null_frac, rng)
+
+    def sql_expression(self, query):
+        return apply_nulls_sql(sql.SQL("{} < 0.5").format(query.draw()), self.null_frac, query)
+
+
+# Bijective mapping of the indexes 0..size-1 onto themselves, (multiplier * index + offset) mod size
+class IndexPermutation:
+    def __init__(self, size, rng):
+        self.size = max(int(size), 1)
+        self.offset = int(rng.integers(self.size))
+        self.multiplier = 1
+
+        # Bigger sizes could overflow the 64-bit multiplication and are only rotated
+        if self.size < 2 ** 32:
+            self.multiplier = int(rng.integers(1, self.size, endpoint=True))
+            while math.gcd(self.multiplier, self.size) != 1:
+                self.multiplier += 1
+
+    def apply(self, indexes):
+        indexes = indexes.astype(numpy.uint64) % numpy.uint64(self.size)
+        permuted = (indexes * numpy.uint64(self.multiplier) + numpy.uint64(self.offset)) % numpy.uint64(self.size)
+
+        return permuted.astype(numpy.int64)
+
+    def sql_expression(self, indexes):
+        # numeric, since the multiplication can overflow a bigint
+        return sql.SQL("((({} % {}) * {}::numeric + {}) % {})::bigint").format(
+            indexes, sql.Literal(self.size), sql.Literal(self.multiplier), sql.Literal(self.offset),
+            sql.Literal(self.size))
+
+
+# Equi-depth histogram as found in pg_stats: every bucket between two neighbouring bounds holds the same
+# share of the values, so picking a bucket uniformly and a value uniformly inside it follows the source's
+# distribution. That is the same as interpolating the bounds at a uniform fraction
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = numpy.sort(bounds)
+
+    def quantile(self, fractions):
+        positions = fractions * (len(self.bounds) - 1)
+        buckets = numpy.minimum(positions.astype(numpy.int64), len(self.bounds) - 2)
+        lower = self.bounds[buckets]
+
+        return lower + (positions - buckets) * (self.bounds[buckets + 1] - lower)
+
+    def quantile_sql(self, fractions):
+        return sql.SQL("pg_temp.pgsynthdata_quantile({}, {})").format(float_array_sql(self.bounds), fractions)
+
+
+def create_histogram(histogram_bounds, dtype):
+    bounds = parse_values(histogram_bounds, dtype)
+    if bounds is None or len(bounds) < 2:
+        return None
+
+    return Histogram(bounds)
+
+
+# Dates are handled as whole days, timestamps as seconds, both counted from the epoch
+def parse_values(values, dtype):
+    if not values:
+        return None
+
+    try:
+        parsed = numpy.array(values, dtype=dtype)
+    except ValueError:
+        # Special values like infinity cannot be interpolated
+        return None
+
+    return parsed.astype(numpy.int64).astype(numpy.float64) if parsed.dtype.kind == 'M' else parsed
+
+
+def date_unit(time):
+    return 's' if time else 'D'
+
+
+# The value domains map the indexes 0..size-1 to distinct values of a column type. The first indexes
+# are the source's most common values when they are known (fixed_count), the others follow the column's
+# histogram, which in pg_stats describes the values that are not among the most common ones
+class NumberDomain:
+    def __init__(self, low, high, size, scale=None, histogram_bounds=None, most_common_values=None):
+        self.low = float(low)
+        self.high = float(high)
+        self.size = max(int(size), 1)
+        self.scale = scale
+        self.histogram = create_histogram(histogram_bounds, numpy.float64)
+        self.most_common_values = parse_values(most_common_values, numpy.float64)
+        self.fixed_count = len(self.most_common_values) if self.most_common_values is not None else 0
+
+        # An integer range holds no more distinct values than its whole numbers. The values are floored,
+        # so the histogram is stretched by one over its whole span to reach its last bound like the others
+        self.stretch = None
+        if not scale:
+            if self.histogram is not None:
+                bounds = self.histogram.bounds
+                span = bounds[-1] - bounds[0]
+                self.stretch = float((span + 1) / span) if span else 1.0
+            else:
+                bounds = [self.low, self.high]
+            width = max(math.floor(bounds[-1]) - math.ceil(bounds[0]) + 1, 1)
+            self.size = min(self.size, self.fixed_count + width)
+
+    def values(self, indexes):
+        fractions = tail_fractions(indexes, self.fixed_count, self.size)
+        if self.histogram is not None:
+            values = self.histogram.quantile(fractions)
+            if self.stretch:
+                values = self.histogram.bounds[0] + (values - self.histogram.bounds[0]) * self.stretch
+        elif self.scale:
+            values = self.low + fractions * (self.high - self.low)
+        else:
+            values = math.ceil(self.low) + fractions * (math.floor(self.high) - math.ceil(self.low) + 1)
+
+        if self.fixed_count:
+            fixed_rows = indexes < self.fixed_count
+            values[fixed_rows] = self.most_common_values[indexes[fixed_rows]]
+
+        return numpy.round(values, self.scale) if self.scale else numpy.floor(values).astype(numpy.int64)
+
+    def sql_values(self, indexes):
+        fractions = tail_fractions_sql(indexes, self.fixed_count, self.size)
+        if self.histogram is not None:
+            values = self.histogram.quantile_sql(fractions)
+            if self.stretch:
+                start = sql.Literal(float(self.histogram.bounds[0]))
+                values = sql.SQL("({} + ({} - {}) * {})").format(start, values, start, sql.Literal(self.stretch))
+        elif self.scale:
+            values = sql.SQL("({} + {} * {})").format(
+                sql.Literal(self.low), fractions, sql.Literal(self.high - self.low))
+        else:
+            values = sql.SQL("({} + {} * {})").format(
+                sql.Literal(math.ceil(self.low)), fractions,
+                sql.Literal(math.floor(self.high) - math.ceil(self.low) + 1))
+
+        values = fixed_values_sql(values, indexes, self.most_common_values, self.fixed_count)
+        return number_sql(values, self.scale)
+
+
+class DateDomain:
+    def __init__(self, start_date, end_date, size, time=False, histogram_bounds=None, most_common_values=None):
+        self.unit = date_unit(time)
+        self.start = numpy.datetime64(start_date, self.unit)
+        self.span = int((numpy.datetime64(end_date, self.unit) - self.start).astype(numpy.int64))
+        self.size = max(int(size), 1)
+        self.histogram = create_histogram(histogram_bounds, f'datetime64[{self.unit}]')
+        self.most_common_values = parse_values(most_common_values, f'datetime64[{self.unit}]')
+        self.fixed_count = len(self.most_common_values) if self.most_common_values is not None else 0
+
+    def values(self, indexes):
+        fractions = tail_fractions(indexes, self.fixed_count, self.size)
+        if self.histogram is not None:
+            steps = self.histogram.quantile(fractions)
+        else:
+            steps = self.start.astype(numpy.int64) + fractions * self.span
+
+        if self.fixed_count:
+            fixed_rows = indexes < self.fixed_count
+            steps[fixed_rows] = self.most_common_values[indexes[fixed_rows]]
+
+        steps = numpy.floor(steps).astype(numpy.int64)
+        return (numpy.datetime64(0, self.unit) + steps.astype(f'timedelta64[{self.unit}]')).astype(object)
+
+    def sql_values(self, indexes):
+        fractions = tail_fractions_sql(indexes, self.fixed_count, self.size)
+        if self.histogram is not None:
+            steps = self.histogram.quantile_sql(fractions)
+        else:
+            steps = sql.SQL("({} + {} * {})").format(
+                sql.Literal(int(self.start.astype(numpy.int64))), fractions, sql.Literal(self.span))
+
+        steps = fixed_values_sql(steps, indexes, self.most_common_values, self.fixed_count)
+        return date_sql(steps, self.unit)
+
+
+# Position of the non-fixed indexes within the rest of the domain, as a fraction between 0 and 1
+def tail_fractions(indexes, fixed_count, size):
+    return (numpy.maximum(indexes - fixed_count, 0) + 0.5) / max(size - fixed_count, 1)
+
+
+def tail_fractions_sql(indexes, fixed_count, size):
+    return sql.SQL("((greatest({} - {}, 0) + 0.5) / {})").format(
+        indexes, sql.Literal(fixed_count), sql.Literal(float(max(size - fixed_count, 1))))
+
+
+def fixed_values_sql(values, indexes, fixed_values, fixed_count):
+    if not fixed_count:
+        return values
+
+    return sql.SQL("(CASE WHEN {0} < {1} THEN ({2})[{0} + 1] ELSE {3} END)").format(
+        indexes, sql.Literal(fixed_count), float_array_sql(fixed_values), values)
+
+
+def number_sql(values, scale):
+    if scale:
+        return sql.SQL("round({}::numeric, {})").format(values, sql.Literal(scale))
+
+    return sql.SQL("floor({})::bigint").format(values)
+
+
+class WordDomain:
+    def __init__(self, length, size, shapes=None, max_length=None):
+        self.size = max(int(size), 1)
+        self.fixed_count = 0
+        self.shapes = shapes or ['lower']
+        self.low, self.high = length_range(length, max_length)
+        self.max_length = max_length
+
+        # Words of a single letter are the same upper-case and capitalized, so those shapes are one
+        if max(self.high, self.digit_count(len(string.ascii_lowercase))) == 1:
+            self.shapes = ['upper' if shape == 'capitalized' else shape for shape in self.shapes]
+        # The domain holds no more distinct words than its digits can tell apart
+        self.size = min(self.size, self.capacity())
+
+    def values(self, indexes):
+        words = numpy.empty(len(indexes), dtype=object)
+        shape_indexes = indexes % len(self.shapes)
+        # The length of a word is a hash of its index, so that it stays the same in every chunk
+        lengths = self.low + (hash_indexes(indexes) % numpy.uint64(self.high - self.low + 1)).astype(numpy.int64)
+
+        for shape in set(self.shapes):
+            rows = numpy.isin(shape_indexes, [index for index, value in enumerate(self.shapes) if value == shape])
+            base = len(ALPHABETS[shape])
+            digit_count = self.digit_count(base)
+            shape_lengths = numpy.maximum(lengths[rows], digit_count)
+            characters = encode_words(indexes[rows], base, shape_lengths, digit_count)
+            words[rows] = shape_words(characters, shape_lengths, shape)
+
+        return words
+
+    def digit_count(self, base):
+        # The words have to be long enough to tell all the indexes apart, even if that makes them longer
+        # than the words of the source. Only the declared length of the column limits them
+        digit_count = 1
+        while base ** digit_count < self.size:
+            digit_count += 1
+
+        return min(digit_count, self.max_length) if self.max_length else digit_count
+
+    # The number of distinct words, below size when the declared length is too short for them
+    def capacity(self):
+        return min(len(ALPHABETS[shape]) ** self.digit_count(len(ALPHABETS[shape])) for shape in set(self.shapes))
+
+    def sql_values(self, indexes):
+        # Same construction as values, with md5 as the hash, so the words differ from the client-side ones
+        lengths = sql.SQL("({} + ('x' || substr(md5({}::text), 1, 8))::bit(32)::bigint % {})").format(
+            sql.Literal(self.low), indexes, sql.Literal(self.high - self.low + 1))
+
+        shape_words = list()
+        for shape in set(self.shapes):
+            alphabet = ALPHABETS[shape]
+            digit_count = self.digit_count(len(alphabet))
+            digits = sql.SQL(
+                "(SELECT string_agg(substr({0}, (div({1}::numeric, {2}::numeric ^ k) % {2})::int + 1, 1), '' "
+                "ORDER BY k DESC) FROM generate_series(0, {3}) AS k)").format(
+                sql.Literal(alphabet), indexes, sql.Literal(len(alphabet)), sql.Literal(digit_count - 1))
+            prefix = sql.SQL("substr({}, 1, greatest({} - {}, 0)::int)").format(
+                hash_text_sql(sql.SQL("md5({}::text || '-' || n)").format(indexes), shape, self.high),
+                lengths, sql.Literal(digit_count))
+
+            positions = [index for index, value in enumerate(self.shapes) if value == shape]
+            shape_words.append(sql.SQL("WHEN {} % {} = ANY({}) THEN {}").format(
+                indexes, sql.Literal(len(self.shapes)), sql.Literal(positions),
+                shape_word_sql(sql.SQL("{} || {}").format(prefix, digits), shape)))
+
+        return sql.SQL("(CASE {} END)").format(sql.SQL(' ').join(shape_words))
+
+
+# Generates whole batches of random words from byte matrices, in the shapes of the column's sample values
+class WordSampler:
+    def __init__(self, length, shapes=None, max_length=None, null_frac=None):
+        self.low, self.high = length_range(length, max_length)
+        self.shapes = shapes or ['lower']
+        self.null_frac = null_frac
+
+    def sample(self, rng, size, offset=0):
+        words = numpy.empty(size, dtype=object)
+        lengths = rng.integers(self.low, self.high, size, endpoint=True)
+        shape_indexes = rng.integers(len(self.shapes), size=size)
+
+        for shape in set(self.shapes):
+            rows = numpy.isin(shape_indexes, [index for index, value in enumerate(self.shapes) if value == shape])
+            characters = rng.integers(len(ALPHABETS[shape]), size=(numpy.count_nonzero(rows), self.high),
+                                      dtype=numpy.uint8)
+            words[rows] = shape_words(characters, lengths[rows], shape)
+
+        return apply_nulls(words, self.null_frac, rng)
+
+    def sql_expression(self, query):
+        length = sql.SQL("{} + floor({} * {})::int").format(
+            sql.Literal(self.low), query.draw(), sql.Literal(self.high - self.low + 1))
+
+        draw = query.draw()
+        shape_words = list()
+        cumulative_share = 0
+        for shape in set(self.shapes):
+            cumulative_share += self.shapes.count(shape) / len(self.shapes)
+            random_text = hash_text_sql(sql.SQL("md5(random()::text || n || {})").format(query.offset),
+                                        shape, self.high)
+            shape_words.append(sql.SQL("WHEN {} < {} THEN {}").format(
+                draw, sql.Literal(cumulative_share),
+                shape_word_sql(sql.SQL("substr({}, 1, {})").format(random_text, length), shape)))
+
+        words = sql.SQL("(CASE {} ELSE NULL END)").format(sql.SQL(' ').join(shape_words))
+        return apply_nulls_sql(words, self.null_frac, query)
+
+
+# Text made of enough concatenated md5 hashes (with n numbering them) for words of up to length characters,
+# translated to the shape's alphabet. The hash expression has to refer to the row, otherwise the subquery
+# is only evaluated once per query
+def hash_text_sql(hash_expression, shape, length):
+    hashes = sql.SQL(
+        "(SELECT string_agg({}, '' ORDER BY n) FROM generate_series(1, {}) AS n)").format(
+        hash_expression, sql.Literal(max(math.ceil(length / 32), 1)))
+
+    if shape == 'numeric':
+        return sql.SQL("translate({}, 'abcdef', '012345')").format(hashes)
+
+    return sql.SQL("translate({}, '0123456789', 'ghijklmnop')").format(hashes)
+
+
+def shape_word_sql(word, shape):
+    if shape == 'upper':
+        return sql.SQL("upper({})").format(word)
+    elif shape == 'capitalized':
+        return sql.SQL("initcap({})").format(word)
+
+    return word
+
+
+# The lengths are spread evenly around the average length
+def length_range(length, max_length=None):
+    length = max(int(round(length)), 1)
+    low, high = max(length - length // 2, 1), length + length // 2
+    if max_length:
+        high = min(high, max_length)
+        low = min(low, high)
+
+    return low, high
+
+
+def hash_indexes(indexes):
+    hashed = indexes.astype(numpy.uint64) * numpy.uint64(0x9E3779B97F4A7C15)
+    hashed = (hashed ^ (hashed >> numpy.uint64(29))) * numpy.uint64(0xBF58476D1CE4E5B9)
+
+    return hashed ^ (hashed >> numpy.uint64(32))
+
+
+# Returns the alphabet positions of the words: the last digit_count characters of every word
+# spell out its index, the others are a hash of it
+def encode_words(indexes, base, lengths, digit_count):
+    width = int(lengths.max()) if len(lengths) else 1
+    characters = numpy.empty((len(indexes), width), dtype=numpy.uint8)
+
+    hashed = indexes.astype(numpy.uint64)
+    for position in range(width):
+        hashed = hash_indexes(hashed + numpy.uint64(position))
+        characters[:, position] = hashed % numpy.uint64(base)
+
+    remaining = indexes.astype(numpy.uint64)
+    rows = numpy.arange(len(indexes))
+    for digit in range(digit_count):
+        characters[rows, lengths - 1 - digit] = remaining % numpy.uint64(base)
+        remaining //= numpy.uint64(base)
+
+    return characters
+
+
+# Turns a matrix of alphabet positions into words of the given lengths and shape,
+# without building a Python object per character
+def shape_words(characters, lengths, shape):
+    width = max(characters.shape[1], 1)
+    letters = numpy.frombuffer(ALPHABETS[shape].encode('ascii'), dtype=numpy.uint8)[characters]
+
+    if shape == 'upper':
+        letters -= CASE_OFFSET
+    elif shape == 'capitalized' and letters.size:
+        letters[:, 0] -= CASE_OFFSET
+
+    # The bytes past the word's length are zeroed, which the fixed-width bytes dtype strips
+    letters[numpy.arange(characters.shape[1]) >= lengths[:, None]] = 0
+    words = numpy.ascontiguousarray(letters).view(f'S{width}').ravel()
+
+    return numpy.char.decode(words, 'ascii').astype(object)
+
+
+def word_shape(value):
+    value = str(value)
+    if value.isdigit():
+        return 'numeric'
+    elif value.isupper():
+        return 'upper'
+    elif value and value[0].isupper():
+        return 'capitalized'
+
+    return 'lower'
+
+
+# Models a column as n_distinct values: the most common values with their frequencies,
+# and a tail that shares the left-over frequency evenly. The values themselves are computed
+# from their index on demand, so the memory needed does not depend on n_distinct. The indexes
+# that the domain does not fix to a known value are permuted.
+# The tail values are assigned by a permutation of the row offsets, which makes a unique column
+# unique and every other column hit its number of distinct values
+class DistinctValueSampler:
+    def __init__(self, domain, distinct_count, rows_to_generate, rng, most_common_freqs=None, null_frac=None):
+        self.domain = domain
+        self.mcv_cdf = numpy.cumsum(most_common_freqs or [])
+        self.tail_count = max(int(distinct_count) - len(self.mcv_cdf), 0)
+        if not self.tail_count and len(self.mcv_cdf):
+            self.mcv_cdf /= self.mcv_cdf[-1]
+
+        self.value_permutation = IndexPermutation(len(self.mcv_cdf) + self.tail_count - domain.fixed_count, rng)
+        self.row_permutation = IndexPermutation(rows_to_generate, rng)
+        self.null_frac = null_frac
+
+    def sample(self, rng, size, offset=0):
+        indexes = numpy.zeros(size, dtype=numpy.int64)
+        if self.tail_count:
+            offsets = numpy.arange(offset, offset + size, dtype=numpy.int64)
+            indexes += len(self.mcv_cdf) + self.row_permutation.apply(offsets) % self.tail_count
+
+        if len(self.mcv_cdf):
+            draws = rng.random(size)
+            mcv_rows = draws < self.mcv_cdf[-1]
+            indexes[mcv_rows] = numpy.searchsorted(self.mcv_cdf, draws[mcv_rows], side='right')
+
+        fixed_rows = indexes < self.domain.fixed_count
+        indexes[~fixed_rows] = self.domain.fixed_count + self.value_permutation.apply(
+            indexes[~fixed_rows] - self.domain.fixed_count)
+
+        values = self.domain.values(indexes)
+        return apply_nulls(values, self.null_frac, rng)
+
+    def sql_expression(self, query):
+        indexes = sql.Literal(0)
+        if self.tail_count:
+            indexes = sql.SQL("{} + {} % {}").format(
+                sql.Literal(len(self.mcv_cdf)), self.row_permutation.sql_expression(query.offset),
+                sql.Literal(self.tail_count))
+
+        if len(self.mcv_cdf):
+            draw = query.draw()
+            indexes = sql.SQL("(CASE WHEN {0} < {1} THEN width_bucket({0}, {2}) ELSE {3} END)").format(
+                draw, sql.Literal(float(self.mcv_cdf[-1])), float_array_sql(self.mcv_cdf), indexes)
+
+        fixed_count = sql.Literal(self.domain.fixed_count)
+        indexes = sql.SQL("(CASE WHEN {0} < {1} THEN {0} ELSE {1} + {2} END)").format(
+            indexes, fixed_count,
+            self.value_permutation.sql_expression(sql.SQL("({} - {})").format(indexes, fixed_count)))
+
+        return apply_nulls_sql(self.domain.sql_values(indexes), self.null_frac, query)
+
+
+# Maps the key indexes 0, 1, 2, ... one-to-one onto consecutive numbers, days or seconds from a start value on
+class SequenceDomain:
+    def __init__(self, start, kind, maximum=None):
+        self.kind = kind
+        self.maximum = maximum
+        if kind == 'number':
+            self.unit = None
+            self.start = int(start)
+        else:
+            self.unit = date_unit(kind == 'timestamp')
+            self.start = numpy.datetime64(start, self.unit)
+
+    def capacity(self):
+        if self.maximum is None:
+            return math.inf
+        if self.unit is None:
+            return self.maximum - self.start + 1
+
+        return int((numpy.datetime64(self.maximum, self.unit) - self.start).astype(numpy.int64)) + 1
+
+    def values(self, indexes):
+        if self.unit is None:
+            return self.start + indexes
+
+        return (self.start + indexes.astype(f'timedelta64[{self.unit}]')).astype(object)
+
+    def sql_values(self, indexes):
+        if self.unit is None:
+            return sql.SQL("({} + {})").format(sql.Literal(self.start), indexes)
+
+        return date_sql(sql.SQL("({} + {})").format(sql.Literal(int(self.start.astype(numpy.int64))), indexes),
+                        self.unit)
+
+
+# Maps the key indexes one-to-one onto the values listed by a list partition
+class ListDomain:
+    def __init__(self, values):
+        self.listed_values = list(values)
+
+    def capacity(self):
+        return len(self.listed_values)
+
+    def values(self, indexes):
+        values = numpy.empty(len(self.listed_values), dtype=object)
+        values[:] = self.listed_values
+        return values[indexes]
+
+    def sql_values(self, indexes):
+        return sql.SQL("({})[{} + 1]").format(sql.Literal(self.listed_values), indexes)
+
+
+# Generates the columns of a primary key or unique constraint from the row offsets, so that every row gets
+# a key of its own whichever chunk and job generates it, without any check on the server. The key index of
+# a row is its offset, permuted within blocks of block_size rows unless the source stores its keys in order,
+# plus the index base of the table. The key index is split into one digit per column (mixed radix, the first
+# column the most significant) and every domain maps the digits of its column to distinct values
+class KeySampler:
+    def __init__(self, domains, radices, block_size, rng, permuted=True, null_frac=None, index_base=0):
+        self.domains = domains
+        self.radices = radices
+        self.width = len(domains)
+        self.block_size = max(int(block_size), 1)
+        self.permutation = IndexPermutation(self.block_size, rng) if permuted else None
+        self.null_frac = null_frac
+        self.index_base = int(index_base)
+
+    def sample(self, rng, size, offset=0):
+        indexes = numpy.arange(offset, offset + size, dtype=numpy.int64)
+        if self.permutation is not None:
+            indexes = indexes - indexes % self.block_size + self.permutation.apply(indexes % self.block_size)
+        indexes = indexes + self.index_base
+
+        columns = list()
+        for domain, radix in zip(self.domains[:0:-1], self.radices[:0:-1]):
+            columns.insert(0, domain.values(indexes % radix))
+            indexes = indexes // radix
+        columns.insert(0, self.domains[0].values(indexes))
+
+        if self.null_frac:
+            # All the columns of a key are NULL together
+            null_rows = rng.random(size) < self.null_frac
+            columns = [column.astype(object) for column in columns]
+            for column in columns:
+                column[null_rows] = None
+
+        return columns
+
+    def sql_expressions(self, query):
+        indexes = query.offset
+        if self.permutation is not None:
+            block_offsets = sql.SQL("({} % {})").format(query.offset, sql.Literal(self.block_size))
+            indexes = sql.SQL("({} - {} + {})").format(
+                query.offset, block_offsets, self.permutation.sql_expression(block_offsets))
+        if self.index_base:
+            indexes = sql.SQL("({} + {})").format(indexes, sql.Literal(self.index_base))
+
+        columns = list()
+        for domain, radix in zip(self.domains[:0:-1], self.radices[:0:-1]):
+            columns.insert(0, domain.sql_values(sql.SQL("({} % {})").format(indexes, sql.Literal(radix))))
+            indexes = sql.SQL("({} / {})").format(indexes, sql.Literal(radix))
+        columns.insert(0, self.domains[0].sql_values(indexes))
+
+        if self.null_frac:
+            draw = query.draw()
+            columns = [sql.SQL("CASE WHEN {} < {} THEN NULL ELSE {} END").format(
+                draw, sql.Literal(float(self.null_frac)), column) for column in columns]
+
+        return columns
+
+
+# Keeps the values of a partition key column within the bound of its partition, so that the rows can be
+# loaded straight into the partition. The values of a range partition are wrapped into the range, which keeps
+# the values that are already inside unchanged, and the values that are not listed by a list partition
+# are replaced by one of the listed values
+class PartitionKeySampler:
+    def __init__(self, column_sampler, bound, kind, scale=None):
+        self.column_sampler = column_sampler
+        self.strategy = bound["strategy"]
+        self.kind = kind
+        self.scale = scale
+
+        if self.strategy == 'range':
+            self.lower = partition_bound_value(bound["lower"], kind, scale)
+            self.upper = partition_bound_value(bound["upper"], kind, scale)
+            if self.lower is not None:
+                self.inside = self.lower
+            elif kind == 'text':
+                self.inside = ''
+            else:
+                self.inside = partition_value(partition_steps(self.upper, kind) - self.step(), kind, scale)
+        else:
+            self.values = [partition_bound_value(value, kind, scale) for value in bound["values"]]
+
+    def step(self):
+        return 10.0 ** -self.scale if self.kind == 'number' and self.scale else 1
+
+    def in_range(self, value):
+        return (self.lower is None or value >= self.lower) and (self.upper is None or value < self.upper)
+
+    def sample(self, rng, size, offset=0):
+        values = self.column_sampler.sample(rng, size, offset).tolist()
+
+        if self.strategy == 'list':
+            listed_values = set(self.values)
+            outside = [index for index, value in enumerate(values) if value not in listed_values]
+            for index, choice in zip(outside, rng.integers(0, len(self.values), len(outside))):
+                values[index] = self.values[choice]
+        else:
+            values = [self.wrap(value) for value in values]
+
+        column = numpy.empty(size, dtype=object)
+        column[:] = values
+        return column
+
+    # Values below a range without an upper bound (or above one without a lower bound) are mirrored at the bound
+    def wrap(self, value):
+        if value is None or self.kind == 'text':
+            return value if value is not None and self.in_range(value) else self.inside
+        if self.in_range(value):
+            return value
+
+        steps = partition_steps(value, self.kind)
+        if self.lower is not None and self.upper is not None:
+            lower = partition_steps(self.lower, self.kind)
+            steps = lower + (steps - lower) % (partition_steps(self.upper, self.kind) - lower)
+        elif self.lower is not None:
+            steps = 2 * partition_steps(self.lower, self.kind) - steps
+        else:
+            steps = 2 * partition_steps(self.inside, self.kind) - steps
+
+        value = partition_value(steps, self.kind, self.scale)
+        return value if self.in_range(value) else self.inside
+
+    def sql_expression(self, query):
+        value = self.column_sampler.sql_expression(query)
+
+        if self.strategy == 'list':
+            listed_values = [listed_value for listed_value in self.values if listed_value is not None]
+            condition = sql.SQL("{} IN ({})").format(value, sql.SQL(', ').join(map(sql.Literal, listed_values))) \
+                if listed_values else sql.SQL("FALSE")
+            if None in self.values:
+                condition = sql.SQL("({} OR {} IS NULL)").format(condition, value)
+
+            choice = sql.SQL("({})[1 + floor({} * {})::int]").format(
+                sql.Literal(self.values), query.draw(), sql.Literal(len(self.values)))
+            return sql.SQL("(CASE WHEN {} THEN {} ELSE {} END)").format(condition, value, choice)
+
+        conditions = [sql.SQL("{} IS NOT NULL").format(value)]
+        if self.lower is not None:
+            conditions.append(sql.SQL("{} >= {}").format(value, sql.Literal(self.lower)))
+        if self.upper is not None:
+            conditions.append(sql.SQL("{} < {}").format(value, sql.Literal(self.upper)))
+
+        if self.kind == 'text':
+            wrapped = sql.Literal(self.inside)
+        else:
+            inside_value = sql.SQL("coalesce({}, {})").format(value, sql.Literal(self.inside))
+            if self.lower is not None and self.upper is not None:
+                span = sql.Literal(partition_steps(self.upper, self.kind) - partition_steps(self.lower, self.kind))
+                wrapped = self.add_sql(sql.Literal(self.lower), sql.SQL("mod(mod({}, {}) + {}, {})").format(
+                    self.difference_sql(inside_value, sql.Literal(self.lower)), span, span, span))
+            else:
+                bound = sql.Literal(self.lower if self.lower is not None else self.inside)
+                wrapped = self.add_sql(bound, self.difference_sql(bound, inside_value))
+
+        return sql.SQL("(CASE WHEN {} THEN {} ELSE {} END)").format(
+            sql.SQL(' AND ').join(conditions), value, wrapped)
+
+    def difference_sql(self, value, bound):
+        if self.kind == 'timestamp':
+            return sql.SQL("extract(epoch FROM {} - {})").format(value, bound)
+
+        return sql.SQL("({} - {})").format(value, bound)
+
+    def add_sql(self, bound, steps):
+        if self.kind == 'timestamp':
+            return sql.SQL("({} + {} * INTERVAL '1 second')").format(bound, steps)
+        elif self.kind == 'date':
+            return sql.SQL("({} + ({})::int)").format(bound, steps)
+
+        return sql.SQL("({} + {})").format(bound, steps)
+
+
+def partition_bound_value(value, kind, scale=None):
+    if value is None:
+        return None
+    elif kind == 'number':
+        return float(value) if scale or not value.lstrip('-').isdigit() else int(value)
+    elif kind == 'date':
+        return datetime.date.fromisoformat(value)
+    elif kind == 'timestamp':
+        return datetime.datetime.fromisoformat(value)
+    elif kind == 'boolean':
+        return value.lower() in ('true', 't')
+
+    return value
+
+
+# Dates and timestamps are wrapped as days and seconds
+def partition_steps(value, kind):
+    if kind == 'date':
+        return value.toordinal()
+    elif kind == 'timestamp':
+        return (value - TIMESTAMP_EPOCH).total_seconds()
+
+    return value
+
+
+def partition_value(steps, kind, scale=None):
+    if kind == 'date':
+        return datetime.date.fromordinal(int(steps))
+    elif kind == 'timestamp':
+        return TIMESTAMP_EPOCH + datetime.timedelta(seconds=steps)
+
+    return round(steps, scale) if scale else int(steps)
+
+
+# Samples (possibly multi-column) foreign keys from the key values of the already generated referenced table.
+# The most common values of the referencing column are mapped to randomly chosen "hot" keys. Without keys
+# to reference, nullable foreign keys are NULL and the others fail the table: any other value would violate them
+class ForeignKeySampler:
+    def __init__(self, referenced_table, referenced_identifier, referenced_columns, fallback_samplers,
+                 nullable=False, null_frac=None, most_common_freqs=None):
+        self.referenced_table = referenced_table
+        self.referenced_identifier = referenced_identifier
+        self.referenced_columns = referenced_columns
+        self.fallback_samplers = fallback_samplers
+        self.width = len(fallback_samplers)
+        self.nullable = nullable
+        self.null_frac = null_frac
+        self.most_common_freqs = most_common_freqs or []
+        self.keys = None
+        self.hot_indexes = None
+        self.hot_cdf = None
+        self.key_table = None
+        self.key_count = 0
+        self.hot_permutation = None
+
+    def attach_keys(self, keys, rng):
+        self.keys = keys
+        if keys is None or len(keys[0]) == 0:
+            return
+
+        hot_count = min(len(self.most_common_freqs), len(keys[0]))
+        self.hot_indexes = rng.choice(len(keys[0]), hot_count, replace=False)
+        self.hot_cdf = numpy.cumsum(self.most_common_freqs[:hot_count])
+
+    # The server-side generation looks the keys up by their number in the key table of the referenced table,
+    # the hot keys are spread over them by a permutation
+    def attach_server_keys(self, key_table, key_count, rng):
+        if key_count == 0:
+            return
+
+        self.key_table = key_table
+        self.key_count = key_count
+        self.hot_cdf = numpy.cumsum(self.most_common_freqs)
+        self.hot_permutation = IndexPermutation(2 ** 31 - 1, rng)
+
+    def has_keys(self):
+        return self.key_table is not None or (self.keys is not None and len(self.keys[0]) > 0)
+
+    def missing_keys_error(self):
+        return (f'its foreign key to the "{self.referenced_table}" table ({", ".join(self.referenced_columns)}) is not '
+                f'nullable, but that table has no loaded keys to reference. Self-references and reference cycles '
+                f'can only be generated when the referencing columns are nullable')
+
+    def sample(self, rng, size, offset=0):
+        if not self.has_keys():
+            if self.nullable:
+                return [numpy.full(size, None, dtype=object) for _ in range(self.width)]
+            raise ValueError(self.missing_keys_error())
+
+        indexes = rng.integers(0, len(self.keys[0]), size)
+        if len(self.hot_indexes):
+            draws = rng.random(size)
+            hot_rows = draws < self.hot_cdf[-1]
+            indexes[hot_rows] = self.hot_indexes[numpy.searchsorted(self.hot_cdf, draws[hot_rows], side='right')]
+
+        columns = [key_values[indexes] for key_values in self.keys]
+        if self.null_frac:
+            null_rows = rng.random(size) < self.null_frac
+            columns = [column.astype(object) for column in columns]
+            for column in columns:
+                column[null_rows] = None
+
+        return columns
+
+    def sql_expressions(self, query):
+        if self.key_table is None:
+            if self.nullable:
+                return [sql.NULL for _ in range(self.width)]
+            raise ValueError(self.missing_keys_error())
+
+        key_count = sql.Literal(self.key_count)
+        indexes = sql.SQL("floor({} * {})::bigint").format(query.draw(), key_count)
+        if len(self.hot_cdf):
+            draw = query.draw()
+            hot_indexes = self.hot_permutation.sql_expression(sql.SQL("width_bucket({}, {})").format(
+                draw, float_array_sql(self.hot_cdf)))
+            indexes = sql.SQL("(CASE WHEN {} < {} THEN {} % {} ELSE {} END)").format(
+                draw, sql.Literal(float(self.hot_cdf[-1])), hot_indexes, key_count, indexes)
+
+        columns = [sql.SQL("(SELECT {} FROM {} WHERE i = {})").format(
+            sql.Identifier(f'a{index}'), sql.Identifier(*self.key_table), indexes) for index in range(self.width)]
+        if self.null_frac:
+            # All the columns of a key are NULL together
+            draw = query.draw()
+            columns = [sql.SQL("CASE WHEN {} < {} THEN NULL ELSE {} END").format(
+                draw, sql.Literal(float(self.null_frac)), column) for column in columns]
+
+        return columns
+
+
+def sample_columns(column_samplers, rng, size, offset=0):
+    columns = list()
+    for column_sampler in column_samplers:
+        # Samplers with a width produce the vectors of several columns at once
+        if hasattr(column_sampler, 'width'):
+            columns.extend(column_sampler.sample(rng, size, offset))
+        else:
+            columns.append(column_sampler.sample(rng, size, offset))
+
+    return columns
+
+
+def sample_rows(column_samplers, rng, size, offset=0):
+    return zip(*[column.tolist() for column in sample_columns(column_samplers, rng, size, offset)])
+
+
+def sql_expressions(column_samplers, query):
+    expressions = list()
+    for column_sampler in column_samplers:
+        if hasattr(column_sampler, 'width'):
+            expressions.extend(column_sampler.sql_expressions(query))
+        else:
+            expressions.append(column_sampler.sql_expression(query))
+
+    return expressions
@@ -0,0 +1,103 @@
+import sys
+
+import psycopg2
+from psycopg2 import sql
+
+import samplers
+
+# Helper functions of the generated queries. They live in the session's temporary schema,
+# so nothing is left behind in the target database
+SERVER_FUNCTIONS = """
+    CREATE OR REPLACE FUNCTION pg_temp.pgsynthdata_quantile(bounds float8[], fraction float8)
+    RETURNS float8 AS $$
+        SELECT bounds[bucket] + (position - bucket + 1) * (bounds[bucket + 1] - bounds[bucket])
+        FROM  (SELECT position, least(floor(position)::int + 1, array_length(bounds, 1) - 1) AS bucket
+               FROM  (SELECT fraction * (array_length(bounds, 1) - 1) AS position) p) b
+    $$ LANGUAGE sql IMMUTABLE;"""
+
+# The numbered keys of the referenced tables, kept for the run in unlogged tables of the target database
+KEY_SCHEMA = 'pgsynthdata_keys'
+
+
+# Collects the per-row random draws that the column expressions use
+class InsertQuery:
+    def __init__(self):
+        self.offset = sql.SQL("g.i")
+        self.draw_count = 0
+
+    def draw(self):
+        self.draw_count += 1
+        return sql.Identifier('d', f'r{self.draw_count}')
+
+    def compose(self, identifier, column_names, expressions, offset, rows):
+        sources = [sql.SQL("generate_series({}, {}) AS g(i)").format(sql.Literal(offset),
+                                                                       sql.Literal(offset + rows - 1))]
+        if self.draw_count:
+            # The draws are referenced several times by some expressions, so they are drawn once per row
+            # in a lateral subquery, which OFFSET 0 keeps from being flattened into the query
+            draws = [sql.SQL("random() AS {}").format(sql.Identifier(f'r{index}'))
+                     for index in range(1, self.draw_count + 1)]
+            sources.append(sql.SQL("LATERAL (SELECT {} WHERE g.i IS NOT NULL OFFSET 0) AS d").format(
+                sql.SQL(', ').join(draws)))
+
+        # The generated values replace the values of identity columns, like COPY does
+        return sql.SQL("INSERT INTO {} ({}) OVERRIDING SYSTEM VALUE SELECT {} FROM {}").format(
+            sql.Identifier(*identifier),
+            sql.SQL(', ').join(sql.Identifier(column_name) for column_name in column_names),
+            sql.SQL(', ').join(expressions),
+            sql.SQL(' CROSS JOIN ').join(sources))
+
+
+def create_functions(cursor):
+    cursor.execute(SERVER_FUNCTIONS)
+
+
+# Numbers the keys of a referenced table once, in their order, so that the insert queries of every chunk
+# look the keys up by their number instead of collecting the whole table again. Returns the number of keys
+def create_key_table(connection, key_table, identifier, column_names):
+    key_columns = sql.SQL(', ').join(sql.Identifier(column_name) for column_name in column_names)
+    key_table_identifier = sql.Identifier(KEY_SCHEMA, key_table)
+
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql.SQL("CREATE SCHEMA IF NOT EXISTS {}").format(sql.Identifier(KEY_SCHEMA)))
+            cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(key_table_identifier))
+            cursor.execute(sql.SQL("CREATE UNLOGGED TABLE {} AS SELECT row_number() OVER (ORDER BY {}) - 1 AS i, {} "
+                                   "FROM {}").format(
+                key_table_identifier, key_columns,
+                sql.SQL(', ').join(sql.SQL("{} AS {}").format(sql.Identifier(column_name), sql.Identifier(f'a{index}'))
+                                   for index, column_name in enumerate(column_names)),
+                sql.Identifier(*identifier)))
+            cursor.execute(sql.SQL("ALTER TABLE {} ADD PRIMARY KEY (i)").format(key_table_identifier))
+            cursor.execute(sql.SQL("ANALYZE {}").format(key_table_identifier))
+            cursor.execute(sql.SQL("SELECT count(*) FROM {}").format(key_table_identifier))
+            key_count = cursor.fetchone()[0]
+        connection.commit()
+    except psycopg2.DatabaseError as error:
+        sys.exit('Could not number the keys of the "{0}" table. Error description: {1}'.format(
+            '.'.join(identifier), error))
+
+    return key_count
+
+
+def drop_key_tables(connection):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql.SQL("DROP SCHEMA IF EXISTS {} CASCADE").format(sql.Identifier(KEY_SCHEMA)))
+        connection.commit()
+    except psycopg2.DatabaseError as error:
+        print('Could not drop the numbered keys. Error description: {0}'.format(error))
+
+
+# Generates the rows of one chunk inside the database: only the column model is sent to the server.
+# Returns the size of the query
+def insert_rows(cursor, table_model, offset, rows, rng):
+    query = InsertQuery()
+    expressions = samplers.sql_expressions(table_model["column_samplers"], query)
+    query_text = query.compose(table_model["load_identifier"], table_model["column_names"], expressions,
+                               offset, rows).as_string(cursor)
+
+    cursor.execute("SELECT setseed(%s)", (float(rng.uniform(-1, 1)),))
+    cursor.execute(query_text)
+
+    return len(query_text.encode('utf-8'))
@@ -0,0 +1,114 @@
+import bisect
+import datetime
+import sys
+import threading
+import zlib
+
+import numpy
+import psycopg2
+from psycopg2.extensions import parse_dsn
+
+import copy_stream
+import postgres
+
+SHARD_MODES = ['replicate', 'hash', 'range']
+
+
+# The settings of every target: the DSN's own values win over the connection options of the command line
+def target_settings(targets, user=None, host=None, port=None, password=None):
+    defaults = {key: value for key, value in dict(user=user, host=host, port=port, password=password).items()
+                if value is not None}
+
+    settings = list()
+    for target in targets:
+        try:
+            settings.append(dict(defaults, **parse_dsn(target)))
+        except psycopg2.ProgrammingError as error:
+            sys.exit('The target "{0}" is not a valid connection string. Error: {1}'.format(target, error))
+
+    return settings
+
+
+def target_name(settings):
+    return '{0}@{1}:{2}'.format(settings.get("dbname"), settings.get("host", 'localhost'), settings.get("port", 5432))
+
+
+# Returns a function that gives the target of every row of a batch of columns, or None if the table
+# is replicated to all the targets. Tables without the shard column are replicated, like reference tables
+def create_router(table_model, sharding, target_count):
+    if sharding["mode"] == 'replicate' or sharding["column"] not in table_model["column_names"]:
+        return None
+
+    column_index = table_model["column_names"].index(sharding["column"])
+    if sharding["mode"] == 'hash':
+        return lambda columns: hash_targets(columns[column_index], target_count)
+
+    bounds = parse_bounds(sharding["bounds"], table_model["column_types"][column_index])
+    return lambda columns: range_targets(columns[column_index], bounds)
+
+
+# The hash of a value is taken from its COPY text, so that it does not depend on the Python type of the value.
+# NULLs go to the first target
+def hash_targets(values, target_count):
+    return numpy.array([zlib.crc32(copy_stream.encode_value(value).encode('utf-8')) % target_count
+                        if value is not None else 0 for value in values.tolist()], dtype=int)
+
+
+# Target i gets the values from bound i - 1 (inclusive) to bound i (exclusive). NULLs go to the first target
+def range_targets(values, bounds):
+    return numpy.array([bisect.bisect_right(bounds, value) if value is not None else 0
+                        for value in values.tolist()], dtype=int)
+
+
+def check_bounds(table_models, sharding):
+    for table_model in table_models:
+        if sharding["mode"] == 'range' and sharding["column"] in table_model["column_names"]:
+            column_type = table_model["column_types"][table_model["column_names"].index(sharding["column"])]
+            bounds = parse_bounds(sharding["bounds"], column_type)
+            if bounds != sorted(bounds):
+                sys.exit('The shard bounds {0} of the "{1}" table are not in ascending order.'.format(
+                    sharding["bounds"], table_model["table_name"]))
+
+
+def parse_bounds(bounds, column_type):
+    try:
+        if column_type in postgres.DataTypes.NUMERIC_TYPES:
+            return [float(bound) for bound in bounds]
+        elif column_type == 'date':
+            return [datetime.date.fromisoformat(bound) for bound in bounds]
+        elif column_type in postgres.DataTypes.DATE_TYPES:
+            return [datetime.datetime.fromisoformat(bound) for bound in bounds]
+    except ValueError as error:
+        sys.exit('The shard bounds {0} are not valid {1} values. Error: {2}'.format(bounds, column_type, error))
+
+    return list(bounds)
+
+
+# Copies the batches of a chunk into all the targets at once, each through its own connection and COPY.
+# The batches are generated once and routed to the targets by a single producer, see FanOutCopyStreams.
+# Returns the sent bytes and the first error, the caller commits or rolls back the connections
+def copy_batches(connections, table_model, batches, route, queue_depth):
+    errors = list()
+
+    with copy_stream.FanOutCopyStreams(batches, route, len(connections), queue_depth) as fan_out:
+        def copy_target(connection, stream):
+            try:
+                with connection.cursor() as cursor:
+                    postgres.copy_rows(cursor, *table_model["load_identifier"], table_model["column_names"], stream)
+            except Exception as error:
+                errors.append(error)
+                # The other COPYs are aborted as well, the chunk is rolled back on every target
+                fan_out.cancel()
+
+        threads = [threading.Thread(target=copy_target, args=(connection, stream))
+                   for connection, stream in zip(connections, fan_out.streams)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    sent_bytes = sum(stream.sent_bytes for stream in fan_out.streams)
+    first_error = next((error for error in errors if not isinstance(error, copy_stream.CopyCancelled)),
+                       errors[0] if errors else None)
+
+    return sent_bytes, first_error
@@ -0,0 +1,67 @@
+import gzip
+import hashlib
+import json
+import sys
+
+SNAPSHOT_VERSION = 4
+
+
+def save_snapshot(stats_path, table_information, fingerprints, exact_stats):
+    try:
+        with open(stats_path, 'wb') as snapshot_file:
+            snapshot_file.write(encode_snapshot(table_information, fingerprints, exact_stats))
+    except OSError as error:
+        sys.exit('The statistics snapshot "{0}" could not be saved. Error: {1}'.format(stats_path, error))
+
+
+def load_snapshot(stats_path):
+    try:
+        with open(stats_path, 'rb') as snapshot_file:
+            return decode_snapshot(snapshot_file.read())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as error:
+        print(f'The statistics snapshot "{stats_path}" could not be read. Error: {error}')
+        return None
+
+
+def encode_snapshot(table_information, fingerprints, exact_stats):
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "exact_stats": exact_stats,
+        "fingerprints": fingerprints,
+        "table_information": table_information
+    }
+
+    # Exact value ranges are read as decimals, which are stored as plain numbers
+    return gzip.compress(json.dumps(snapshot, separators=(',', ':'), default=float).encode('utf-8'))
+
+
+# The table information as a run generates from it, the same whether it was read from the database or from
+# a snapshot: decimals become plain numbers and tuples become lists
+def normalize_table_information(table_information):
+    return json.loads(json.dumps(table_information, default=float))
+
+
+# Identifies the statistics of a run without holding any of their values
+def statistics_fingerprint(table_information):
+    return hashlib.sha256(json.dumps(table_information, sort_keys=True, separators=(',', ':'),
+                                     default=float).encode('utf-8')).hexdigest()
+
+
+# Raises an OSError or a ValueError if the data is not a gzipped snapshot
+def decode_snapshot(data):
+    snapshot = json.loads(gzip.decompress(data).decode('utf-8'))
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        return None
+
+    return snapshot
+
+
+def is_table_fresh(snapshot, table_name, fingerprint, exact_stats):
+    if table_name not in snapshot["table_information"]:
+        return False
+    if exact_stats and not snapshot["exact_stats"]:
+        return False
+
+    return snapshot["fingerprints"].get(table_name) == fingerprint
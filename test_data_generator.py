@@ -0,0 +1,255 @@
+import gzip
+
+import numpy
+import pytest
+
+import checkpoints
+import data_generator
+import samplers
+import stats_snapshot
+from data_generator import DataGenerator
+
+SEED = 1
+
+
+# The statistics of a table with a single column, like read_statistics collects them
+def single_column_table(column_info, column_stats, row_count, unique=False):
+    column_name = column_info["column_name"]
+    return {
+        "public.sample": {
+            "identifier": ('public', 'sample'),
+            "column_information": {column_name: column_info},
+            "pg_stats": {column_name: dict(column_stats, column_name=column_name)},
+            "foreign_keys": [],
+            "partition_levels": [],
+            "unique_keys": [{"primary_key": True, "column_names": [column_name]}] if unique else [],
+            "row_count": row_count,
+            "value_ranges": {}
+        }
+    }
+
+
+def generate_column(table_information, multiplication_factor):
+    generator = DataGenerator()
+    generator.table_information = table_information
+    generator.seed = SEED
+    table_model = generator.create_table_model(multiplication_factor, 'public.sample')
+
+    values = list()
+    for chunk_index, (chunk_offset, chunk_rows) in enumerate(table_model["chunks"]):
+        rng = data_generator.create_rng(SEED, 'public.sample', *table_model["chunk_stream"], chunk_index)
+        for columns in data_generator.generate_batches(table_model["column_samplers"], chunk_rows, rng, chunk_offset):
+            values.extend(columns[0].tolist())
+
+    return table_model, values
+
+
+def short_code_table(max_length):
+    column_info = dict(column_name='code', data_type='character varying', max_length=max_length, nullable=False)
+    column_stats = dict(null_frac=0.0, avg_width=3, n_distinct=-1.0, most_common_vals=None, most_common_freqs=None,
+                        histogram_bounds=['AA', 'BM', 'DZ', 'KQ', 'ZZ'], correlation=0.1)
+
+    return single_column_table(column_info, column_stats, 600, unique=True)
+
+
+def test_short_varchar_key_stays_unique_at_a_large_mf():
+    _, values = generate_column(short_code_table(8), 100)
+
+    assert len(values) == 60000
+    assert len(set(values)) == len(values)
+    assert max(len(value) for value in values) <= 8
+
+
+def test_key_spelling_does_not_depend_on_the_mf():
+    _, small_values = generate_column(short_code_table(8), 3)
+    _, large_values = generate_column(short_code_table(8), 100)
+
+    assert large_values[:len(small_values)] == small_values
+
+
+def test_key_that_does_not_fit_its_column_is_sampled():
+    table_model, _ = generate_column(short_code_table(3), 100)
+
+    assert not isinstance(table_model["column_samplers"][0], samplers.KeySampler)
+
+
+
+def test_hash_partitions_share_one_key_space():
+    table_information = dict()
+    for remainder in range(2):
+        partition = single_column_table(
+            dict(column_name='id', data_type='integer', numeric_precision=32, numeric_precision_radix=2,
+                 numeric_scale=0, nullable=False),
+            dict(null_frac=0.0, avg_width=4, n_distinct=-1.0, most_common_vals=None, most_common_freqs=None,
+                 histogram_bounds=['1', '500', '1000'], correlation=0.1), 500, unique=True)["public.sample"]
+        partition["identifier"] = ('public', f'hp{remainder}')
+        partition["partition_levels"] = [dict(parent='public.hp', parent_identifier=('public', 'hp'), column_name='id',
+                                              bound=dict(strategy='hash'))]
+        table_information[f'public.hp{remainder}'] = partition
+
+    generator = DataGenerator()
+    generator.table_information = table_information
+    generator.seed = SEED
+
+    partition_keys = list()
+    for table_name in table_information:
+        table_model = generator.create_table_model(5, table_name)
+        assert table_model["load_identifier"] == ('public', 'hp')
+
+        rng = data_generator.create_rng(SEED, table_name, *table_model["chunk_stream"], 0)
+        columns = next(data_generator.generate_batches(table_model["column_samplers"], 2500, rng))
+        partition_keys.append(set(columns[0].tolist()))
+
+    assert all(len(keys) == 2500 for keys in partition_keys)
+    assert not partition_keys[0] & partition_keys[1]
+
+
+class FailingSampler:
+    def sample(self, rng, size, offset=0):
+        raise ValueError('the sampler failed')
+
+
+def test_chunk_errors_fail_their_table_instead_of_the_run(tmp_path):
+    generator = DataGenerator()
+    generator.table_information = short_code_table(8)
+    generator.seed = SEED
+    table_model = generator.create_table_model(1, 'public.sample')
+    table_model["column_samplers"] = [FailingSampler()]
+
+    load_settings = dict(server_side=False, queue_depth=0, checkpoint=False, pool_size=1, targets=None,
+                         output=dict(directory=str(tmp_path), format='csv', compression=None))
+    results = list(data_generator.load_chunks([table_model], None, load_settings, SEED, 1))
+
+    assert [(table_name, chunk_rows, error) for table_name, chunk_rows, error, _ in results] == \
+        [('public.sample', 0, 'the sampler failed')]
+
+
+def test_narrow_integer_range_reaches_its_distinct_values():
+    column_info = dict(column_name='level', data_type='integer', numeric_precision=32, numeric_precision_radix=2,
+                       numeric_scale=0, nullable=False)
+    column_stats = dict(null_frac=0.0, avg_width=4, n_distinct=500.0, most_common_vals=None, most_common_freqs=None,
+                        histogram_bounds=[str(bound) for bound in range(0, 101, 10)], correlation=0.0)
+
+    _, values = generate_column(single_column_table(column_info, column_stats, 10000), 1)
+
+    assert len(set(values)) == 101
+    assert min(values) >= 0 and max(values) <= 100
+
+
+# Binary parameters are unpacked, a compressed snapshot would hide the values it holds
+def written_value(parameter):
+    parameter = getattr(parameter, 'adapted', parameter)
+    if isinstance(parameter, (bytes, memoryview)):
+        return gzip.decompress(bytes(parameter)).decode('utf-8')
+
+    return str(parameter)
+
+
+# Records what a run writes into the generated database
+class RecordingConnection:
+    def __init__(self):
+        self.written = list()
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def execute(self, query, parameters=()):
+        self.written.append((str(query), [written_value(parameter) for parameter in parameters]))
+
+    def commit(self):
+        pass
+
+
+def test_checkpoint_keeps_no_source_values():
+    column_info = dict(column_name='last_name', data_type='text', nullable=False)
+    column_stats = dict(null_frac=0.0, avg_width=6, n_distinct=-0.5, most_common_vals=['Smith', 'Kim'],
+                        most_common_freqs=[0.2, 0.1], histogram_bounds=['Adams', 'Lee', 'Zhou'], correlation=0.0)
+    table_information = stats_snapshot.normalize_table_information(
+        single_column_table(column_info, column_stats, 1000))
+
+    connection = RecordingConnection()
+    checkpoints.save_run(connection, SEED, dict(mf=1, tables=None, server_side=False, exact_stats=False),
+                         stats_snapshot.statistics_fingerprint(table_information))
+    checkpoints.finish_run(connection)
+
+    written = repr(connection.written)
+    assert not any(value in written for value in ['Smith', 'Kim', 'Adams', 'Lee', 'Zhou'])
+
+
+def partition_key_table(column_info, histogram_bounds, row_count, bound):
+    column_stats = dict(null_frac=0.0, avg_width=4, n_distinct=-1.0, most_common_vals=None, most_common_freqs=None,
+                        histogram_bounds=histogram_bounds, correlation=0.1)
+    table_information = single_column_table(column_info, column_stats, row_count, unique=True)
+    table_information["public.sample"]["partition_levels"] = [
+        dict(parent='public.parent', parent_identifier=('public', 'parent'), column_name=column_info["column_name"],
+             bound=bound)]
+
+    return table_information
+
+
+def test_list_partition_keys_stay_within_the_listed_values():
+    column_info = dict(column_name='code', data_type='text', nullable=False)
+    table_information = partition_key_table(column_info, ['AAAA', 'BBBB'], 2,
+                                            dict(strategy='list', values=['AAAA', 'BBBB', 'CCCC']))
+
+    table_model, values = generate_column(table_information, 1)
+
+    assert table_model["load_identifier"] == ('public', 'sample')
+    assert sorted(values) == ['AAAA', 'BBBB']
+
+    # Four keys do not fit the three listed values, the table is not generated at all
+    generator = DataGenerator()
+    generator.table_information = table_information
+    generator.seed = SEED
+    assert generator.create_table_model(2, 'public.sample') is None
+
+
+def test_range_partition_keys_stay_within_the_range():
+    column_info = dict(column_name='id', data_type='integer', numeric_precision=32, numeric_precision_radix=2,
+                       numeric_scale=0, nullable=False)
+    table_information = partition_key_table(column_info, ['1000', '1200', '1500'], 500,
+                                            dict(strategy='range', lower='1000', upper='2000'))
+
+    table_model, values = generate_column(table_information, 2)
+
+    assert table_model["load_identifier"] == ('public', 'sample')
+    assert len(set(values)) == 1000
+    assert min(values) >= 1000 and max(values) < 2000
+
+
+def test_word_domain_counts_only_the_words_it_can_spell():
+    domain = samplers.WordDomain(1, 100, shapes=['upper', 'capitalized'], max_length=1)
+    words = domain.values(numpy.arange(domain.size)).tolist()
+
+    assert domain.size == 26
+    assert len(set(words)) == len(words)
+
+
+def test_self_reference_that_is_not_nullable_fails_its_table():
+    column_info = dict(column_name='id', data_type='integer', numeric_precision=32, numeric_precision_radix=2,
+                       numeric_scale=0, nullable=False)
+    column_stats = dict(null_frac=0.0, avg_width=4, n_distinct=-1.0, most_common_vals=None, most_common_freqs=None,
+                        histogram_bounds=['1', '500', '1000'], correlation=1.0)
+    table_information = single_column_table(column_info, column_stats, 1000, unique=True)
+    table = table_information["public.sample"]
+    table["column_information"]["boss_id"] = dict(column_info, column_name='boss_id')
+    table["pg_stats"]["boss_id"] = dict(column_stats, column_name='boss_id', n_distinct=-0.1)
+    table["foreign_keys"] = [dict(column_names=['boss_id'], referenced_table='public.sample',
+                                  referenced_identifier=('public', 'sample'), referenced_columns=['id'])]
+
+    generator = DataGenerator()
+    generator.table_information = table_information
+    generator.seed = SEED
+    table_model = generator.create_table_model(1, 'public.sample')
+
+    unloadable_tables = generator.attach_foreign_keys(None, [table_model], {'public.sample': 1}, [table_model])
+
+    assert list(unloadable_tables) == ['public.sample']
+    with pytest.raises(ValueError):
+        samplers.sample_columns(table_model["column_samplers"], data_generator.create_rng(SEED, 'public.sample'), 10)